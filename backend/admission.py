@@ -0,0 +1,166 @@
+"""
+Daily-limit admission control for /wallet/earn.
+
+Users who have hit ``daily_earning_limit`` tend to keep retrying. This layer
+remembers each user's committed daily earnings and limit, so those retries
+are turned away without touching the database.
+
+The table is a fixed array of ``EARN_ADMISSION_SLOTS`` 32-byte slots,
+addressed by a hash of the user id:
+
+    fingerprint u64 | reset u64 | day u32 | earned i32 | limit i32 | check u32
+
+* ``day`` is the UTC day the slot was written. Slots from earlier days are
+  ignored, so the whole table resets at midnight without a sweep.
+* ``reset`` is ``last_earning_reset`` in epoch microseconds. A write never
+  replaces a slot with an older reset, or with lower earnings under the
+  same reset, so a late resync cannot undo a newer one.
+* ``check`` covers the other fields. A slot torn by a concurrent write from
+  another process fails the check and reads as a miss.
+
+The database stays the source of truth. The layer only rejects an earn the
+wallet row would reject too. Misses, collisions and stale or torn slots
+all fall through to the normal wallet read. Slots are resynced from every
+committed ``UserWallet`` change and from wallet reads that reject an earn.
+
+With ``EARN_ADMISSION_SHARED`` the table is an anonymous shared mapping.
+It is allocated at import, so it must be created before gunicorn forks its
+workers (``preload_app``); every worker then reads and writes the same
+slots. Otherwise each process has its own table.
+"""
+
+from datetime import datetime, timedelta, timezone
+import hashlib
+import mmap
+import os
+import struct
+import time
+import uuid
+
+from sqlalchemy import event
+
+from models import UserWallet
+from models.routing_session import RoutingSession
+
+EARN_ADMISSION_ENABLED = os.getenv('EARN_ADMISSION_ENABLED', 'true').lower() == 'true'
+EARN_ADMISSION_SLOTS = int(os.getenv('EARN_ADMISSION_SLOTS', '262144'))
+EARN_ADMISSION_SHARED = os.getenv('EARN_ADMISSION_SHARED', 'false').lower() == 'true'
+
+SLOT = struct.Struct('<QQIiiI')
+CHECK_MASK = (1 << 32) - 1
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _fingerprint(user_id):
+    """64-bit hash of a user id, or None for ids that are not UUIDs"""
+    try:
+        key = user_id.bytes if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id)).bytes
+    except ValueError:
+        return None
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+def _check(fingerprint, reset, day, earned, limit):
+    return hash((fingerprint, reset, day, earned, limit)) & CHECK_MASK
+
+
+def _epoch_micros(value):
+    if value is None:
+        return 0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def utc_day(now=None):
+    return int((time.time() if now is None else now) // 86400)
+
+
+class EarnAdmission:
+    def __init__(self, slots=EARN_ADMISSION_SLOTS, shared=EARN_ADMISSION_SHARED):
+        self.slots = max(1, slots)
+        self.shared = shared
+        size = self.slots * SLOT.size
+        self._table = mmap.mmap(-1, size) if shared else bytearray(size)
+        self.metrics = {"admitted": 0, "rejected": 0, "misses": 0, "resyncs": 0}
+
+    def _read(self, fingerprint, today):
+        """(reset, earned, limit) for a live slot of this user, else None"""
+        offset = fingerprint % self.slots * SLOT.size
+        stored, reset, day, earned, limit, check = SLOT.unpack_from(self._table, offset)
+        if stored != fingerprint or day != today or check != _check(stored, reset, day, earned, limit):
+            return None
+        return reset, earned, limit
+
+    def admit(self, user_id, amount):
+        """False only if the committed state already puts this earn over the limit"""
+        fingerprint = _fingerprint(user_id)
+        entry = self._read(fingerprint, utc_day()) if fingerprint else None
+        if entry is None:
+            self.metrics["misses"] += 1
+            return True
+        _, earned, limit = entry
+        if earned + amount > limit:
+            self.metrics["rejected"] += 1
+            return False
+        self.metrics["admitted"] += 1
+        return True
+
+    def observe(self, user_id, daily_earnings, daily_earning_limit, last_earning_reset):
+        """Record a user's committed daily state as read from (or written to) the database"""
+        fingerprint = _fingerprint(user_id)
+        if not fingerprint:
+            return
+        today = utc_day()
+        reset = _epoch_micros(last_earning_reset)
+        earned, limit = daily_earnings or 0, daily_earning_limit or 0
+        current = self._read(fingerprint, today)
+        if current is not None and (reset, earned) < current[:2]:
+            return  # older than what is already recorded
+        SLOT.pack_into(self._table, fingerprint % self.slots * SLOT.size,
+                       fingerprint, reset, today, earned, limit, _check(fingerprint, reset, today, earned, limit))
+        self.metrics["resyncs"] += 1
+
+    def observe_wallet(self, wallet):
+        self.observe(wallet.user_id, wallet.daily_earnings, wallet.daily_earning_limit, wallet.last_earning_reset)
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "shared": self.shared,
+            "slots": self.slots,
+            "table_bytes": self.slots * SLOT.size,
+            **self.metrics,
+        }
+
+
+earn_admission = None
+
+
+def init_earn_admission():
+    global earn_admission
+    earn_admission = EarnAdmission() if EARN_ADMISSION_ENABLED else None
+    return earn_admission
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_wallet_changes(session, flush_context):
+    if earn_admission is None:
+        return
+    changed = {obj.user_id: (obj.daily_earnings, obj.daily_earning_limit, obj.last_earning_reset)
+               for obj in (*session.new, *session.dirty) if isinstance(obj, UserWallet)}
+    if changed:
+        session.info.setdefault('admission_changes', {}).update(changed)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _resync_wallet_changes(session):
+    changed = session.info.pop('admission_changes', None)
+    if changed and earn_admission is not None:
+        for user_id, state in changed.items():
+            earn_admission.observe(user_id, *state)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_wallet_changes(session):
+    session.info.pop('admission_changes', None)
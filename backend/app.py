@@ -1,64 +1,132 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Blueprint, current_app, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-from models import db, User, UserWallet, WalletTransaction, VirtualProduct, ProductPurchase, UserInventory, EventTokenBalance, ExchangeRate
+from models import db, User, UserWallet, WalletTransaction, VirtualProduct, ProductPurchase, UserInventory, EventTokenBalance, ExchangeRate, ProductRefundJob
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from uuid import UUID as PyUUID
+from uuid import UUID as PyUUID, uuid4
+from sqlalchemy.engine import make_url
+from exports import parse_time_range, stream_ndjson
+from replica import configure_replica, read_replica, use_primary, READ_YOUR_WRITES_HEADER
+from sharding import (configure_shards, create_shard_schemas, shards_enabled, shard_for, use_shard, user_shard,
+                      group_by_shard, common_shard, scatter)
+from transfers import validate_transfer, transfer_funds, bulk_transfer
+from earn_coalescer import EarnCoalescer, EARN_COALESCE_ENABLED
+from rollups import parse_day_range, user_stats, global_stats
+from leaderboard import init_leaderboard, LEADERBOARD_MAX_LIMIT
+from catalog_index import init_catalog_search, is_record_available, CATALOG_SEARCH_MAX_LIMIT
+from eligibility import init_eligible_catalog
+from refunds import start_refund_job, launch_refund_job
+from inventory_actions import validate_actions, apply_inventory_actions
+from loadouts import init_loadout_cache, LOADOUT_MAX_USERS
+from admission import init_earn_admission
+from change_feed import init_change_feed, stream_events, Subscription
+import read_queries
+from http_cache import conditional, init_compression
+from degraded import init_degraded_mode, serve_stale, breaker_stats, stale_cache
+from invalidation import init_invalidation_bus
+from write_paths import (create_user_with_wallet, ensure_wallet, note_new_wallets, reserve_stock, release_stock,
+                         note_stock_changes)
+from snapshots import parse_as_of, balance_as_of
+from xp import progress, validate_grants, grant_xp, LEAGUES, LEVEL_THRESHOLDS, MAX_XP_GRANTS
 import os
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+DB_SOCKET_TIMEOUT = int(os.getenv('DB_SOCKET_TIMEOUT', '60'))
 
-# Configuration - MySQL database
-# Construct database URI from environment variables
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
-    f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-)
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here-change-in-production')
+api = Blueprint('api', __name__)
 
-# Enable CORS for frontend communication
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Per-process services, set up by create_app()
+earn_coalescer = None
+earn_admission = None
+change_feed = None
+leaderboard = None
+catalog_search = None
+eligible_catalog = None
+loadout_cache = None
+invalidation_bus = None
 
-# Initialize database
-db.init_app(app)
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def database_url():
+    """DATABASE_URL, else a URL built from the DB_* variables.
+
+    The URL's scheme selects the backend: mysql+pymysql://, postgresql://
+    or sqlite:///.
+    """
+    return os.getenv('DATABASE_URL') or (
+        f"{os.getenv('DB_DRIVER', 'mysql+pymysql')}://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
+        f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    )
+
+
+def engine_options(url):
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {}
+    # Bound what statement timeouts can't: connecting, a dead socket, and
+    # waiting for a pooled connection
+    if backend == 'mysql':
+        connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT,
+                        "read_timeout": DB_SOCKET_TIMEOUT, "write_timeout": DB_SOCKET_TIMEOUT}
+    else:
+        connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+    # Per-process pool; serve.py sizes threads and workers to fit it
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+        "connect_args": connect_args
+    }
 
 
 # ============================================================================
 # DATABASE INITIALIZATION ON STARTUP
 # ============================================================================
 
-def init_db():
+def init_db(app):
     """Initialize database with tables and seed data"""
     with app.app_context():
         try:
             # Create all tables
             db.create_all()
+            create_shard_schemas()
             print("✅ Database tables created!")
             
-            # Create a default test user if none exists
-            test_user = db.session.query(User).filter_by(username='testuser').first()
-            if not test_user:
-                test_user = User(username='testuser', email='test@example.com')
-                db.session.add(test_user)
-                db.session.flush()
-                
-                # Create wallet for test user with some initial balance
-                test_wallet = UserWallet(
-                    user_id=test_user.id,
-                    sf_coins=12450,
-                    premium_gems=350,
-                    event_tokens=25,
-                    total_coins_earned=15000,
-                    total_coins_spent=2550,
-                    daily_earnings=450
-                )
-                db.session.add(test_wallet)
-                db.session.commit()
-                print(f"✅ Created test user with ID: {test_user.id}")
+            # Create a default test user if none exists (here or on any shard)
+            def test_user_exists():
+                return db.session.query(User.id).filter_by(username='testuser').first() is not None
+            
+            if not (test_user_exists() or shards_enabled() and any(scatter(test_user_exists).values())):
+                test_user_id = str(uuid4())
+                with use_shard(shard_for(test_user_id)):
+                    test_user = User(id=test_user_id, username='testuser', email='test@example.com')
+                    db.session.add(test_user)
+                    db.session.flush()
+                    
+                    # Create wallet for test user with some initial balance
+                    test_wallet = UserWallet(
+                        user_id=test_user.id,
+                        sf_coins=12450,
+                        premium_gems=350,
+                        event_tokens=25,
+                        total_coins_earned=15000,
+                        total_coins_spent=2550,
+                        daily_earnings=450
+                    )
+                    db.session.add(test_wallet)
+                    db.session.commit()
+                print(f"✅ Created test user with ID: {test_user_id}")
             else:
                 print("✅ Test user already exists")
                 
@@ -66,15 +134,11 @@ def init_db():
             print(f"⚠️ Database initialization error: {e}")
             db.session.rollback()
 
-# Initialize database before handling requests
-init_db()
-
-
 # ============================================================================
 # HEALTH & INFO ENDPOINTS
 # ============================================================================
 
-@app.route('/')
+@api.route('/')
 def index():
     return jsonify({
         "message": "SF Combined API - Virtual Product Store with Wallet System",
@@ -89,16 +153,23 @@ def index():
     }), 200
 
 
-@app.route('/health', methods=['GET'])
+@api.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok"}), 200
+    # Still 200 when degraded: the worker itself can serve
+    breakers = breaker_stats()
+    degraded = any(breaker["state"] != 'closed' for breaker in breakers.values())
+    return jsonify({
+        "status": "degraded" if degraded else "ok",
+        "databases": breakers,
+        "stale_cache": stale_cache.stats()
+    }), 200
 
 
 # ============================================================================
 # USER ENDPOINTS
 # ============================================================================
 
-@app.route('/users', methods=['POST'])
+@api.route('/users', methods=['POST'])
 def create_user():
     """Create a new user with wallet"""
     try:
@@ -109,33 +180,29 @@ def create_user():
         if not username or not email:
             return jsonify({"error": "Username and email are required"}), 400
         
-        # Check if user exists
-        existing_user = db.session.query(User).filter(
-            (User.username == username) | (User.email == email)
-        ).first()
-        
-        if existing_user:
-            return jsonify({"error": "User already exists"}), 400
-        
-        # Create user
-        user = User(username=username, email=email)
-        db.session.add(user)
-        db.session.flush()  # Get user ID
-        
-        # Create wallet for user
-        wallet = UserWallet(
-            user_id=user.id,
-            sf_coins=0,
-            premium_gems=0,
-            event_tokens=0
-        )
-        db.session.add(wallet)
-        db.session.commit()
+        # Unique indexes only cover one shard; ask the others first
+        if shards_enabled():
+            taken = scatter(lambda: db.session.query(User.id).filter(
+                db.or_(User.username == username, User.email == email)
+            ).first() is not None)
+            if any(taken.values()):
+                return jsonify({"error": "User already exists"}), 400
+        
+        # User and wallet in one round trip where the backend allows; a
+        # taken username or email is reported by the insert itself
+        user_id = str(uuid4())
+        with use_shard(shard_for(user_id)):
+            created = create_user_with_wallet(db.session, username, email, user_id=user_id)
+            if created is None:
+                db.session.rollback()
+                return jsonify({"error": "User already exists"}), 400
+            db.session.commit()
+        note_new_wallets([user_id])
         
         return jsonify({
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
+            "id": user_id,
+            "username": username,
+            "email": email,
             "wallet_created": True
         }), 201
         
@@ -144,7 +211,7 @@ def create_user():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/users/user_id', methods=['GET'])
+@api.route('/users/user_id', methods=['GET'])
 def get_user(user_id):
     """Get user information"""
     try:
@@ -163,21 +230,19 @@ def get_user(user_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/users', methods=['GET'])
+@api.route('/users', methods=['GET'])
 def list_users():
     """List all users"""
     try:
-        users = db.session.query(User).all()
-        return jsonify({
-            "users": [
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                    "is_active": user.is_active
-                } for user in users
-            ]
-        }), 200
+        users = scatter(lambda: [
+            {
+                "id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "is_active": user.is_active
+            } for user in db.session.query(User).all()
+        ])
+        return jsonify({"users": [user for shard_users in users.values() for user in shard_users]}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -186,60 +251,109 @@ def list_users():
 # WALLET ENDPOINTS
 # ============================================================================
 
-@app.route('/wallet/balance/<user_id>', methods=['GET'])
+@api.route('/wallet/balance/<user_id>', methods=['GET'])
+@serve_stale
+@user_shard
+@read_replica
+@conditional(read_queries.wallet_version)
 def get_wallet_balance(user_id):
-    """Get wallet balance for a user"""
+    """Get wallet balance for a user, now or at ?as_of= (ISO-8601 time or date)"""
     try:
         # Convert string to UUID
         user_uuid = PyUUID(user_id)
         
-        wallet = db.session.query(UserWallet).filter_by(user_id=user_uuid).first()
-        """if not wallet:
-            return jsonify({"error": "Wallet not found"}), 404"""
+        if request.args.get('as_of'):
+            return get_wallet_balance_as_of(str(user_uuid), request.args['as_of'])
         
-        if not wallet:
-            # Create a default wallet if not found
-            wallet = UserWallet(
-                user_id=user_uuid,
-                sf_coins=0,
-                premium_gems=0,
-                event_tokens=0,
-                total_coins_earned=0,
-                total_coins_spent=0,
-                daily_earnings=0,
-                daily_earning_limit=100  # or any default
-            )
-            db.session.add(wallet)
+        balance = read_queries.wallet_balance(str(user_uuid))
+        if balance:
+            return jsonify(balance._asdict()), 200
+        
+        # The replica may simply be behind; create a default wallet on the
+        # primary unless one exists (concurrent first reads create one wallet)
+        with use_primary():
+            ensure_wallet(db.session, user_uuid, daily_earning_limit=100)
             db.session.commit()
+            note_new_wallets([str(user_uuid)])
+            balance = read_queries.wallet_balance(str(user_uuid))
         
-        return jsonify({
-            "sf_coins": wallet.sf_coins,
-            "premium_gems": wallet.premium_gems,
-            "event_tokens": wallet.event_tokens,
-            "total_coins_earned": wallet.total_coins_earned,
-            "total_coins_spent": wallet.total_coins_spent,
-            "daily_earnings": wallet.daily_earnings,
-            "daily_earning_limit": wallet.daily_earning_limit
-        }), 200
+        return jsonify(balance._asdict()), 200
     except ValueError:
         return jsonify({"error": "Invalid user ID format"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def get_wallet_balance_as_of(user_id, as_of):
+    """Balances just after a point in time, from the nearest daily snapshot"""
+    try:
+        as_of = parse_as_of(as_of)
+    except ValueError:
+        return jsonify({"error": "as_of must be an ISO-8601 date or time"}), 400
+    
+    balance = balance_as_of(user_id, as_of)
+    if balance is None:
+        return jsonify({"error": "Wallet not found"}), 404
+    return jsonify(balance), 200
+
+
+MAX_BALANCE_BATCH = 5000
+
+
+@api.route('/wallet/balance/batch', methods=['POST'])
+@read_replica
+def get_wallet_balances():
+    """Get balances for many users; missing wallets are reported, not created"""
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({"error": "user_ids must be a non-empty list"}), 400
+    if len(user_ids) > MAX_BALANCE_BATCH:
+        return jsonify({"error": f"At most {MAX_BALANCE_BATCH} user_ids per request"}), 400
+    try:
+        user_ids = list(dict.fromkeys(str(PyUUID(str(user_id))) for user_id in user_ids))
+    except ValueError:
+        return jsonify({"error": "Invalid user ID format"}), 400
+    
+    try:
+        balances = {}
+        for shard, shard_user_ids in group_by_shard(user_ids).items():
+            with use_shard(shard):
+                balances.update(UserWallet.find_balances(shard_user_ids))
+                missing = [user_id for user_id in shard_user_ids if user_id not in balances]
+                if missing:
+                    # The replica may simply be behind; confirm on the primary
+                    with use_primary():
+                        balances.update(UserWallet.find_balances(missing))
+        missing = [user_id for user_id in user_ids if user_id not in balances]
+        
+        return jsonify({
+            "fields": ["sf_coins", "premium_gems", "event_tokens"],
+            "balances": balances,
+            "missing": missing
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 
-@app.route('/wallet/history/<user_id>', methods=['GET'])   
+@api.route('/wallet/history/<user_id>', methods=['GET'])   
+@user_shard
+@read_replica
+@conditional(read_queries.history_version)
 def get_wallet_history(user_id):
     """Get wallet transaction history"""
     try:
-        transactions = db.session.query(WalletTransaction).filter_by(user_id=user_id).order_by(WalletTransaction.created_at.desc()).all()
+        transactions = read_queries.wallet_history(user_id)
         
         if not transactions:
             return jsonify({"message": "No transactions found", "transactions": []}), 200
         
-        history = []
-        for transaction in transactions:
-            history.append({
+        history = [
+            {
                 "id": transaction.id,
                 "transaction_type": transaction.transaction_type,
                 "currency_type": transaction.currency_type,
@@ -248,7 +362,8 @@ def get_wallet_history(user_id):
                 "balance_after": transaction.balance_after,
                 "description": transaction.description,
                 "created_at": transaction.created_at.isoformat() if transaction.created_at else None
-            })
+            } for transaction in transactions
+        ]
         
         return jsonify({"transactions": history}), 200
         
@@ -256,7 +371,64 @@ def get_wallet_history(user_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/wallet/earn', methods=['POST'])
+@api.route('/wallet/stats/<user_id>', methods=['GET'])
+@user_shard
+@read_replica
+def get_wallet_stats(user_id):
+    """Per-day earned/spent totals for a user from the daily rollups"""
+    try:
+        start_day, end_day = parse_day_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        return jsonify({
+            "user_id": user_id,
+            "from": start_day.isoformat(),
+            "to": end_day.isoformat(),
+            **user_stats(user_id, start_day, end_day)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/wallet/stream/<user_id>', methods=['GET'])
+@user_shard
+def stream_wallet_changes(user_id):
+    """Server-sent events of the user's wallet transactions; resumes from Last-Event-ID"""
+    try:
+        user_uuid = str(PyUUID(user_id))
+    except ValueError:
+        return jsonify({"error": "Invalid user ID format"}), 400
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    # Subscribe before reading the backlog so nothing committed in between is missed
+    subscription = change_feed.subscribe(Subscription(user_uuid))
+    try:
+        backlog, resync = change_feed.replay(user_uuid, last_event_id) if last_event_id else ([], None)
+    except Exception as e:
+        change_feed.unsubscribe(subscription)
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        # Release the connection before the stream goes idle
+        db.session.remove()
+
+    return Response(
+        stream_events(change_feed, subscription, backlog or [], resync),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@api.route('/wallet/stream', methods=['GET'])
+def wallet_stream_stats():
+    """Open streams and deliveries in this worker"""
+    return jsonify(change_feed.stats()), 200
+
+
+@api.route('/wallet/earn', methods=['POST'])
+@user_shard
 def earn_coins():
     """Earn SF Coins"""
     try:
@@ -268,19 +440,30 @@ def earn_coins():
         if not user_id or amount <= 0:
             return jsonify({"error": "Invalid user_id or amount"}), 400
         
+        # Known to be over today's limit: reject without reading the wallet
+        if earn_admission and not earn_admission.admit(user_id, amount):
+            return jsonify({"error": "Daily earning limit exceeded"}), 400
+        
+        if data.get('coalesce') and earn_coalescer:
+            # Accepted into the write-behind buffer; credited on the next flush
+            pending = earn_coalescer.submit(user_id, amount, description)
+            return jsonify({
+                "message": "Coins accepted",
+                "pending_amount": pending
+            }), 202
+        
         wallet = db.session.query(UserWallet).filter_by(user_id=user_id).first()
         if not wallet:
             return jsonify({"error": "Wallet not found"}), 404
         
         # Check daily limit
         if wallet.daily_earnings + amount > wallet.daily_earning_limit:
+            if earn_admission:
+                earn_admission.observe_wallet(wallet)
             return jsonify({"error": "Daily earning limit exceeded"}), 400
         
-        # Record balance before
-        balance_before = wallet.sf_coins
-        
-        # Update wallet
-        wallet.earn_sf_coins(amount)
+        # Update wallet; the ledger row below is the only one
+        balance_before = wallet.credit_earning(amount)
         
         # Create transaction record
         transaction = WalletTransaction(
@@ -306,12 +489,31 @@ def earn_coins():
         
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/wallet/spend', methods=['POST'])
+@api.route('/wallet/earn/coalescer', methods=['GET'])
+def earn_coalescer_stats():
+    """Queue depth and flush lag of the earn coalescer"""
+    if not earn_coalescer:
+        return jsonify({"enabled": False}), 200
+    return jsonify(earn_coalescer.stats()), 200
+
+
+@api.route('/wallet/earn/admission', methods=['GET'])
+def earn_admission_stats():
+    """Hit and rejection counters of this worker's earn admission table"""
+    if not earn_admission:
+        return jsonify({"enabled": False}), 200
+    return jsonify(earn_admission.stats()), 200
+
+
+@api.route('/wallet/spend', methods=['POST'])
+@user_shard
 def spend_coins():
     """Spend SF Coins"""
     try:
@@ -331,12 +533,9 @@ def spend_coins():
         if wallet.sf_coins < amount:
             return jsonify({"error": "Insufficient SF Coins"}), 400
         
-        # Record balance before
-        balance_before = wallet.sf_coins
-        
-        # Update wallet
-        wallet.spend_sf_coins(amount)
-        
+        # Update wallet; the ledger row is recorded below
+        balance_before = wallet.debit('sf_coins', amount)
+
         # Create transaction record
         transaction = WalletTransaction(
             wallet_id=wallet.id,
@@ -365,7 +564,8 @@ def spend_coins():
         return jsonify({"error": str(e)}), 500
     
 
-@app.route('/wallet/refund', methods=['POST'])
+@api.route('/wallet/refund', methods=['POST'])
+@user_shard
 def refund_currency():
     """Refund currency"""
     data = request.get_json()
@@ -384,8 +584,8 @@ def refund_currency():
         return jsonify({"error": "currency_type is required"}), 400
     if not amount or amount <= 0:
         return jsonify({"error": "amount must be positive"}), 400
-    if currency_type not in ['sf_coins', 'sf_crystals']:
-        return jsonify({"error": "currency_type must be sf_coins or sf_crystals"}), 400
+    if currency_type not in ['sf_coins', 'premium_gems']:
+        return jsonify({"error": "currency_type must be sf_coins or premium_gems"}), 400
     
     try:
         wallet = UserWallet.query.filter_by(user_id=user_id).first()
@@ -393,11 +593,9 @@ def refund_currency():
             return jsonify({"error": "Wallet not found"}), 404
         
         if currency_type == 'sf_coins':
-            wallet.refund_sf_coins(amount)
-            new_balance = wallet.sf_coins_balance
+            new_balance = wallet.refund_sf_coins(amount)
         else:
-            wallet.refund_sf_crystals(amount)
-            new_balance = wallet.sf_crystals_balance
+            new_balance = wallet.refund_premium_gems(amount)
         
         db.session.commit()
         
@@ -414,7 +612,8 @@ def refund_currency():
         return jsonify({"error": str(e)}), 500
     
     
-@app.route('/wallet/grant', methods=['POST'])
+@api.route('/wallet/grant', methods=['POST'])
+@user_shard
 def grant_currency():
     """Admin: Grant currency to user"""
     data = request.get_json()
@@ -433,8 +632,8 @@ def grant_currency():
         return jsonify({"error": "currency_type is required"}), 400
     if not amount or amount <= 0:
         return jsonify({"error": "amount must be positive"}), 400
-    if currency_type not in ['sf_coins', 'sf_crystals']:
-        return jsonify({"error": "currency_type must be sf_coins or sf_crystals"}), 400
+    if currency_type not in ['sf_coins', 'premium_gems']:
+        return jsonify({"error": "currency_type must be sf_coins or premium_gems"}), 400
     
     try:
         wallet = UserWallet.query.filter_by(user_id=user_id).first()
@@ -442,22 +641,22 @@ def grant_currency():
             return jsonify({"error": "Wallet not found"}), 404
         
         if currency_type == 'sf_coins':
-            wallet.sf_coins_balance += amount
-            wallet.lifetime_earned += amount
+            balance_before = wallet.sf_coins
+            wallet.sf_coins += amount
+            wallet.total_coins_earned += amount
             WalletTransaction.record_transaction(
                 wallet_id=wallet.id,
-                user_id=user_id,
-                transaction_type="admin_grant",
+                user_id=wallet.user_id,
+                transaction_type="bonus",
                 currency_type="sf_coins",
                 amount=amount,
-                balance_before=wallet.sf_coins_balance - amount,
-                balance_after=wallet.sf_coins_balance,
+                balance_before=balance_before,
+                balance_after=wallet.sf_coins,
                 description=description
             )
-            new_balance = wallet.sf_coins_balance
+            new_balance = wallet.sf_coins
         else:
-            wallet.add_sf_crystals(amount)
-            new_balance = wallet.sf_crystals_balance
+            new_balance = wallet.add_premium_gems(amount)
         
         db.session.commit()
         
@@ -470,7 +669,8 @@ def grant_currency():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
-@app.route('/wallet/achievement', methods=['POST'])
+@api.route('/wallet/achievement', methods=['POST'])
+@user_shard
 def award_achievement():
     """Award achievement bonus"""
     data = request.get_json()
@@ -481,6 +681,7 @@ def award_achievement():
     user_id = data.get('user_id')
     amount = data.get('amount')
     achievement_name = data.get('achievement_name', 'Achievement')
+    achievement_id = data.get('achievement_id')
     
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
@@ -492,12 +693,14 @@ def award_achievement():
         if not wallet:
             return jsonify({"error": "Wallet not found"}), 404
         
+        if achievement_id:
+            wallet.user.add_achievement(str(achievement_id))
         wallet.award_achievement_bonus(amount)
         db.session.commit()
         
         return jsonify({
             "message": f"Awarded {amount} SF Coins for {achievement_name}",
-            "new_balance": wallet.sf_coins_balance
+            "new_balance": wallet.sf_coins
         }), 200
         
     except ValueError as e:
@@ -506,7 +709,7 @@ def award_achievement():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
-@app.route('/wallet/event-tokens/:user_id', methods=['GET'])
+@api.route('/wallet/event-tokens/:user_id', methods=['GET'])
 def get_event_tokens(user_id):
     """Get user's event token balances"""
     try:
@@ -531,7 +734,7 @@ def get_event_tokens(user_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
-@app.route('/wallet/reset-daily/user_id', methods=['POST'])
+@api.route('/wallet/reset-daily/user_id', methods=['POST'])
 def reset_daily_earnings(user_id):
     """Reset daily earnings counter"""
     try:
@@ -541,6 +744,8 @@ def reset_daily_earnings(user_id):
         
         wallet.update_daily_tracker()
         db.session.commit()
+        if earn_coalescer:
+            earn_coalescer.forget(user_id)
         
         return jsonify({
             "message": "Daily earnings reset",
@@ -552,15 +757,192 @@ def reset_daily_earnings(user_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+
+MAX_BULK_TRANSFERS = 500
+
+
+@api.route('/wallet/transfer', methods=['POST'])
+def transfer_currency():
+    """Transfer currency between two user wallets"""
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    try:
+        transfer = validate_transfer(data)
+        with use_shard(common_shard([transfer['from_user_id'], transfer['to_user_id']])):
+            result, attempts = transfer_funds(transfer)
+        
+        return jsonify({
+            "message": f"Transferred {transfer['amount']} {transfer['currency_type']}",
+            **result,
+            "attempts": attempts
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/wallet/transfer/bulk', methods=['POST'])
+def bulk_transfer_currency():
+    """Apply a list of transfers atomically (all succeed or none do)"""
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('transfers'), list) or not data['transfers']:
+        return jsonify({"error": "transfers must be a non-empty list"}), 400
+    if len(data['transfers']) > MAX_BULK_TRANSFERS:
+        return jsonify({"error": f"At most {MAX_BULK_TRANSFERS} transfers per request"}), 400
+    
+    try:
+        transfers = [validate_transfer(t) for t in data['transfers']]
+        shard = common_shard([user_id for t in transfers for user_id in (t['from_user_id'], t['to_user_id'])])
+        with use_shard(shard):
+            results, attempts = bulk_transfer(transfers)
+        
+        return jsonify({
+            "message": f"Completed {len(results)} transfers",
+            "transfers": results,
+            "attempts": attempts
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# ============================================================================
+# LEADERBOARD ENDPOINTS
+# ============================================================================
+
+@api.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Top users by a wallet metric"""
+    metric = request.args.get('metric', 'total_coins_earned')
+    limit = request.args.get('limit', 100, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    if metric not in leaderboard.metrics:
+        return jsonify({"error": f"metric must be one of {', '.join(leaderboard.metrics)}"}), 400
+    if limit <= 0 or limit > LEADERBOARD_MAX_LIMIT or offset < 0:
+        return jsonify({"error": f"limit must be 1-{LEADERBOARD_MAX_LIMIT} and offset non-negative"}), 400
+    
+    try:
+        entries = leaderboard.top(metric, limit, offset)
+        usernames = {}
+        for shard, user_ids in group_by_shard([e["user_id"] for e in entries]).items():
+            with use_shard(shard):
+                usernames.update(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)))
+        for entry in entries:
+            entry["username"] = usernames.get(entry["user_id"])
+        
+        return jsonify({"metric": metric, "leaderboard": entries}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/leaderboard/rank/<user_id>', methods=['GET'])
+def get_leaderboard_rank(user_id):
+    """A user's rank on a wallet metric leaderboard"""
+    metric = request.args.get('metric', 'total_coins_earned')
+    if metric not in leaderboard.metrics:
+        return jsonify({"error": f"metric must be one of {', '.join(leaderboard.metrics)}"}), 400
+    
+    try:
+        rank = leaderboard.rank_of(metric, user_id)
+        if rank is None:
+            return jsonify({"error": "Wallet not found"}), 404
+        
+        return jsonify({"metric": metric, "user_id": user_id, **rank}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ============================================================================
+# XP & LEAGUE ENDPOINTS
+# ============================================================================
+
+@api.route('/xp/levels', methods=['GET'])
+def get_xp_levels():
+    """Level and league thresholds"""
+    return jsonify({
+        "levels": [{"level": level, "min_xp": min_xp} for level, min_xp in enumerate(LEVEL_THRESHOLDS, 1)],
+        "leagues": [{"name": name, "min_xp": min_xp} for name, min_xp in LEAGUES]
+    }), 200
+
+
+@api.route('/xp/<user_id>', methods=['GET'])
+@user_shard
+@read_replica
+def get_user_xp(user_id):
+    """A user's XP total, level and league"""
+    try:
+        PyUUID(user_id)
+    except ValueError:
+        return jsonify({"error": "Invalid user_id format"}), 400
+    
+    try:
+        user = db.session.query(User.xp, User.level).filter_by(id=user_id).first()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        
+        return jsonify({"user_id": user_id, **progress(user.xp, user.level)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/admin/xp/grants', methods=['POST'])
+def grant_user_xp():
+    """Admin: Grant XP to many users in one transaction"""
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('grants'), list) or not data['grants']:
+        return jsonify({"error": "grants must be a non-empty list"}), 400
+    if len(data['grants']) > MAX_XP_GRANTS:
+        return jsonify({"error": f"At most {MAX_XP_GRANTS} grants per request"}), 400
+    
+    try:
+        grants = validate_grants(data['grants'])
+        missing = []
+        # One transaction per shard
+        for shard, user_ids in group_by_shard(grants).items():
+            with use_shard(shard):
+                missing.extend(grant_xp(db.session, {user_id: grants[user_id] for user_id in user_ids},
+                                        data.get('reason')))
+                db.session.commit()
+        
+        return jsonify({
+            "message": f"Granted XP to {len(grants) - len(missing)} users",
+            "missing": missing
+        }), 200
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
 # ============================================================================
 # VIRTUAL PRODUCT ENDPOINTS
 # ============================================================================
 
-@app.route('/products', methods=['GET'])
+@api.route('/products', methods=['GET'])
+@serve_stale
+@read_replica
 def list_products():
     """List all active virtual products"""
     try:
-        products = VirtualProduct.find_active_products()
+        products = read_queries.active_products()
         
         return jsonify({
             "products": [
@@ -571,7 +953,8 @@ def list_products():
                     "product_type": product.product_type,
                     "currency_type": product.currency_type,
                     "price": float(product.price),
-                    "is_available": product.is_available(),
+                    # Active and in its window by the query; only stock is left to check
+                    "is_available": product.stock_quantity is None or product.stock_quantity > 0,
                     "stock_quantity": product.stock_quantity,
                     "icon_url": product.icon_url
                 } for product in products
@@ -581,9 +964,108 @@ def list_products():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/products/<int:product_id>', methods=['GET'])
+@api.route('/products/search', methods=['GET'])
+def search_products():
+    """Filter and full-text search the catalog from in-memory indexes"""
+    args = request.args
+    try:
+        consumable = args.get('consumable')
+        if consumable is not None and consumable not in ('true', 'false'):
+            raise ValueError("consumable must be true or false")
+        available_at = datetime.fromisoformat(args['available_at']) if args.get('available_at') else datetime.utcnow()
+        filters = {
+            "product_type": args.get('product_type'),
+            "currency_type": args.get('currency_type'),
+            "min_price": float(args['min_price']) if args.get('min_price') else None,
+            "max_price": float(args['max_price']) if args.get('max_price') else None,
+            "consumable": None if consumable is None else consumable == 'true',
+            "available_at": available_at,
+            "q": args.get('q'),
+            "limit": int(args.get('limit', 50)),
+            "offset": int(args.get('offset', 0))
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid search parameter: {e}"}), 400
+    
+    if not 0 < filters["limit"] <= CATALOG_SEARCH_MAX_LIMIT or filters["offset"] < 0:
+        return jsonify({"error": f"limit must be 1-{CATALOG_SEARCH_MAX_LIMIT} and offset non-negative"}), 400
+    
+    try:
+        total, records = catalog_search.search(**filters)
+        
+        return jsonify({
+            "total": total,
+            "products": [
+                {
+                    "id": record['id'],
+                    "name": record['name'],
+                    "description": record['description'],
+                    "product_type": record['product_type'],
+                    "currency_type": record['currency_type'],
+                    "price": record['price'],
+                    "consumable": record['consumable'],
+                    "is_available": is_record_available(record, available_at),
+                    "stock_quantity": record['stock_quantity'],
+                    "icon_url": record['icon_url']
+                } for record in records
+            ]
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/products/eligible/<user_id>', methods=['GET'])
+@user_shard
+def get_eligible_products(user_id):
+    """Products the user meets the level and achievement requirements for"""
+    try:
+        PyUUID(user_id)
+    except ValueError:
+        return jsonify({"error": "Invalid user_id format"}), 400
+    
+    try:
+        eligible = eligible_catalog.eligible_for(user_id)
+        if eligible is None:
+            return jsonify({"error": "User not found"}), 404
+        level, records = eligible
+        
+        # Requirements are cached per user; stock and windows change independently
+        now = datetime.utcnow()
+        include_unavailable = request.args.get('include_unavailable') == 'true'
+        
+        return jsonify({
+            "user_id": user_id,
+            "level": level,
+            "products": [
+                {
+                    "id": record['id'],
+                    "name": record['name'],
+                    "product_type": record['product_type'],
+                    "currency_type": record['currency_type'],
+                    "price": record['price'],
+                    "is_available": available,
+                    "stock_quantity": record['stock_quantity'],
+                    "icon_url": record['icon_url']
+                }
+                for record in records
+                for available in (is_record_available(record, now),)
+                if available or include_unavailable
+            ]
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/products/<product_id>', methods=['GET'])
+@serve_stale
+@read_replica
 def get_product(product_id):
     """Get product details"""
+    try:
+        PyUUID(product_id)
+    except ValueError:
+        return jsonify({"error": "Invalid product ID format"}), 400
+    
     try:
         product = VirtualProduct.find_by_id(product_id)
         if not product:
@@ -610,7 +1092,7 @@ def get_product(product_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/products', methods=['POST'])
+@api.route('/products', methods=['POST'])
 def create_product():
     """Create a new virtual product (admin endpoint)"""
     try:
@@ -652,7 +1134,8 @@ def create_product():
 # PURCHASE ENDPOINTS
 # ============================================================================
 
-@app.route('/products/<int:product_id>/purchase', methods=['POST'])
+@api.route('/products/<product_id>/purchase', methods=['POST'])
+@user_shard
 def purchase_product(product_id):
     """Purchase a virtual product"""
     try:
@@ -675,6 +1158,11 @@ def purchase_product(product_id):
         if not wallet:
             return jsonify({"error": "Wallet not found"}), 404
         
+        # Level and achievement requirements
+        user = db.session.query(User.level, User.achievements).filter_by(id=user_id).first()
+        if not product.user_meets_requirements(user.level or 1, user.achievements):
+            return jsonify({"error": "User does not meet the requirements for this product"}), 400
+        
         # Check purchase limits
         if product.max_purchases:
             user_purchases = ProductPurchase.find_user_product_purchases(user_id, product_id)
@@ -685,29 +1173,15 @@ def purchase_product(product_id):
         price = int(product.price)
         currency_type = product.currency_type
         
-        if currency_type == 'sf_coins':
-            if wallet.sf_coins < price:
-                return jsonify({"error": "Insufficient SF Coins"}), 400
-            balance_before = wallet.sf_coins
-            wallet.spend_sf_coins(price)
-            balance_after = wallet.sf_coins
-        elif currency_type == 'premium_gems':
-            if wallet.premium_gems < price:
-                return jsonify({"error": "Insufficient Premium Gems"}), 400
-            balance_before = wallet.premium_gems
-            wallet.spend_premium_gems(price)
-            balance_after = wallet.premium_gems
-        elif currency_type == 'event_tokens':
-            if wallet.event_tokens < price:
-                return jsonify({"error": "Insufficient Event Tokens"}), 400
-            balance_before = wallet.event_tokens
-            wallet.spend_event_tokens(price)
-            balance_after = wallet.event_tokens
-        else:
+        if currency_type not in ('sf_coins', 'premium_gems', 'event_tokens'):
             return jsonify({"error": f"Unsupported currency type: {currency_type}"}), 400
+        balance_before = wallet.debit(currency_type, price)
+        balance_after = balance_before - price
         
-        # Create wallet transaction
+        # Keys are assigned here so the whole purchase goes out in the
+        # commit's single flush
         transaction = WalletTransaction(
+            id=uuid4(),
             wallet_id=wallet.id,
             user_id=user_id,
             transaction_type='purchase',
@@ -716,11 +1190,9 @@ def purchase_product(product_id):
             balance_before=balance_before,
             balance_after=balance_after,
             reference_type='product',
-            reference_id=product_id,
             description=f"Purchased {product.name}"
         )
         db.session.add(transaction)
-        db.session.flush()
         
         # Create purchase record
         expires_at = None
@@ -728,19 +1200,22 @@ def purchase_product(product_id):
             expires_at = datetime.utcnow() + timedelta(days=product.duration_days)
         
         purchase = ProductPurchase(
+            id=uuid4(),
             user_id=user_id,
             product_id=product_id,
             currency_type=currency_type,
             amount_paid=price,
             status='completed',
             expires_at=expires_at,
-            transaction_id=transaction.id
+            transaction_id=transaction.id,
+            is_delivered=True,
+            delivered_at=datetime.utcnow()
         )
         db.session.add(purchase)
-        db.session.flush()
         
         # Add to user inventory
         inventory_item = UserInventory(
+            id=uuid4(),
             user_id=user_id,
             product_id=product_id,
             purchase_id=purchase.id,
@@ -749,20 +1224,27 @@ def purchase_product(product_id):
         )
         db.session.add(inventory_item)
         
-        # Update stock if applicable
-        if product.stock_quantity is not None:
-            product.stock_quantity -= 1
-        
-        # Mark purchase as delivered
-        purchase.deliver()
+        # Take the unit of stock last, just before the purchase commits
+        stock_reserved = product.stock_quantity is not None
+        if stock_reserved and not reserve_stock(db.session, product_id):
+            db.session.rollback()
+            return jsonify({"error": "Product is out of stock"}), 400
         
-        db.session.commit()
+        purchase_id, transaction_id, inventory_id = purchase.id, transaction.id, inventory_item.id
+        try:
+            db.session.commit()
+        except Exception:
+            if stock_reserved and shards_enabled():
+                release_stock(product_id)
+            raise
+        if stock_reserved:
+            note_stock_changes([product_id])
         
         return jsonify({
             "message": "Product purchased successfully",
-            "purchase_id": purchase.id,
-            "transaction_id": transaction.id,
-            "inventory_id": inventory_item.id,
+            "purchase_id": purchase_id,
+            "transaction_id": transaction_id,
+            "inventory_id": inventory_id,
             "remaining_balance": {
                 currency_type: balance_after
             }
@@ -776,7 +1258,9 @@ def purchase_product(product_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/purchases/user_id', methods=['GET'])
+@api.route('/purchases/<user_id>', methods=['GET'])
+@user_shard
+@read_replica
 def get_user_purchases(user_id):
     """Get user's purchase history"""
     try:
@@ -805,25 +1289,29 @@ def get_user_purchases(user_id):
 # INVENTORY ENDPOINTS
 # ============================================================================
 
-@app.route('/inventory/user_id', methods=['GET'])
+@api.route('/inventory/<user_id>', methods=['GET'])
+@user_shard
+@read_replica
+@conditional(read_queries.inventory_version)
 def get_user_inventory(user_id):
     """Get user's inventory"""
     try:
-        inventory_items = UserInventory.find_by_user(user_id)
+        inventory_items = read_queries.user_inventory(user_id)
+        now = datetime.utcnow()
         
         return jsonify({
             "inventory": [
                 {
                     "id": item.id,
                     "product_id": item.product_id,
-                    "product_name": item.product.name if item.product else None,
-                    "product_type": item.product.product_type if item.product else None,
+                    "product_name": item.product_name,
+                    "product_type": item.product_type,
                     "quantity": item.quantity,
                     "remaining_uses": item.remaining_uses,
                     "is_equipped": item.is_equipped,
                     "is_active": item.is_active,
                     "is_consumed": item.is_consumed,
-                    "is_valid": item.is_valid(),
+                    "is_valid": read_queries.is_item_valid(item, now),
                     "acquired_at": item.acquired_at.isoformat() if item.acquired_at else None,
                     "expires_at": item.expires_at.isoformat() if item.expires_at else None
                 } for item in inventory_items
@@ -833,7 +1321,7 @@ def get_user_inventory(user_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/inventory/inventory_id/equip', methods=['POST'])
+@api.route('/inventory/inventory_id/equip', methods=['POST'])
 def equip_item(inventory_id):
     """Equip an inventory item"""
     try:
@@ -857,7 +1345,7 @@ def equip_item(inventory_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/inventory/inventory_id/unequip', methods=['POST'])
+@api.route('/inventory/inventory_id/unequip', methods=['POST'])
 def unequip_item(inventory_id):
     """Unequip an inventory item"""
     try:
@@ -878,7 +1366,7 @@ def unequip_item(inventory_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/inventory/inventory_id/use', methods=['POST'])
+@api.route('/inventory/inventory_id/use', methods=['POST'])
 def use_consumable(inventory_id):
     """Use a consumable item"""
     try:
@@ -910,6 +1398,233 @@ def use_consumable(inventory_id):
         return jsonify({"error": str(e)}), 500
 
 
+@api.route('/inventory/equipped', methods=['GET'])
+def get_equipped_loadouts():
+    """Get the equipped items of many users (?user_ids=a,b,c)"""
+    user_ids = list(dict.fromkeys(u.strip() for u in request.args.get('user_ids', '').split(',') if u.strip()))
+    
+    if not user_ids:
+        return jsonify({"error": "user_ids is required"}), 400
+    if len(user_ids) > LOADOUT_MAX_USERS:
+        return jsonify({"error": f"At most {LOADOUT_MAX_USERS} user_ids per request"}), 400
+    try:
+        for user_id in user_ids:
+            PyUUID(user_id)
+    except ValueError:
+        return jsonify({"error": "Invalid user_id format"}), 400
+    
+    try:
+        return jsonify({"loadouts": loadout_cache.get_many(user_ids)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/inventory/<user_id>/actions', methods=['POST'])
+@user_shard
+def apply_inventory_action_batch(user_id):
+    """Apply a batch of equip/unequip/use actions in one transaction"""
+    data = request.get_json()
+    
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    try:
+        PyUUID(user_id)
+        actions = validate_actions(data.get('actions'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        items = apply_inventory_actions(user_id, actions)
+        
+        return jsonify({
+            "message": f"Applied {len(actions)} inventory actions",
+            "items": items
+        }), 200
+        
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+# ============================================================================
+# ADMIN EXPORT ENDPOINTS
+# ============================================================================
+
+def _ndjson_export(dataset):
+    """Stream a dataset as NDJSON, optionally bounded by ?since=&until="""
+    try:
+        since, until = parse_time_range(request.args)
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO-8601 timestamps"}), 400
+    
+    return Response(
+        stream_with_context(stream_ndjson(dataset, since, until)),
+        mimetype='application/x-ndjson',
+        headers={"Content-Disposition": f"attachment; filename={dataset}.ndjson"}
+    )
+
+
+@api.route('/admin/export/users', methods=['GET'])
+def export_users():
+    """Admin: Stream all users as NDJSON"""
+    return _ndjson_export('users')
+
+
+@api.route('/admin/export/transactions', methods=['GET'])
+def export_transactions():
+    """Admin: Stream wallet transactions as NDJSON"""
+    return _ndjson_export('transactions')
+
+
+@api.route('/admin/export/purchases', methods=['GET'])
+def export_purchases():
+    """Admin: Stream product purchases as NDJSON"""
+    return _ndjson_export('purchases')
+
+
+# ============================================================================
+# ADMIN REFUND ENDPOINTS
+# ============================================================================
+
+@api.route('/admin/products/<product_id>/refund-all', methods=['POST'])
+def refund_all_purchases(product_id):
+    """Admin: Refund every completed purchase of a recalled product in the background"""
+    try:
+        PyUUID(product_id)
+    except ValueError:
+        return jsonify({"error": "Invalid product_id format"}), 400
+    
+    if shards_enabled():
+        return jsonify({"error": "Bulk refunds are not supported across shards"}), 400
+    
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        product = db.session.get(VirtualProduct, product_id)
+        if not product:
+            return jsonify({"error": "Product not found"}), 404
+        
+        job, started = start_refund_job(product, deactivate_product=data.get('deactivate_product', True))
+        if started:
+            launch_refund_job(current_app._get_current_object(), job.id)
+        
+        return jsonify(job.to_dict()), 202 if started else 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/admin/refund-jobs/<job_id>', methods=['GET'])
+def get_refund_job(job_id):
+    """Admin: Progress of a bulk refund job"""
+    try:
+        job = db.session.get(ProductRefundJob, job_id)
+        if not job:
+            return jsonify({"error": "Refund job not found"}), 404
+        
+        return jsonify(job.to_dict()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ============================================================================
+# ADMIN STATS ENDPOINTS
+# ============================================================================
+
+@api.route('/admin/stats', methods=['GET'])
+@read_replica
+def get_admin_stats():
+    """Admin: System-wide per-day ledger totals from the daily rollups"""
+    try:
+        start_day, end_day = parse_day_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        return jsonify({
+            "from": start_day.isoformat(),
+            "to": end_day.isoformat(),
+            **global_stats(start_day, end_day)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/admin/cache/versions', methods=['GET'])
+def cache_versions():
+    """Admin: invalidation versions applied and propagation lag in this worker"""
+    return jsonify(invalidation_bus.stats()), 200
+
+
+# ============================================================================
+# APPLICATION FACTORY
+# ============================================================================
+
+def create_app(config=None):
+    """Build the app for the backend selected by the database URL"""
+    global earn_coalescer, earn_admission, change_feed, leaderboard, catalog_search, eligible_catalog, loadout_cache, \
+        invalidation_bus
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here-change-in-production')
+    app.config.update(config or {})
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+
+    # Enable CORS for frontend communication
+    CORS(app, resources={r"/*": {"origins": "*", "expose_headers": [READ_YOUR_WRITES_HEADER]}})
+
+    # gzip/brotli for large JSON responses
+    init_compression(app)
+
+    # Statement timeouts and circuit breakers; stale reads and fast 503s
+    # while the database is down
+    init_degraded_mode(app)
+
+    # Optional read replica for GET endpoints (REPLICA_DATABASE_URL)
+    configure_replica(app)
+
+    # Optional per-user shards (SHARD_DATABASE_URLS)
+    configure_shards(app)
+
+    db.init_app(app)
+    app.register_blueprint(api)
+    init_db(app)
+
+    # Opt-in write-behind coalescing of /wallet/earn events; its flushes
+    # span users, so it stays off when sharded
+    earn_coalescer = EarnCoalescer(app) if EARN_COALESCE_ENABLED and not shards_enabled() else None
+
+    # Daily-limit admission control for /wallet/earn (shared across forked workers when enabled)
+    earn_admission = init_earn_admission()
+
+    # Wallet change events for /wallet/stream
+    change_feed = init_change_feed(app)
+
+    # Tells other workers which keys of the caches below a commit changed
+    invalidation_bus = init_invalidation_bus(app)
+
+    # In-memory leaderboards, built lazily per worker
+    leaderboard = init_leaderboard(app)
+
+    # In-memory catalog search indexes, built lazily per worker
+    catalog_search = init_catalog_search(app)
+    eligible_catalog = init_eligible_catalog(catalog_search)
+    loadout_cache = init_loadout_cache(catalog_search)
+
+    return app
+
+
+app = create_app()
+
+
 # ============================================================================
 # APPLICATION STARTUP
 # ============================================================================
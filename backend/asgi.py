@@ -0,0 +1,282 @@
+"""
+Optional async (ASGI) serving mode.
+
+The polling-heavy read routes are served natively with an ``AsyncSession``
+so an in-flight request waiting on the database no longer pins a worker
+thread; every other route falls through to the regular Flask app mounted
+as WSGI. Models are shared with ``models``. Wallet change streams are
+served here too, so thousands of idle SSE clients cost no threads.
+
+The native reads tag responses with the same ETags as the Flask routes
+and answer ``If-None-Match`` with 304. They hand a request to the Flask
+route when it needs what only that route does: ``?as_of=``, creating a
+missing wallet, or serving a stale body or 503 after a database error.
+With ``SHARD_DATABASE_URLS`` or ``REPLICA_DATABASE_URL`` set they are not
+mounted at all, since the Flask routes read from the user's shard or the
+replica rather than ``ASYNC_DATABASE_URL``; a sharded stream replays its
+backlog from the user's shard on a thread.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 2
+
+Requires the packages in requirements-async.txt.
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+from uuid import UUID as PyUUID
+import os
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date, parse_etags
+
+from app import app as flask_app, change_feed
+from change_feed import AsyncSubscription, anchor_query, replay_query, replay_result, stream_events_async
+from degraded import STATEMENT_TIMEOUTS_MS, stale_cache, statement_timeout
+from http_cache import make_etag
+from models import db, REPLICA_BIND, UserWallet, WalletTransaction, VirtualProduct
+from sharding import shard_for, shards_enabled, use_shard
+
+# Sync driver -> async driver for the same database
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def get_async_database_url():
+    """Async URL from ASYNC_DATABASE_URL, else derived from the Flask config"""
+    url = os.getenv('ASYNC_DATABASE_URL')
+    if url:
+        return url
+    sync_url = make_url(flask_app.config["SQLALCHEMY_DATABASE_URI"])
+    return sync_url.set(drivername=ASYNC_DRIVERS[sync_url.get_backend_name()])
+
+
+def get_engine_options(url):
+    """Small shared pool: thousands of waiting requests multiplex over it"""
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        "pool_size": int(os.getenv('ASYNC_DB_POOL_SIZE', '10')),
+        "max_overflow": int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '5')),
+        "pool_pre_ping": True
+    }
+
+
+ASYNC_DATABASE_URL = get_async_database_url()
+engine = create_async_engine(ASYNC_DATABASE_URL, **get_engine_options(ASYNC_DATABASE_URL))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# The Flask routes read from the user's shard or the replica instead
+NATIVE_READS = not shards_enabled() and REPLICA_BIND not in flask_app.config.get("SQLALCHEMY_BINDS", {})
+
+flask_wsgi = WSGIMiddleware(flask_app)
+
+
+class Native:
+    """ASGI app serving ``endpoint`` natively. When the endpoint returns
+    None, or fails with a database error, the request goes to the Flask
+    route instead."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        try:
+            with statement_timeout(STATEMENT_TIMEOUTS_MS['read'] or None):
+                response = await self.endpoint(request)
+        except SQLAlchemyError:
+            response = None  # the Flask route serves a stale body or 503
+        except Exception as e:
+            response = JSONResponse({"error": str(e)}, status_code=500)
+        if response is None:
+            await flask_wsgi(scope, receive, send)
+        else:
+            await response(scope, receive, send)
+
+
+def conditional_response(request, version, body):
+    """304 or ``body`` tagged like ``http_cache.conditional`` would for
+    this version row; 200 bodies are kept for ``serve_stale``"""
+    full_path = f"{request.url.path}?{request.url.query}"  # as Flask's request.full_path
+    etag = make_etag(full_path, version)
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'private, no-cache'}
+    if isinstance(version[0], datetime):
+        headers['Last-Modified'] = http_date(version[0])
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        return Response(status_code=304, headers=headers)
+    response = JSONResponse(body, headers=headers)
+    stale_cache.put(full_path, response.body)
+    return response
+
+
+# ============================================================================
+# ASYNC WALLET ENDPOINTS
+# ============================================================================
+
+async def get_wallet_balance(request):
+    """Get wallet balance for a user; ``?as_of=`` and missing wallets are
+    left to the Flask route"""
+    try:
+        user_uuid = str(PyUUID(request.path_params['user_id']))
+    except ValueError:
+        return JSONResponse({"error": "Invalid user ID format"}, status_code=400)
+    if request.query_params.get('as_of'):
+        return None
+
+    # The columns of read_queries.wallet_version, so the ETags agree
+    w = UserWallet
+    async with Session() as session:
+        version = (await session.execute(
+            select(w.updated_at, w.sf_coins, w.premium_gems, w.event_tokens,
+                   w.total_coins_earned, w.total_coins_spent, w.daily_earnings, w.daily_earning_limit)
+            .where(w.user_id == user_uuid)
+        )).first()
+    if version is None:
+        return None
+
+    return conditional_response(request, version, {
+        "sf_coins": version.sf_coins,
+        "premium_gems": version.premium_gems,
+        "event_tokens": version.event_tokens,
+        "total_coins_earned": version.total_coins_earned,
+        "total_coins_spent": version.total_coins_spent,
+        "daily_earnings": version.daily_earnings,
+        "daily_earning_limit": version.daily_earning_limit
+    })
+
+
+async def get_wallet_history(request):
+    """Get wallet transaction history"""
+    async with Session() as session:
+        transactions = (await session.execute(
+            select(WalletTransaction)
+            .filter_by(user_id=request.path_params['user_id'])
+            .order_by(WalletTransaction.created_at.desc(), WalletTransaction.id.desc())
+        )).scalars().all()
+
+    if not transactions:
+        return JSONResponse({"message": "No transactions found", "transactions": []})
+
+    # read_queries.history_version: the latest entry
+    return conditional_response(request, (transactions[0].created_at, transactions[0].id), {
+        "transactions": [
+            {
+                "id": transaction.id,
+                "transaction_type": transaction.transaction_type,
+                "currency_type": transaction.currency_type,
+                "amount": transaction.amount,
+                "balance_before": transaction.balance_before,
+                "balance_after": transaction.balance_after,
+                "description": transaction.description,
+                "created_at": transaction.created_at.isoformat() if transaction.created_at else None
+            } for transaction in transactions
+        ]
+    })
+
+
+def replay_on_shard(user_id, last_event_id):
+    """``change_feed.replay`` on the user's shard"""
+    with flask_app.app_context(), use_shard(shard_for(user_id)):
+        try:
+            return change_feed.replay(user_id, last_event_id)
+        finally:
+            db.session.remove()
+
+
+async def stream_wallet_changes(request):
+    """Server-sent events of the user's wallet transactions; an idle stream
+    costs a queue and a suspended coroutine rather than a thread"""
+    try:
+        user_uuid = str(PyUUID(request.path_params['user_id']))
+    except ValueError:
+        return JSONResponse({"error": "Invalid user ID format"}, status_code=400)
+
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    subscription = change_feed.subscribe(AsyncSubscription(user_uuid))
+    backlog, resync = [], None
+    try:
+        if last_event_id and shards_enabled():
+            backlog, resync = await run_in_threadpool(replay_on_shard, user_uuid, last_event_id)
+        elif last_event_id:
+            async with Session() as session:
+                anchor = (await session.execute(anchor_query(user_uuid, last_event_id))).scalar()
+                if anchor is None:
+                    resync = "unknown last event id"
+                else:
+                    rows = (await session.execute(replay_query(user_uuid, last_event_id, anchor))).all()
+                    backlog, resync = replay_result(rows)
+    except Exception as e:
+        change_feed.unsubscribe(subscription)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    return StreamingResponse(
+        stream_events_async(change_feed, subscription, backlog or [], resync),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# ============================================================================
+# ASYNC VIRTUAL PRODUCT ENDPOINTS
+# ============================================================================
+
+async def list_products(request):
+    """List all active virtual products"""
+    async with Session() as session:
+        products = (await session.execute(
+            VirtualProduct.active_products_query()
+        )).scalars().all()
+
+    response = JSONResponse({
+        "products": [
+            {
+                "id": product.id,
+                "name": product.name,
+                "description": product.description,
+                "product_type": product.product_type,
+                "currency_type": product.currency_type,
+                "price": float(product.price),
+                "is_available": product.is_available(),
+                "stock_quantity": product.stock_quantity,
+                "icon_url": product.icon_url
+            } for product in products
+        ]
+    })
+    stale_cache.put(f"{request.url.path}?{request.url.query}", response.body)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+native_reads = [
+    Route('/wallet/balance/{user_id}', Native(get_wallet_balance), methods=['GET']),
+    Route('/wallet/history/{user_id}', Native(get_wallet_history), methods=['GET']),
+    Route('/products', Native(list_products), methods=['GET']),
+] if NATIVE_READS else []
+
+app = Starlette(
+    routes=[
+        *native_reads,
+        Route('/wallet/stream/{user_id}', stream_wallet_changes, methods=['GET']),
+        # Everything else is served by the synchronous Flask app
+        Mount('/', app=flask_wsgi),
+    ],
+    lifespan=lifespan
+)
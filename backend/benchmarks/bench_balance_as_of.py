@@ -0,0 +1,105 @@
+"""
+Point-in-time balance lookups against account age.
+
+Creates wallets whose ledgers span 30, 365 and 1825 days (--per-day rows a
+day), writes their daily snapshots, then looks up balances at random
+times. Each lookup runs from the nearest snapshot (balance_as_of) and as
+a scan of every ledger row up to the requested time, for comparison.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_balance_as_of.py --wallets 5 --per-day 10
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet, WalletTransaction  # noqa: E402
+from snapshots import balance_as_of, write_snapshots  # noqa: E402
+
+AGES = (30, 365, 1825)
+
+
+def seed(wallets, per_day, end):
+    """{age: [(user_id, wallet_id), ...]} with ledgers of per_day rows a day"""
+    run_id = uuid.uuid4().hex[:8]
+    accounts = {}
+    with app.app_context():
+        for age in AGES:
+            accounts[age] = []
+            for i in range(wallets):
+                user_id, wallet_id = str(uuid.uuid4()), str(uuid.uuid4())
+                db.session.execute(insert(User), [{"id": user_id, "username": f"bench_{run_id}_{age}_{i}",
+                                                   "email": f"bench_{run_id}_{age}_{i}@example.com"}])
+                start = end - timedelta(days=age)
+                balance, rows = 0, []
+                for offset in sorted(random.uniform(0, age * 86400) for _ in range(age * per_day)):
+                    amount = random.randint(1, 100)
+                    credit = balance < 100 or random.random() < 0.6
+                    after = balance + amount if credit else balance - amount
+                    rows.append({
+                        "id": str(uuid.uuid4()), "wallet_id": wallet_id, "user_id": user_id,
+                        "transaction_type": 'earn' if credit else 'spend', "currency_type": 'sf_coins',
+                        "amount": amount, "balance_before": balance, "balance_after": after, "xp_amount": 0,
+                        "created_at": start + timedelta(seconds=offset)
+                    })
+                    balance = after
+                # The live balance matches the ledger; the opening snapshot is their difference
+                db.session.execute(insert(UserWallet), [{"id": wallet_id, "user_id": user_id, "created_at": start,
+                                                         "sf_coins": balance}])
+                db.session.execute(insert(WalletTransaction), rows)
+                accounts[age].append((user_id, wallet_id))
+            db.session.commit()
+        started = time.perf_counter()
+        written = write_snapshots(end.date() - timedelta(days=max(AGES) + 1), end.date() - timedelta(days=1))
+        print(f"snapshots: {written:,} rows in {time.perf_counter() - started:.1f}s")
+    return accounts
+
+
+def full_scan(wallet_id, as_of):
+    tx = WalletTransaction
+    return db.session.execute(
+        select(func.sum(tx.balance_after - tx.balance_before))
+        .where(tx.wallet_id == wallet_id, tx.created_at <= as_of)
+    ).scalar() or 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=5, help="Wallets per account age")
+    parser.add_argument('--per-day', type=int, default=10, help="Ledger rows per wallet per day")
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    end = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    accounts = seed(args.wallets, args.per_day, end)
+    print(f"{'age (days)':>10} {'ledger rows':>12} {'snapshot us':>12} {'rows applied':>13} {'scan us':>10}")
+    with app.app_context():
+        for age in AGES:
+            snapshot_times, scan_times, applied = [], [], []
+            for _ in range(args.lookups):
+                user_id, wallet_id = random.choice(accounts[age])
+                as_of = end - timedelta(seconds=random.uniform(0, age * 86400))
+                started = time.perf_counter()
+                balance = balance_as_of(user_id, as_of)
+                snapshot_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                expected = full_scan(wallet_id, as_of)
+                scan_times.append(time.perf_counter() - started)
+                assert balance['sf_coins'] == expected, (balance, expected)
+                applied.append(balance['ledger_rows_applied'])
+            print(f"{age:>10,} {age * args.per_day:>12,} {statistics.median(snapshot_times) * 1e6:>12,.0f} "
+                  f"{max(applied):>13,} {statistics.median(scan_times) * 1e6:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main()
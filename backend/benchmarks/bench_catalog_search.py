@@ -0,0 +1,81 @@
+"""
+Query latency of the in-memory catalog index at catalog scale.
+
+    python benchmarks/bench_catalog_search.py --products 100000
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from catalog_index import CatalogIndex  # noqa: E402
+
+PRODUCT_TYPES = ['feature_unlock', 'cosmetic', 'booster', 'subscription', 'collectible', 'currency_pack']
+CURRENCIES = ['sf_coins', 'premium_gems', 'event_tokens']
+WORDS = ['sword', 'shield', 'dragon', 'golden', 'shadow', 'potion', 'booster', 'skin', 'crystal',
+         'legendary', 'epic', 'rare', 'pack', 'frost', 'flame', 'storm', 'knight', 'mage', 'arrow', 'helm']
+
+
+def make_records(count, rng):
+    now = datetime.utcnow()
+    for _ in range(count):
+        windowed = rng.random() < 0.05
+        yield {
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'name': ' '.join(rng.sample(WORDS, 3)),
+            'description': ' '.join(rng.sample(WORDS, 6)),
+            'product_type': rng.choice(PRODUCT_TYPES),
+            'currency_type': rng.choice(CURRENCIES),
+            'price': float(rng.randint(1, 5000)),
+            'consumable': rng.random() < 0.3,
+            'is_active': rng.random() < 0.9,
+            'available_from': now - timedelta(days=rng.randint(0, 30)) if windowed else None,
+            'available_to': now + timedelta(days=rng.randint(-5, 30)) if windowed else None,
+            'stock_quantity': None,
+            'icon_url': None,
+            'min_user_level': 1,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    index = CatalogIndex(make_records(args.products, rng))
+    print(f"products : {args.products:,}  build {time.perf_counter() - started:.2f} s")
+
+    now = datetime.utcnow()
+    queries = {
+        'type+currency': lambda: dict(product_type=rng.choice(PRODUCT_TYPES), currency_type=rng.choice(CURRENCIES)),
+        'price range': lambda: dict(min_price=rng.randint(1, 2500), max_price=rng.randint(2500, 5000)),
+        'text': lambda: dict(q=rng.choice(WORDS)),
+        'text prefix x2': lambda: dict(q=f"{rng.choice(WORDS)[:3]} {rng.choice(WORDS)}"),
+        'all filters': lambda: dict(product_type=rng.choice(PRODUCT_TYPES), currency_type=rng.choice(CURRENCIES),
+                                    min_price=100, max_price=3000, consumable=False, available_at=now,
+                                    q=rng.choice(WORDS)),
+    }
+    for name, make in queries.items():
+        timings = []
+        for _ in range(args.queries):
+            filters = make()
+            started = time.perf_counter()
+            index.search(limit=50, **filters)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{name:<15} p50 {statistics.median(timings):.3f} ms  p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
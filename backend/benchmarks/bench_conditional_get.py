@@ -0,0 +1,89 @@
+"""
+Bandwidth and server CPU for a client polling unchanged wallet data.
+
+Seeds one user with a ledger and inventory, then polls the balance, history
+and inventory endpoints in-process three ways: a plain GET every time, a
+GET accepting compression, and a conditional GET that echoes the last ETag
+(what a polling client should do). Reports bytes on the wire and CPU per
+poll.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_conditional_get.py --transactions 500
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet, WalletTransaction, VirtualProduct, UserInventory  # noqa: E402
+import http_cache  # noqa: E402
+
+
+def seed(transactions, items):
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        user = User(username=f"bench_{run_id}", email=f"bench_{run_id}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        wallet = UserWallet(user_id=user.id, sf_coins=1000)
+        db.session.add(wallet)
+        db.session.flush()
+        for i in range(transactions):
+            db.session.add(WalletTransaction(wallet_id=wallet.id, user_id=user.id, transaction_type='earn',
+                                             currency_type='sf_coins', amount=1, balance_before=i, balance_after=i + 1,
+                                             description="Daily quest reward"))
+        for i in range(items):
+            product = VirtualProduct(name=f"bench_{run_id}_{i}", product_type='cosmetic', currency_type='sf_coins',
+                                     price=10)
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(UserInventory(user_id=user.id, product_id=product.id))
+        db.session.commit()
+        return str(user.id)
+
+
+def wire_bytes(response):
+    headers = sum(len(k) + len(v) + 4 for k, v in response.headers.items())
+    return headers + len(response.get_data())
+
+
+def poll(client, url, polls, mode):
+    etag = None
+    total_bytes = 0
+    started = time.process_time()
+    for _ in range(polls):
+        headers = {}
+        if mode != 'plain':
+            headers['Accept-Encoding'] = 'br, gzip'
+        if mode == 'conditional' and etag:
+            headers['If-None-Match'] = etag
+        response = client.get(url, headers=headers)
+        etag = response.headers.get('ETag', etag)
+        total_bytes += wire_bytes(response)
+    return total_bytes / polls, (time.process_time() - started) / polls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=500)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--polls', type=int, default=300)
+    args = parser.parse_args()
+
+    user_id = seed(args.transactions, args.items)
+    client = app.test_client()
+    print(f"compression: {'brotli' if http_cache.brotli else 'gzip'}")
+    print(f"{'endpoint':<10} {'mode':<12} {'bytes/poll':>11} {'cpu us/poll':>12}")
+    for name in ('balance', 'history', 'inventory'):
+        url = f"/wallet/{name}/{user_id}" if name != 'inventory' else f"/inventory/{user_id}"
+        for mode in ('plain', 'compressed', 'conditional'):
+            size, cpu = poll(client, url, args.polls, mode)
+            print(f"{name:<10} {mode:<12} {size:>11,.0f} {cpu:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
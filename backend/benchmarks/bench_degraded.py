@@ -0,0 +1,118 @@
+"""
+Latency and status codes through a database outage.
+
+Warms the last-known-good cache, then injects a fault and measures
+GET /products, GET /wallet/balance/<id> and POST /wallet/earn while the
+database is healthy, during the outage and after it ends:
+
+* ``stall``  statements hang (each should be cut at DB_READ/WRITE_TIMEOUT_MS
+  until the breaker opens, then answered in about a millisecond)
+* ``refuse`` the database is gone (connection errors open the breaker)
+
+By default the fault is injected in-process on SQLite: a stall swaps each
+statement for an endless query, a refusal for one that fails in the driver. With
+--proxy-target, DATABASE_URL must point at --proxy-listen and the faults
+are injected by benchmarks/fault_proxy.py in front of a real server.
+
+    DATABASE_URL=sqlite:////tmp/degraded.db python benchmarks/bench_degraded.py --fault stall
+    DATABASE_URL=mysql+pymysql://u:p@127.0.0.1:13306/db python benchmarks/bench_degraded.py \\
+        --proxy-target 127.0.0.1:3306 --proxy-listen 127.0.0.1:13306
+"""
+
+import argparse
+from collections import Counter
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+STALL = "WITH RECURSIVE spin(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM spin) SELECT count(*) FROM spin"
+# Fails in the driver with an OperationalError, as a lost connection would
+REFUSE = "SELECT * FROM fault_injected_database_unavailable"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fault', choices=('stall', 'refuse'), default='stall')
+    parser.add_argument('--requests', type=int, default=20, help="Requests per route per phase")
+    parser.add_argument('--read-timeout-ms', default='300')
+    parser.add_argument('--write-timeout-ms', default='500')
+    parser.add_argument('--breaker-failures', default='3')
+    parser.add_argument('--breaker-reset-seconds', default='2')
+    parser.add_argument('--proxy-target', help="host:port of the real database")
+    parser.add_argument('--proxy-listen', default='127.0.0.1:13306')
+    args = parser.parse_args()
+
+    # Read by degraded.py at import
+    os.environ.setdefault('DB_READ_TIMEOUT_MS', args.read_timeout_ms)
+    os.environ.setdefault('DB_WRITE_TIMEOUT_MS', args.write_timeout_ms)
+    os.environ.setdefault('DB_BREAKER_FAILURES', args.breaker_failures)
+    os.environ.setdefault('DB_BREAKER_RESET_SECONDS', args.breaker_reset_seconds)
+    os.environ.setdefault('DB_SOCKET_TIMEOUT', '5')
+
+    from sqlalchemy import event
+    from app import app
+    from models import db, User
+    import degraded
+
+    if args.proxy_target:
+        from benchmarks.fault_proxy import FaultProxy, _address
+        proxy = FaultProxy(_address(args.proxy_listen), _address(args.proxy_target))
+        proxy.start()
+
+        def inject():
+            proxy.set_mode('stall' if args.fault == 'stall' else 'refuse')
+
+        def heal():
+            proxy.set_mode('pass')
+    else:
+        with app.app_context():
+            engine = db.engine
+        assert engine.dialect.name == 'sqlite', "pass --proxy-target for a networked database"
+
+        def fault(conn, cursor, statement, parameters, context, executemany):
+            return (REFUSE if args.fault == 'refuse' else STALL), ()
+
+        def inject():
+            event.listen(engine, 'before_cursor_execute', fault, retval=True)
+
+        def heal():
+            event.remove(engine, 'before_cursor_execute', fault)
+
+    client = app.test_client()
+    with app.app_context():
+        user_id = str(db.session.execute(db.select(User.id).limit(1)).scalar())
+    routes = {
+        'GET /products': lambda: client.get('/products'),
+        'GET /wallet/balance': lambda: client.get(f'/wallet/balance/{user_id}'),
+        'POST /wallet/earn': lambda: client.post('/wallet/earn', json={"user_id": user_id, "amount": 1}),
+    }
+
+    def phase(label):
+        for route, call in routes.items():
+            samples, outcomes = [], Counter()
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = call()
+                samples.append((time.perf_counter() - started) * 1000)
+                stale = response.status_code == 200 and (response.get_json() or {}).get('stale')
+                outcomes[f"{response.status_code}{' stale' if stale else ''}"] += 1
+            print(f"{label:<9} {route:<20} p50 {statistics.median(samples):>8.1f} ms  "
+                  f"max {max(samples):>8.1f} ms  {dict(outcomes)}")
+
+    phase('healthy')
+    inject()
+    started = time.perf_counter()
+    phase('outage')
+    print(f"outage phase took {time.perf_counter() - started:.1f}s; breakers: "
+          f"{ {name: stats['state'] for name, stats in degraded.breaker_stats().items()} }")
+    heal()
+    time.sleep(float(os.environ['DB_BREAKER_RESET_SECONDS']))
+    phase('recovered')
+    print(f"stale cache: {degraded.stale_cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Cost of over-limit retries on /wallet/earn with and without admission control.
+
+Seeds users who have already used up their daily allowance, then replays
+earn requests for them in-process. Each request is timed against the
+admission table and then with it bypassed (every request reads the
+wallet). Reports latency and SQL statements per rejected request.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_earn_admission.py --users 200 --requests 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event  # noqa: E402
+
+import app as app_module  # noqa: E402
+from app import app  # noqa: E402
+from models import db, User, UserWallet  # noqa: E402
+
+
+def seed(users):
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        rows = [User(username=f"bench_{run_id}_{i}", email=f"bench_{run_id}_{i}@example.com") for i in range(users)]
+        db.session.add_all(rows)
+        db.session.flush()
+        db.session.add_all(UserWallet(user_id=user.id, daily_earnings=1000, daily_earning_limit=1000) for user in rows)
+        db.session.commit()
+        return [str(user.id) for user in rows]
+
+
+def replay(client, user_ids, requests):
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    started = time.perf_counter()
+    rejected = 0
+    for _ in range(requests):
+        response = client.post('/wallet/earn', json={"user_id": random.choice(user_ids), "amount": 10})
+        rejected += response.status_code == 400
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return elapsed / requests * 1e6, statements[0] / requests, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    user_ids = seed(args.users)
+    client = app.test_client()
+    admission = app_module.earn_admission
+    print(f"{'mode':<10} {'us/req':>8} {'sql/req':>8} {'rejected':>9}")
+    for mode in ('admission', 'bypass'):
+        app_module.earn_admission = admission if mode == 'admission' else None
+        latency, statements, rejected = replay(client, user_ids, args.requests)
+        print(f"{mode:<10} {latency:>8,.0f} {statements:>8.2f} {rejected:>9,}")
+    app_module.earn_admission = admission
+
+
+if __name__ == '__main__':
+    main()
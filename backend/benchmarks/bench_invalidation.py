@@ -0,0 +1,126 @@
+"""
+Propagation lag of cache invalidations between worker processes.
+
+Forks --workers processes that each load the catalog index, then changes a
+product's price --updates times in the parent and records how long each
+worker takes to see every new price. With --transport local the workers
+never see it (the old behaviour); db and unix publish through the
+invalidation bus.
+
+    DATABASE_URL=sqlite:////tmp/inval.db python benchmarks/bench_invalidation.py --transport db
+    DATABASE_URL=sqlite:////tmp/inval.db python benchmarks/bench_invalidation.py --transport unix
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('local', 'db', 'unix'), default='db')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--updates', type=int, default=50)
+    parser.add_argument('--interval-ms', type=float, default=100, help="Mean time between updates")
+    parser.add_argument('--timeout', type=float, default=3.0, help="Seconds a worker waits for the next price")
+    args = parser.parse_args()
+
+    # Read by invalidation.py at import
+    os.environ['INVALIDATION_TRANSPORT'] = args.transport
+    os.environ.setdefault('INVALIDATION_SOCKET_DIR', f'/tmp/sf_invalidation_bench_{os.getpid()}')
+
+    import app as application
+    from models import db, VirtualProduct
+
+    app = application.app
+    with app.app_context():
+        product = VirtualProduct(name=f"bench invalidation {time.time()}", product_type='cosmetic',
+                                 currency_type='sf_coins', price=1)
+        db.session.add(product)
+        db.session.commit()
+        product_id = str(product.id)
+
+    context = multiprocessing.get_context('fork')
+    ready, seen = context.Queue(), context.Queue()
+    go = context.Event()
+
+    def worker(number):
+        client = app.test_client()
+        client.get('/health')  # first request starts the bus in this process
+        application.catalog_search.index()
+        ready.put(number)
+        go.wait()
+        expected = 2
+        deadline = time.time() + args.timeout
+        while expected <= args.updates + 1:
+            record = application.catalog_search.lookup([product_id]).get(product_id)
+            if record and record['price'] >= expected:
+                # Every price up to this one is now visible
+                seen.put((number, (expected, int(record['price'])), time.time()))
+                expected = int(record['price']) + 1
+                deadline = time.time() + args.timeout
+            elif time.time() > deadline:
+                seen.put((number, (expected, args.updates + 1), None))
+                break
+            else:
+                time.sleep(0.001)
+        seen.put((number, 'stats', application.invalidation_bus.stats()))
+
+    processes = [context.Process(target=worker, args=(i,), daemon=True) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=30)
+    go.set()
+
+    committed = {}
+    with app.app_context():
+        for price in range(2, args.updates + 2):
+            time.sleep(random.expovariate(1000 / args.interval_ms))
+            db.session.get(VirtualProduct, product_id).price = price
+            db.session.commit()
+            committed[price] = time.time()
+
+    lags, missed, stats = [], 0, None
+    done = 0
+    while done < len(processes):
+        try:
+            number, prices, at = seen.get(timeout=args.timeout * (args.updates + 2))
+        except queue.Empty:
+            break
+        if prices == 'stats':
+            done += 1
+            stats = at
+        elif at is None:
+            missed += prices[1] - prices[0] + 1
+        else:
+            lags.extend((at - committed[price]) * 1000 for price in range(prices[0], prices[1] + 1))
+    for process in processes:
+        process.join(timeout=1)
+    shutil.rmtree(os.environ['INVALIDATION_SOCKET_DIR'], ignore_errors=True)
+
+    print(f"transport {args.transport}: {args.workers} workers x {args.updates} updates")
+    if lags:
+        print(f"  lag ms    p50 {statistics.median(lags):7.1f}  p99 {percentile(lags, 0.99):7.1f}  "
+              f"max {max(lags):7.1f}")
+    print(f"  missed    {missed} of {args.workers * args.updates} (a worker gives up after {args.timeout}s)")
+    if stats:
+        print(f"  typical ms {stats['typical_staleness_ms']:.0f}; one worker: polls {stats.get('polls', 0)}, "
+              f"datagrams {stats.get('datagrams_received', 0)}, self-measured lag {stats['lag'].get('catalog')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Memory and latency of the in-memory leaderboard index.
+
+Builds one metric's index (keys + per-user value map, exactly what
+leaderboard.Leaderboard holds per metric) for synthetic users with a
+long-tailed score distribution, then times top-N, rank and update calls.
+
+    python benchmarks/bench_leaderboard.py --users 10000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from leaderboard import RankedIndex  # noqa: E402
+
+
+def timed(fn, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--ops', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tracemalloc.start()
+    started = time.perf_counter()
+    values = {str(uuid.UUID(int=rng.getrandbits(128))): int(rng.paretovariate(1.2) * 100) for _ in range(args.users)}
+    index = RankedIndex((-value, user_id) for user_id, value in values.items())
+    build_s = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    user_ids = rng.sample(list(values), min(args.ops, args.users))
+
+    def update():
+        user_id = rng.choice(user_ids)
+        old = values[user_id]
+        index.remove((-old, user_id))
+        values[user_id] = old + rng.randint(1, 50)
+        index.add((-values[user_id], user_id))
+
+    print(f"users          : {args.users:,}")
+    print(f"build          : {build_s:.1f} s")
+    print(f"memory         : {current / 2**20:,.0f} MiB resident, {peak / 2**20:,.0f} MiB peak during build")
+    print(f"bytes per user : {current / args.users:.0f}")
+    print(f"top-100        : {timed(lambda: index.slice(0, 100), args.ops):.1f} us")
+    print(f"rank           : {timed(lambda: index.rank((-values[rng.choice(user_ids)], '')), args.ops):.1f} us")
+    print(f"update         : {timed(update, args.ops):.1f} us")
+
+
+if __name__ == '__main__':
+    main()
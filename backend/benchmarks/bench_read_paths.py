@@ -0,0 +1,164 @@
+"""
+CPU and allocations per request: ORM reads vs the read_queries Core fast path.
+
+Seeds one user with a transaction history and inventory plus a catalog,
+then builds each endpoint's response payload both ways (the former ORM
+route bodies are reproduced below) and reports CPU time and peak memory
+allocated per call.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_read_paths.py --transactions 200 --products 200
+"""
+
+import argparse
+from datetime import datetime
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet, WalletTransaction, VirtualProduct, UserInventory  # noqa: E402
+import read_queries  # noqa: E402
+
+
+def seed(transactions, products, items):
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        user = User(username=f"bench_{run_id}", email=f"bench_{run_id}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        wallet = UserWallet(user_id=user.id, sf_coins=1000)
+        db.session.add(wallet)
+        db.session.flush()
+        for i in range(transactions):
+            db.session.add(WalletTransaction(wallet_id=wallet.id, user_id=user.id, transaction_type='earn',
+                                             currency_type='sf_coins', amount=1, balance_before=i, balance_after=i + 1,
+                                             description="bench"))
+        catalog = [VirtualProduct(name=f"bench_{run_id}_{i}", description="bench product", product_type='cosmetic',
+                                  currency_type='sf_coins', price=10 + i, is_active=True) for i in range(products)]
+        db.session.add_all(catalog)
+        db.session.flush()
+        for product in catalog[:items]:
+            db.session.add(UserInventory(user_id=user.id, product_id=product.id))
+        db.session.commit()
+        return str(user.id)
+
+
+# Former ORM route bodies
+
+def orm_balance(user_id):
+    wallet = db.session.query(UserWallet).filter_by(user_id=user_id).first()
+    return {
+        "sf_coins": wallet.sf_coins, "premium_gems": wallet.premium_gems, "event_tokens": wallet.event_tokens,
+        "total_coins_earned": wallet.total_coins_earned, "total_coins_spent": wallet.total_coins_spent,
+        "daily_earnings": wallet.daily_earnings, "daily_earning_limit": wallet.daily_earning_limit
+    }
+
+
+def orm_history(user_id):
+    return [
+        {"id": t.id, "transaction_type": t.transaction_type, "currency_type": t.currency_type, "amount": t.amount,
+         "balance_before": t.balance_before, "balance_after": t.balance_after, "description": t.description,
+         "created_at": t.created_at.isoformat() if t.created_at else None}
+        for t in db.session.query(WalletTransaction).filter_by(user_id=user_id)
+        .order_by(WalletTransaction.created_at.desc()).all()
+    ]
+
+
+def orm_products(_):
+    return [
+        {"id": p.id, "name": p.name, "description": p.description, "product_type": p.product_type,
+         "currency_type": p.currency_type, "price": float(p.price), "is_available": p.is_available(),
+         "stock_quantity": p.stock_quantity, "icon_url": p.icon_url}
+        for p in VirtualProduct.find_active_products()
+    ]
+
+
+def orm_inventory(user_id):
+    return [
+        {"id": i.id, "product_id": i.product_id, "product_name": i.product.name if i.product else None,
+         "product_type": i.product.product_type if i.product else None, "quantity": i.quantity,
+         "remaining_uses": i.remaining_uses, "is_equipped": i.is_equipped, "is_active": i.is_active,
+         "is_consumed": i.is_consumed, "is_valid": i.is_valid()}
+        for i in UserInventory.find_by_user(user_id)
+    ]
+
+
+# Fast path, as the routes now build it
+
+def core_balance(user_id):
+    return read_queries.wallet_balance(user_id)._asdict()
+
+
+def core_history(user_id):
+    return [
+        {"id": t.id, "transaction_type": t.transaction_type, "currency_type": t.currency_type, "amount": t.amount,
+         "balance_before": t.balance_before, "balance_after": t.balance_after, "description": t.description,
+         "created_at": t.created_at.isoformat() if t.created_at else None}
+        for t in read_queries.wallet_history(user_id)
+    ]
+
+
+def core_products(_):
+    return [
+        {"id": p.id, "name": p.name, "description": p.description, "product_type": p.product_type,
+         "currency_type": p.currency_type, "price": float(p.price),
+         "is_available": p.stock_quantity is None or p.stock_quantity > 0,
+         "stock_quantity": p.stock_quantity, "icon_url": p.icon_url}
+        for p in read_queries.active_products()
+    ]
+
+
+def core_inventory(user_id):
+    now = datetime.utcnow()
+    return [
+        {"id": i.id, "product_id": i.product_id, "product_name": i.product_name, "product_type": i.product_type,
+         "quantity": i.quantity, "remaining_uses": i.remaining_uses, "is_equipped": i.is_equipped,
+         "is_active": i.is_active, "is_consumed": i.is_consumed, "is_valid": read_queries.is_item_valid(i, now)}
+        for i in read_queries.user_inventory(user_id)
+    ]
+
+
+def measure(fn, user_id, runs):
+    with app.app_context():
+        for _ in range(10):  # warm statement caches
+            fn(user_id)
+            db.session.remove()
+        started = time.process_time()
+        for _ in range(runs):
+            fn(user_id)
+            db.session.remove()
+        cpu_us = (time.process_time() - started) / runs * 1e6
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(user_id)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        db.session.remove()
+    return cpu_us, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=200)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=300)
+    args = parser.parse_args()
+
+    user_id = seed(args.transactions, args.products, args.items)
+    print(f"{'endpoint':<10} {'path':<5} {'cpu us/req':>11} {'peak KiB/req':>13}")
+    for name, orm_fn, core_fn in (('balance', orm_balance, core_balance), ('history', orm_history, core_history),
+                                  ('products', orm_products, core_products),
+                                  ('inventory', orm_inventory, core_inventory)):
+        for path, fn in (('orm', orm_fn), ('core', core_fn)):
+            cpu_us, peak = measure(fn, user_id, args.runs)
+            print(f"{name:<10} {path:<5} {cpu_us:>11,.0f} {peak / 1024:>13,.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Throughput of the bulk recall refund pipeline.
+
+Seeds one product with many completed purchases spread over a pool of
+wallets, runs its refund job in the foreground and reports purchases/s,
+the slowest chunk transaction (how long live writers could wait on a wallet
+lock), and whether every paid amount came back.
+
+    DATABASE_URL=mysql+pymysql://... python benchmarks/bench_refunds.py --purchases 1000000 --users 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import func, insert  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet, VirtualProduct, ProductPurchase, UserInventory  # noqa: E402
+import refunds  # noqa: E402
+
+
+def seed(purchases, users, price, batch=10000):
+    run_id = uuid.uuid4().hex[:8]
+    rng = random.Random(42)
+    with app.app_context():
+        product = VirtualProduct(name=f"bench_recall_{run_id}", product_type='cosmetic',
+                                 currency_type='sf_coins', price=price, is_active=True)
+        db.session.add(product)
+        user_rows = [{"id": str(uuid.uuid4()), "username": f"bench_{run_id}_{i}",
+                      "email": f"bench_{run_id}_{i}@example.com"} for i in range(users)]
+        db.session.execute(insert(User.__table__), user_rows)
+        db.session.execute(insert(UserWallet.__table__), [
+            {"id": str(uuid.uuid4()), "user_id": row["id"], "sf_coins": 0, "total_coins_spent": 0}
+            for row in user_rows
+        ])
+        db.session.commit()
+        product_id = str(product.id)
+
+        now = datetime.utcnow()
+        for start in range(0, purchases, batch):
+            rows = [{"id": str(uuid.uuid4()), "user_id": rng.choice(user_rows)["id"], "product_id": product_id,
+                     "currency_type": "sf_coins", "amount_paid": price, "status": "completed", "purchased_at": now}
+                    for _ in range(min(batch, purchases - start))]
+            db.session.execute(insert(ProductPurchase.__table__), rows)
+            db.session.execute(insert(UserInventory.__table__), [
+                {"id": str(uuid.uuid4()), "user_id": row["user_id"], "product_id": product_id,
+                 "purchase_id": row["id"], "quantity": 1, "is_active": True} for row in rows
+            ])
+            db.session.commit()
+        return product_id, [row["id"] for row in user_rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--purchases', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--price', type=int, default=250)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    product_id, user_ids = seed(args.purchases, args.users, args.price)
+    print(f"seeded         : {args.purchases:,} purchases in {time.perf_counter() - started:.1f} s")
+
+    # Time every chunk transaction
+    chunk_times = []
+    refund_chunk = refunds._refund_chunk
+
+    def timed_chunk(*a, **kw):
+        t = time.perf_counter()
+        try:
+            return refund_chunk(*a, **kw)
+        finally:
+            chunk_times.append(time.perf_counter() - t)
+
+    refunds._refund_chunk = timed_chunk
+    with app.app_context():
+        job, _ = refunds.start_refund_job(db.session.get(VirtualProduct, product_id))
+        job_id = str(job.id)
+    started = time.perf_counter()
+    refunds.run_refund_job(app, job_id)
+    elapsed = time.perf_counter() - started
+    chunk_times.sort()
+
+    with app.app_context():
+        job = db.session.get(refunds.ProductRefundJob, job_id)
+        credited = db.session.query(func.sum(UserWallet.sf_coins)).filter(UserWallet.user_id.in_(user_ids)).scalar()
+        remaining = db.session.query(func.count(ProductPurchase.id)).filter(
+            ProductPurchase.product_id == product_id, ProductPurchase.status == 'completed').scalar()
+        print(f"status         : {job.status} ({job.purchases_refunded:,} refunded, {job.purchases_skipped} skipped)")
+    print(f"refund time    : {elapsed:.1f} s incl. {refunds.REFUND_CHUNK_PAUSE_MS} ms pauses")
+    print(f"purchases/s    : {args.purchases / elapsed:,.0f}")
+    print(f"chunk p50 / max: {chunk_times[len(chunk_times) // 2] * 1000:.0f} / {chunk_times[-1] * 1000:.0f} ms")
+    expected = args.purchases * args.price
+    print(f"credited       : {credited:,} of {expected:,}  remaining purchases: {remaining}")
+    sys.exit(0 if credited == expected and remaining == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare WSGI (gunicorn + Flask) and ASGI (uvicorn + asgi.py) serving modes
+under many concurrent balance-polling clients.
+
+Start both servers against the same database first, e.g.:
+    gunicorn -w 8 --threads 4 -b :5001 app:app
+    uvicorn asgi:app --workers 2 --port 5002
+
+Then:
+    python benchmarks/bench_serving_modes.py --user-id <uuid> \
+        --target wsgi=http://localhost:5001 --target asgi=http://localhost:5002
+
+Reports throughput, p50/p99 latency and, for MySQL/PostgreSQL, the peak
+number of server-side database connections observed during the run.
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+import httpx
+from sqlalchemy import create_engine, text
+
+CONNECTION_COUNT_SQL = {
+    'mysql': "SHOW STATUS LIKE 'Threads_connected'",
+    'postgresql': "SELECT 'connections', count(*) FROM pg_stat_activity WHERE datname = current_database()",
+}
+
+
+class ConnectionSampler(threading.Thread):
+    """Poll the database for its connection count while a run is in flight"""
+
+    def __init__(self, database_url, interval=0.25):
+        super().__init__(daemon=True)
+        self.engine = create_engine(database_url, pool_size=1)
+        self.sql = CONNECTION_COUNT_SQL.get(self.engine.dialect.name)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not self.sql:
+            return
+        with self.engine.connect() as conn:
+            while not self.stopped.is_set():
+                self.peak = max(self.peak, int(conn.execute(text(self.sql)).fetchone()[1]))
+                time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.engine.dispose()
+        return self.peak if self.sql else None
+
+
+async def poll(client, url, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_target(base_url, user_id, clients, duration):
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    latencies, errors = [], []
+    url = f"{base_url}/wallet/balance/{user_id}"
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            poll(client, url, deadline, latencies, errors) for _ in range(clients)
+        ])
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='name=base_url')
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='Database to sample connection counts from')
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'db conns':>9}")
+    for target in args.target:
+        name, base_url = target.split('=', 1)
+
+        sampler = ConnectionSampler(args.database_url) if args.database_url else None
+        if sampler:
+            sampler.start()
+        latencies, errors = asyncio.run(run_target(base_url, args.user_id, args.clients, args.duration))
+        peak = sampler.stop() if sampler else None
+
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+        print(f"{name:<8} {len(latencies) / args.duration:>9.0f} {p50:>8.1f} {p99:>8.1f} "
+              f"{len(errors):>7} {peak if peak is not None else 'n/a':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Shard routing, scatter-gather and rebalancing on local SQLite shards.
+
+Builds --shards SQLite files (plus the default database) under --dir,
+creates --users users through POST /users and gives each some ledger
+rows, then:
+
+* reports how evenly the ring spread them and how many users moving to
+  one more shard would relocate (ideally 1/(N+1)),
+* times two counts per shard gathered in parallel with scatter() against
+  the same reads made one shard after another, with --latency-ms added
+  to every statement to stand in for a network round trip,
+* adds a shard, runs rebalance() and checks every balance survived.
+
+    python benchmarks/bench_shards.py --dir /tmp/shards --shards 3 --users 2000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def shard_urls(directory, count):
+    return ','.join(f"s{i}=sqlite:///{os.path.join(directory, f's{i}.db')}" for i in range(count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default='/tmp/shards')
+    parser.add_argument('--shards', type=int, default=3)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="Simulated round trip per statement")
+    args = parser.parse_args()
+
+    shutil.rmtree(args.dir, ignore_errors=True)
+    os.makedirs(args.dir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(args.dir, 'default.db')}"
+    os.environ['SHARD_DATABASE_URLS'] = shard_urls(args.dir, args.shards)
+
+    # The app reads its databases from the environment at import
+    from collections import Counter
+    from app import app, create_app
+    from sqlalchemy import event
+    from models import db, UserWallet
+    import sharding
+    from sharding import ShardRing, rebalance, shard_engines
+
+    client = app.test_client()
+    user_ids = []
+    for i in range(args.users):
+        response = client.post('/users', json={"username": f"shard_{i}", "email": f"shard_{i}@example.com"})
+        assert response.status_code == 201, response.get_json()
+        user_ids.append(response.get_json()['id'])
+        response = client.post('/wallet/earn', json={"user_id": user_ids[-1], "amount": random.randint(1, 500)})
+        assert response.status_code == 200, response.get_json()
+
+    ring = sharding.shard_ring
+    counts = Counter(ring.shard_for(user_id) for user_id in user_ids)
+    print(f"users per shard : {dict(sorted(counts.items()))} "
+          f"(max/mean {max(counts.values()) / (len(user_ids) / args.shards):.2f})")
+    grown = ShardRing([*ring.names, f"s{args.shards}"])
+    relocated = sum(ring.shard_for(user_id) != grown.shard_for(user_id) for user_id in user_ids)
+    print(f"adding a shard  : moves {relocated / len(user_ids):.1%} of users "
+          f"(ideal {1 / (args.shards + 1):.1%})")
+
+    def balances():
+        found = {}
+        for engine in shard_engines().values():
+            with engine.connect() as conn:
+                for user_id, balance in conn.execute(db.select(UserWallet.user_id, UserWallet.sf_coins)):
+                    assert str(user_id) not in found, f"{user_id} is on two shards"
+                    found[str(user_id)] = balance
+        return found
+
+    with app.app_context():
+        expected = balances()
+
+    def timed(fn):
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000
+
+    def sequential_stats():
+        with app.test_request_context():
+            for name in ring.names:
+                with sharding.use_shard(name):
+                    db.session.execute(db.text("SELECT COUNT(*) FROM wallet_transactions")).scalar()
+                    db.session.execute(db.text("SELECT COUNT(*) FROM users")).scalar()
+
+    def scattered_stats():
+        with app.test_request_context():
+            sharding.scatter(lambda: (
+                db.session.execute(db.text("SELECT COUNT(*) FROM wallet_transactions")).scalar(),
+                db.session.execute(db.text("SELECT COUNT(*) FROM users")).scalar()
+            ))
+
+    def round_trip(*_):
+        time.sleep(args.latency_ms / 1000)
+
+    with app.app_context():
+        engines = list(shard_engines().values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', round_trip)
+    print(f"GET /admin/stats: {timed(lambda: client.get('/admin/stats')):.2f} ms")
+    print(f"counts, serial  : {timed(sequential_stats):.2f} ms over {args.shards} shards")
+    print(f"counts, scatter : {timed(scattered_stats):.2f} ms over {args.shards} shards")
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', round_trip)
+
+    os.environ['SHARD_DATABASE_URLS'] = shard_urls(args.dir, args.shards + 1)
+    grown_app = create_app()
+    with grown_app.app_context():
+        started = time.perf_counter()
+        moved = rebalance()
+        elapsed = time.perf_counter() - started
+        print(f"rebalance       : {sum(moved.values()):,} users moved in {elapsed:.2f}s "
+              f"{dict(sorted(moved.items()))}")
+        actual = balances()
+    grown_client = grown_app.test_client()
+    for user_id in random.sample(user_ids, min(200, len(user_ids))):
+        response = grown_client.get(f'/wallet/balance/{user_id}')
+        assert response.get_json()['sf_coins'] == expected[user_id], user_id
+    missing = [user_id for user_id in expected if actual.get(user_id) != expected[user_id]]
+    print(f"after rebalance : {len(missing)} balances differ, "
+          f"{sum(1 for user_id in user_ids if sharding.shard_for(user_id) == f's{args.shards}'):,} users on the new shard")
+
+
+if __name__ == '__main__':
+    main()
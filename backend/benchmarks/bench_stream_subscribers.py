@@ -0,0 +1,73 @@
+"""
+Memory and fan-out latency of idle wallet streams on one event loop.
+
+Opens N event-loop-served SSE streams (as asgi.py serves them) for N
+distinct users, lets them sit idle, then publishes one change per user
+from another thread, as an after-commit hook would. Reports memory per
+idle stream and the time until every stream has written its event.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_stream_subscribers.py --streams 10000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from change_feed import ChangeFeed, AsyncSubscription, stream_events_async  # noqa: E402
+from app import app  # noqa: E402
+
+
+async def consume(feed, user_id, received, done, expected):
+    subscription = feed.subscribe(AsyncSubscription(user_id))
+    async for message in stream_events_async(feed, subscription, [], heartbeat=3600):
+        if message.startswith('id:'):
+            received[0] += 1
+            if received[0] == expected:
+                done.set()
+            return
+
+
+async def run(streams):
+    feed = ChangeFeed(app, transport='local')
+    user_ids = [str(uuid.uuid4()) for _ in range(streams)]
+    received, done = [0], asyncio.Event()
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(consume(feed, user_id, received, done, streams)) for user_id in user_ids]
+    await asyncio.sleep(0.5)
+    idle_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    print(f"{feed.hub.subscriber_count():,} idle streams, {idle_bytes / streams / 1024:.2f} KiB each "
+          f"({idle_bytes / 2**20:.1f} MiB total)")
+
+    changes = [{"id": str(uuid.uuid4()), "user_id": user_id, "transaction_type": "earn",
+                "currency_type": "sf_coins", "amount": 1, "balance_after": 1, "created_at": None}
+               for user_id in user_ids]
+    started = time.perf_counter()
+    publisher = threading.Thread(target=feed.publish, args=(changes,))
+    publisher.start()
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    publisher.join()
+    await asyncio.gather(*tasks)
+    print(f"fan-out to {received[0]:,} streams in {elapsed * 1000:.0f} ms "
+          f"({elapsed / streams * 1e6:.1f} us per stream)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(run(args.streams))
+
+
+if __name__ == '__main__':
+    main()
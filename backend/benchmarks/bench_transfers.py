@@ -0,0 +1,108 @@
+"""
+Stress test for wallet-to-wallet transfers.
+
+Creates a pool of funded wallets, then runs many threads doing random
+cross-transfers between them (deliberately including A->B / B->A pairs) and
+reports throughput, retries and whether the total amount of currency was
+conserved.
+
+    DATABASE_URL=mysql+pymysql://... python benchmarks/bench_transfers.py --wallets 50 --threads 32
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import func  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet  # noqa: E402
+from transfers import transfer_funds, validate_transfer  # noqa: E402
+
+
+def create_wallets(count, balance):
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = []
+    with app.app_context():
+        for i in range(count):
+            user = User(username=f"bench_{run_id}_{i}", email=f"bench_{run_id}_{i}@example.com")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(UserWallet(user_id=user.id, sf_coins=balance, premium_gems=0, event_tokens=0))
+            user_ids.append(str(user.id))
+        db.session.commit()
+    return user_ids
+
+
+def total_balance(user_ids):
+    with app.app_context():
+        return db.session.query(func.sum(UserWallet.sf_coins)).filter(UserWallet.user_id.in_(user_ids)).scalar()
+
+
+def worker(user_ids, deadline, stats, lock):
+    completed = retries = rejected = failed = 0
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        source, target = rng.sample(user_ids, 2)
+        transfer = validate_transfer({
+            "from_user_id": source,
+            "to_user_id": target,
+            "currency_type": "sf_coins",
+            "amount": rng.randint(1, 50)
+        })
+        with app.app_context():
+            try:
+                _, attempts = transfer_funds(transfer)
+                completed += 1
+                retries += attempts - 1
+            except ValueError:
+                rejected += 1  # insufficient funds
+            except Exception:
+                failed += 1
+    with lock:
+        stats['completed'] += completed
+        stats['retries'] += retries
+        stats['rejected'] += rejected
+        stats['failed'] += failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--balance', type=int, default=10000)
+    args = parser.parse_args()
+
+    user_ids = create_wallets(args.wallets, args.balance)
+    before = total_balance(user_ids)
+
+    stats = {'completed': 0, 'retries': 0, 'rejected': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(user_ids, deadline, stats, lock)) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    after = total_balance(user_ids)
+    print(f"transfers/s : {stats['completed'] / elapsed:.0f}")
+    print(f"completed   : {stats['completed']}")
+    print(f"retries     : {stats['retries']}")
+    print(f"rejected    : {stats['rejected']} (insufficient funds)")
+    print(f"failed      : {stats['failed']}")
+    print(f"total before: {before}  after: {after}  conserved: {before == after}")
+    sys.exit(0 if before == after else 1)
+
+
+if __name__ == '__main__':
+    main()
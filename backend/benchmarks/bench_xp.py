@@ -0,0 +1,105 @@
+"""
+XP resolution, bulk grant and recompute throughput.
+
+Times level/league resolution with the bisect over the precomputed
+thresholds against the linear scan the frontend does, then grants XP to
+N users through POST /admin/xp/grants and recomputes every total from the
+ledger with recompute_xp().
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/bench_xp.py --users 20000
+"""
+
+import argparse
+from bisect import bisect_right
+import os
+import random
+import sys
+import time
+import uuid
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, UserWallet  # noqa: E402
+from xp import LEAGUES, LEAGUE_THRESHOLDS, LEVEL_THRESHOLDS, MAX_XP_GRANTS, level_for, recompute_xp  # noqa: E402
+
+
+def linear_progress(xp):
+    """The frontend's scan, over levels and leagues"""
+    level = 1
+    for i, min_xp in enumerate(LEVEL_THRESHOLDS):
+        if xp >= min_xp:
+            level = i + 1
+        else:
+            break
+    league = LEAGUES[0]
+    for candidate in LEAGUES:
+        if xp >= candidate[1]:
+            league = candidate
+        else:
+            break
+    return level, league
+
+
+def bisect_progress(xp):
+    return level_for(xp), LEAGUES[bisect_right(LEAGUE_THRESHOLDS, xp) - 1]
+
+
+def seed(users):
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"id": user_id, "username": f"bench_{run_id}_{i}", "email": f"bench_{run_id}_{i}@example.com"}
+            for i, user_id in enumerate(user_ids)
+        ])
+        db.session.execute(insert(UserWallet), [{"user_id": user_id} for user_id in user_ids])
+        db.session.commit()
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=MAX_XP_GRANTS)
+    args = parser.parse_args()
+
+    samples = [random.randrange(0, LEVEL_THRESHOLDS[-1] * 2) for _ in range(10000)]
+    for name, resolve in (('linear', linear_progress), ('bisect', bisect_progress)):
+        seconds = timeit(lambda: [resolve(xp) for xp in samples], number=5)
+        print(f"{name:<7} resolution: {seconds / 5 / len(samples) * 1e9:,.0f} ns per user")
+
+    user_ids = seed(args.users)
+    client = app.test_client()
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    started = time.perf_counter()
+    for start in range(0, len(user_ids), args.batch):
+        response = client.post('/admin/xp/grants', json={"grants": [
+            {"user_id": user_id, "xp": random.randint(1, 5000)} for user_id in user_ids[start:start + args.batch]
+        ]})
+        assert response.status_code == 200, response.get_json()
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', count)
+    batches = -(-len(user_ids) // args.batch)
+    print(f"grants     : {len(user_ids) / elapsed:,.0f} users/s, {statements[0] / batches:.0f} statements "
+          f"per {args.batch:,}-user request")
+
+    with app.app_context():
+        started = time.perf_counter()
+        total, changed = recompute_xp()
+        elapsed = time.perf_counter() - started
+    print(f"recompute  : {total:,} users in {elapsed:.2f}s ({total / elapsed:,.0f} users/s), {changed:,} changed")
+
+
+if __name__ == '__main__':
+    main()
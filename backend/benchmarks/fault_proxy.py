@@ -0,0 +1,158 @@
+"""
+TCP proxy that injects database faults, for exercising degraded mode
+against a real MySQL or PostgreSQL server.
+
+Point DATABASE_URL at the proxy's port and switch modes while the app runs:
+
+* ``pass``   forward traffic unchanged
+* ``delay``  forward after --delay-ms per chunk (a slow network)
+* ``stall``  accept and read, but send nothing back (a hung server)
+* ``refuse`` close new and existing connections (a server that is down)
+
+    python benchmarks/fault_proxy.py --listen 127.0.0.1:13306 --target 127.0.0.1:3306
+    echo stall > /tmp/fault_proxy.mode    # or: kill -USR1 <pid> to cycle modes
+
+The mode is re-read from --mode-file on every chunk, so changes apply to
+open connections too.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+
+MODES = ('pass', 'delay', 'stall', 'refuse')
+
+
+class FaultProxy:
+    def __init__(self, listen, target, mode='pass', delay_ms=200, mode_file=None):
+        self.listen = listen
+        self.target = target
+        self.mode = mode
+        self.delay_ms = delay_ms
+        self.mode_file = mode_file
+        self._server = None
+        self._sockets = set()
+        self._lock = threading.Lock()
+
+    def current_mode(self):
+        if self.mode_file and os.path.exists(self.mode_file):
+            with open(self.mode_file) as f:
+                mode = f.read().strip()
+            if mode in MODES:
+                self.mode = mode
+        return self.mode
+
+    def set_mode(self, mode):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.mode = mode
+        if self.mode_file:
+            with open(self.mode_file, 'w') as f:
+                f.write(mode)
+        if mode == 'refuse':
+            self._close_all()
+
+    def _close_all(self):
+        with self._lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _pipe(self, source, sink):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                mode = self.current_mode()
+                while mode == 'stall':
+                    time.sleep(0.05)
+                    mode = self.current_mode()
+                if mode == 'refuse':
+                    break
+                if mode == 'delay':
+                    time.sleep(self.delay_ms / 1000)
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, sink):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _handle(self, client):
+        if self.current_mode() == 'refuse':
+            client.close()
+            return
+        try:
+            upstream = socket.create_connection(self.target)
+        except OSError:
+            client.close()
+            return
+        with self._lock:
+            self._sockets.update((client, upstream))
+        threading.Thread(target=self._pipe, args=(client, upstream), daemon=True).start()
+        threading.Thread(target=self._pipe, args=(upstream, client), daemon=True).start()
+
+    def start(self):
+        """Accept connections on a daemon thread; returns the bound (host, port)"""
+        self._server = socket.create_server(self.listen)
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self._server.getsockname()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self._handle(client)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+        self._close_all()
+
+
+def _address(value):
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', type=_address, default=('127.0.0.1', 13306))
+    parser.add_argument('--target', type=_address, required=True)
+    parser.add_argument('--mode', choices=MODES, default='pass')
+    parser.add_argument('--delay-ms', type=float, default=200)
+    parser.add_argument('--mode-file', default='/tmp/fault_proxy.mode')
+    args = parser.parse_args()
+
+    proxy = FaultProxy(args.listen, args.target, args.mode, args.delay_ms, args.mode_file)
+    proxy.set_mode(args.mode)
+
+    def cycle(*_):
+        proxy.set_mode(MODES[(MODES.index(proxy.current_mode()) + 1) % len(MODES)])
+        print(f"mode: {proxy.mode}", flush=True)
+
+    signal.signal(signal.SIGUSR1, cycle)
+    host, port = proxy.start()
+    print(f"proxying {host}:{port} -> {args.target[0]}:{args.target[1]} (mode {proxy.mode}, pid {os.getpid()})")
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""
+In-memory secondary indexes over the product catalog.
+
+Products are given dense document ids and every filterable attribute keeps
+a posting list as a Python int bitset, so a query is a handful of big-int
+ANDs:
+
+* ``product_type`` / ``currency_type`` / ``consumable`` / ``is_active``
+  map each value to a bitset.
+* Price: document ids are assigned in price order when the index is built,
+  so a price range is one contiguous bit range found by bisecting the
+  sorted price array. Products added or changed since the build sit in a
+  small unsorted delta that is checked one by one. The index is rebuilt
+  once the delta grows past ``CATALOG_MAX_DELTA``.
+* Text: lower-cased ``name`` / ``description`` tokens map to bitsets. Every
+  query term matches as a prefix, so the index also works for search-as-you-type.
+* Availability windows: products without a window are in one bitset. The
+  set of windowed products available at a time only changes at window
+  boundaries, so their mask is cached per boundary interval.
+
+The index is built from ``virtual_products`` on first use in each worker
+and maintained from committed product inserts/updates. Products changed
+by other workers are re-read when the invalidation bus reports them.
+"""
+
+from bisect import bisect_left, bisect_right
+import os
+import re
+import threading
+
+from sqlalchemy import event
+
+from invalidation import publish, register
+from models import db, VirtualProduct
+from models.routing_session import RoutingSession
+
+CATALOG_MAX_DELTA = int(os.getenv('CATALOG_MAX_DELTA', '1024'))
+CATALOG_SEARCH_MAX_LIMIT = 500
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Fields whose change moves a product between postings
+INDEXED_FIELDS = ('product_type', 'currency_type', 'price', 'consumable', 'is_active',
+                  'available_from', 'available_to', 'name', 'description')
+# Purchase requirements; changing them also re-indexes the product
+REQUIREMENT_FIELDS = ('min_user_level', 'required_achievements')
+# Everything a search result carries
+RECORD_FIELDS = ('id',) + INDEXED_FIELDS + REQUIREMENT_FIELDS + ('stock_quantity', 'icon_url')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def product_record(product):
+    """Plain dict snapshot of a VirtualProduct for the index"""
+    record = {field: getattr(product, field) for field in RECORD_FIELDS}
+    record['id'] = str(record['id'])
+    record['price'] = float(record['price'])
+    record['consumable'] = bool(record['consumable'])
+    record['is_active'] = bool(record['is_active'])
+    return record
+
+
+def is_record_available(record, at):
+    if not record['is_active']:
+        return False
+    if record['available_from'] and record['available_from'] > at:
+        return False
+    if record['available_to'] and record['available_to'] < at:
+        return False
+    if record['stock_quantity'] is not None and record['stock_quantity'] <= 0:
+        return False
+    return True
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class CatalogIndex:
+    def __init__(self, records=()):
+        records = sorted(records, key=lambda r: r['price'])
+        self._docs = []          # doc id -> record (None once superseded)
+        self._doc_by_product = {}
+        self._prices = []        # prices of the price-ordered base docs
+        self._base_count = 0
+        self._delta = []         # doc ids appended since the build
+        self._live = 0
+        self._postings = {}      # (field, value) -> bitset
+        self._tokens = {}        # token -> bitset
+        self._sorted_tokens = []
+        self._open_window = 0    # docs with no availability window
+        self._windowed = set()   # docs with one
+        self._window_cache = {}  # boundary interval -> mask of windowed docs
+        self.generation = 0      # bumped whenever a doc is (re)indexed
+
+        for record in records:
+            self._index(record)
+        self._prices = [r['price'] for r in records]
+        self._base_count = len(records)
+        self._delta = []
+        self._sorted_tokens = sorted(self._tokens)
+
+    def __len__(self):
+        return self._live.bit_count()
+
+    # Maintenance
+
+    def _index(self, record):
+        doc = len(self._docs)
+        bit = 1 << doc
+        self.generation += 1
+        self._docs.append(record)
+        self._doc_by_product[record['id']] = doc
+        self._live |= bit
+        for field in ('product_type', 'currency_type', 'consumable', 'is_active'):
+            key = (field, record[field])
+            self._postings[key] = self._postings.get(key, 0) | bit
+        for token in set(tokenize(record['name']) + tokenize(record['description'])):
+            if token not in self._tokens:
+                self._tokens[token] = 0
+                self._sorted_tokens = None
+            self._tokens[token] |= bit
+        if record['available_from'] or record['available_to']:
+            self._windowed.add(doc)
+            self._window_cache = {}
+        else:
+            self._open_window |= bit
+        return doc
+
+    def _unindex(self, doc):
+        # Stale bits in the postings are masked out by _live
+        self._live &= ~(1 << doc)
+        if doc in self._windowed:
+            self._windowed.discard(doc)
+            self._window_cache = {}
+        self._docs[doc] = None
+
+    def upsert(self, record):
+        """Add or replace a product; returns False once a rebuild is due"""
+        doc = self._doc_by_product.get(record['id'])
+        if doc is not None:
+            current = self._docs[doc]
+            if all(current[f] == record[f] for f in INDEXED_FIELDS + REQUIREMENT_FIELDS):
+                current.update(record)  # e.g. only stock changed
+                return True
+            self._unindex(doc)
+        self._delta.append(self._index(record))
+        return len(self._delta) <= CATALOG_MAX_DELTA
+
+    def records(self):
+        return [r for r in self._docs if r is not None]
+
+    def lookup(self, product_ids):
+        """{product_id: record} for the given ids that are indexed"""
+        docs = (self._doc_by_product.get(product_id) for product_id in product_ids)
+        return {self._docs[doc]['id']: self._docs[doc] for doc in docs if doc is not None}
+
+    # Queries
+
+    def _price_mask(self, min_price, max_price):
+        lo = bisect_left(self._prices, min_price) if min_price is not None else 0
+        hi = bisect_right(self._prices, max_price) if max_price is not None else self._base_count
+        mask = ((1 << hi) - 1) ^ ((1 << lo) - 1) if hi > lo else 0
+        for doc in self._delta:
+            price = self._docs[doc]['price'] if self._docs[doc] else None
+            if price is not None and (min_price is None or price >= min_price) \
+                    and (max_price is None or price <= max_price):
+                mask |= 1 << doc
+        return mask
+
+    def _text_mask(self, query):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._tokens)
+        mask = self._live
+        for term in tokenize(query):
+            term_mask = 0
+            i = bisect_left(self._sorted_tokens, term)
+            while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(term):
+                term_mask |= self._tokens[self._sorted_tokens[i]]
+                i += 1
+            mask &= term_mask
+            if not mask:
+                break
+        return mask
+
+    def _window_mask(self, at):
+        cache = self._window_cache
+        if 'starts' not in cache:
+            records = [self._docs[doc] for doc in self._windowed]
+            cache['starts'] = sorted(r['available_from'] for r in records if r['available_from'])
+            cache['ends'] = sorted(r['available_to'] for r in records if r['available_to'])
+        # Times with the same number of windows opened / closed before them
+        # see exactly the same windowed products
+        interval = (bisect_right(cache['starts'], at), bisect_left(cache['ends'], at))
+        mask = cache.get(interval)
+        if mask is None:
+            mask = 0
+            for doc in self._windowed:
+                record = self._docs[doc]
+                if (not record['available_from'] or record['available_from'] <= at) and \
+                        (not record['available_to'] or record['available_to'] >= at):
+                    mask |= 1 << doc
+            if len(cache) > 64:
+                cache = self._window_cache = {'starts': cache['starts'], 'ends': cache['ends']}
+            cache[interval] = mask
+        return self._open_window | mask
+
+    def search(self, product_type=None, currency_type=None, min_price=None, max_price=None,
+               consumable=None, active_only=True, available_at=None, q=None, limit=50, offset=0):
+        """Return (total, records) for products matching every given filter.
+
+        Results are ordered by price.
+        """
+        mask = self._live
+        for field, value in (('product_type', product_type), ('currency_type', currency_type),
+                             ('consumable', consumable), ('is_active', True if active_only else None)):
+            if value is not None:
+                mask &= self._postings.get((field, value), 0)
+        if min_price is not None or max_price is not None:
+            mask &= self._price_mask(min_price, max_price)
+        if available_at is not None:
+            mask &= self._window_mask(available_at)
+        if q:
+            mask &= self._text_mask(q)
+
+        total = mask.bit_count()
+        base_mask = mask & ((1 << self._base_count) - 1)
+        delta = sorted((self._docs[d] for d in iter_bits(mask >> self._base_count << self._base_count)),
+                       key=lambda r: r['price'])
+
+        # Merge the price-ordered base with the (sorted) delta
+        out, wanted = [], offset + limit
+        base_iter = iter_bits(base_mask)
+        next_base = next(base_iter, None)
+        i = 0
+        while len(out) < wanted and (next_base is not None or i < len(delta)):
+            if i < len(delta) and (next_base is None or delta[i]['price'] < self._docs[next_base]['price']):
+                out.append(delta[i])
+                i += 1
+            else:
+                out.append(self._docs[next_base])
+                next_base = next(base_iter, None)
+        return total, out[offset:]
+
+
+class CatalogSearch:
+    """Owns the live index for this worker and keeps it current"""
+
+    def __init__(self, app):
+        self.app = app
+        self._index = None
+        self._pid = None
+        self._builds = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self.app.app_context():
+            return CatalogIndex(product_record(p) for p in db.session.query(VirtualProduct).all())
+
+    def index(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._index = self._load()
+                    self._pid = os.getpid()
+                    self._builds += 1
+        return self._index
+
+    def version(self):
+        """Changes whenever a product is added or its indexed fields change"""
+        index = self.index()
+        return self._builds, index.generation
+
+    def rebuild(self):
+        index = self._load()
+        with self._lock:
+            self._index, self._pid = index, os.getpid()
+            self._builds += 1
+
+    def apply(self, records):
+        if self._pid != os.getpid():
+            return  # not loaded in this worker yet; the first load will see them
+        with self._lock:
+            compact = [self._index.upsert(record) for record in records]
+            if not all(compact):
+                self._index = CatalogIndex(self._index.records())
+                self._builds += 1
+
+    def refresh(self, product_ids=None):
+        """Re-read products other workers changed (None: rebuild)"""
+        if self._pid != os.getpid():
+            return
+        if product_ids is None:
+            self.rebuild()
+            return
+        with self.app.app_context():
+            products = db.session.query(VirtualProduct).filter(VirtualProduct.id.in_(list(product_ids))).all()
+            records = [product_record(p) for p in products]
+        self.apply(records)
+
+    def records(self):
+        index = self.index()
+        with self._lock:
+            return index.records()
+
+    def lookup(self, product_ids):
+        index = self.index()
+        with self._lock:
+            return index.lookup(product_ids)
+
+    def search(self, **filters):
+        index = self.index()
+        with self._lock:
+            return index.search(**filters)
+
+
+catalog_search = None
+
+
+def init_catalog_search(app):
+    global catalog_search
+    catalog_search = CatalogSearch(app)
+    register('catalog', catalog_search.refresh)
+    return catalog_search
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    if catalog_search is None:
+        return
+    flushed = {str(obj.id): product_record(obj) for obj in (*session.new, *session.dirty)
+               if isinstance(obj, VirtualProduct)}
+    if flushed:
+        session.info.setdefault('catalog_changes', {}).update(flushed)
+        publish('catalog', flushed.keys(), session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_product_changes(session):
+    changed = session.info.pop('catalog_changes', None)
+    if changed and catalog_search is not None:
+        catalog_search.apply(list(changed.values()))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('catalog_changes', None)
@@ -0,0 +1,411 @@
+"""
+Wallet change feed and server-sent event streams.
+
+Every committed ``WalletTransaction`` is a change event: the ORM writes
+(all ``UserWallet`` mutators, purchases, transfers, earn flushes) are
+picked up from the session, and Core bulk inserts report themselves with
+``publish_inserted``. Events are published after commit and never for a
+rolled-back transaction.
+
+Published events go through a transport to the ``ChangeHub`` of each
+worker, which fans them out to that user's open streams:
+
+* ``local`` (default) delivers straight to this process's hub. It is the
+  stand-in for a real bus: with several workers a stream only sees the
+  commits made by its own worker.
+* ``db`` tails ``wallet_transactions`` every ``CHANGE_FEED_POLL_MS`` while
+  the worker has subscribers, so each worker sees every commit, including
+  Core inserts. That is one query per worker per interval, however many
+  clients are connected. Rows committed up to
+  ``CHANGE_FEED_LOOKBACK_SECONDS`` after their ``created_at`` are still
+  caught.
+
+Other transports only need ``publish(changes)`` and ``ensure_started()``;
+register them in ``TRANSPORTS``.
+
+Streams send the transaction id as the SSE id. A client that reconnects
+with ``Last-Event-ID`` first gets the transactions after that one, read
+from the database. Delivery is at least once: transactions with the same
+``created_at`` as the resume point can be sent again, so clients should
+drop ids they have seen. A stream that cannot be resumed (unknown id, too
+large a gap) or whose queue overflows gets a ``resync`` event and is
+closed; the client should then refetch its balance and history.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from models import db, WalletTransaction
+from models.routing_session import RoutingSession
+from sharding import scatter
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_TRANSPORT = os.getenv('CHANGE_FEED_TRANSPORT', 'local')
+CHANGE_FEED_POLL_MS = int(os.getenv('CHANGE_FEED_POLL_MS', '500'))
+CHANGE_FEED_LOOKBACK_SECONDS = float(os.getenv('CHANGE_FEED_LOOKBACK_SECONDS', '5'))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_QUEUE_SIZE = 64
+STREAM_REPLAY_LIMIT = 500
+STREAM_RETRY_MS = 3000
+
+EVENT_FIELDS = ('id', 'user_id', 'transaction_type', 'currency_type', 'amount', 'balance_after', 'created_at')
+EVENT_COLUMNS = tuple(getattr(WalletTransaction, field) for field in EVENT_FIELDS)
+
+
+def change_event(values):
+    """Event dict from a WalletTransaction, a result row or a ledger dict"""
+    get = values.get if isinstance(values, dict) else lambda field: getattr(values, field)
+    created_at = get('created_at')
+    return {
+        "id": str(get('id')),
+        "user_id": str(get('user_id')),
+        "transaction_type": get('transaction_type'),
+        "currency_type": get('currency_type'),
+        "amount": get('amount'),
+        "balance_after": get('balance_after'),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+
+# ============================================================================
+# SSE FRAMING
+# ============================================================================
+
+HEARTBEAT = ": heartbeat\n\n"
+RETRY = f"retry: {STREAM_RETRY_MS}\n\n"
+
+
+def sse_change(change):
+    return f"id: {change['id']}\nevent: wallet\ndata: {json.dumps(change)}\n\n"
+
+
+def sse_resync(reason):
+    return f"event: resync\ndata: {json.dumps({'reason': reason})}\n\n"
+
+
+# ============================================================================
+# SUBSCRIPTIONS AND HUB
+# ============================================================================
+
+class Subscription:
+    """One stream served by a thread"""
+    __slots__ = ('user_id', 'queue', 'overflowed')
+
+    def __init__(self, user_id, maxsize=STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def push(self, change):
+        try:
+            self.queue.put_nowait(change)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """One stream served by an event loop; push() is safe from any thread"""
+    __slots__ = ('user_id', 'queue', 'loop', 'overflowed')
+
+    def __init__(self, user_id, maxsize=STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.overflowed = False
+
+    def push(self, change):
+        try:
+            self.loop.call_soon_threadsafe(self._put, change)
+        except RuntimeError:
+            pass  # loop closed; the stream is gone
+
+    def _put(self, change):
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        try:
+            async with asyncio.timeout(timeout):
+                return await self.queue.get()
+        except TimeoutError:
+            return None
+
+
+class ChangeHub:
+    """Fans events out to the subscriptions of their user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> set of subscriptions
+        self.metrics = {"delivered": 0}
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscribers.setdefault(subscription.user_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def deliver(self, changes):
+        for change in changes:
+            with self._lock:
+                subscriptions = tuple(self._subscribers.get(change['user_id'], ()))
+            for subscription in subscriptions:
+                subscription.push(change)
+            self.metrics["delivered"] += len(subscriptions)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def user_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+# ============================================================================
+# TRANSPORTS
+# ============================================================================
+
+class LocalTransport:
+    """Delivers this process's commits to this process's hub"""
+
+    def __init__(self, app, hub):
+        self.hub = hub
+
+    def publish(self, changes):
+        self.hub.deliver(changes)
+
+    def ensure_started(self):
+        pass
+
+
+class DatabaseTransport:
+    """Tails wallet_transactions so every worker sees every commit"""
+
+    def __init__(self, app, hub, interval_ms=CHANGE_FEED_POLL_MS, lookback=CHANGE_FEED_LOOKBACK_SECONDS):
+        self.app = app
+        self.hub = hub
+        self.interval = interval_ms / 1000
+        self.lookback = timedelta(seconds=lookback)
+        self._seen = set()  # ids of rows inside the lookback window
+        self._primed = False
+        self._lock = threading.Lock()
+        self._pid = None
+        self.metrics = {"polls": 0, "poll_failures": 0}
+
+    def publish(self, changes):
+        pass  # the commit itself is the publication
+
+    def ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._primed = False
+        threading.Thread(target=self._run, name='change-feed-poller', daemon=True).start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                time.sleep(self.interval)
+                if not self.hub.subscriber_count():
+                    self._primed = False
+                    continue
+                try:
+                    self.poll()
+                except Exception:
+                    self.metrics["poll_failures"] += 1
+                    logger.exception("Change feed poll failed")
+                finally:
+                    db.session.remove()
+
+    def poll(self):
+        """Deliver rows not seen before; the first poll after an idle spell only primes"""
+        since = datetime.utcnow() - self.lookback
+        stmt = select(*EVENT_COLUMNS).where(WalletTransaction.created_at >= since)
+        rows = sorted(
+            (row for shard_rows in scatter(lambda: db.session.execute(stmt).all()).values() for row in shard_rows),
+            key=lambda row: (row.created_at, row.id)
+        )
+        changes = [change_event(row) for row in rows]
+        fresh = [change for change in changes if change['id'] not in self._seen]
+        self._seen = {change['id'] for change in changes}
+        self.metrics["polls"] += 1
+        if fresh and self._primed:
+            self.hub.deliver(fresh)
+        self._primed = True
+
+
+TRANSPORTS = {
+    'local': LocalTransport,
+    'db': DatabaseTransport,
+}
+
+
+# ============================================================================
+# FEED
+# ============================================================================
+
+def anchor_query(user_id, event_id):
+    """created_at of the user's transaction event_id"""
+    return select(WalletTransaction.created_at).where(
+        WalletTransaction.id == event_id, WalletTransaction.user_id == user_id
+    )
+
+
+def replay_query(user_id, event_id, anchor, limit=STREAM_REPLAY_LIMIT):
+    """The user's transactions from the anchor on, one more than limit"""
+    return (
+        select(*EVENT_COLUMNS)
+        .where(WalletTransaction.user_id == user_id, WalletTransaction.created_at >= anchor,
+               WalletTransaction.id != event_id)
+        .order_by(WalletTransaction.created_at, WalletTransaction.id)
+        .limit(limit + 1)
+    )
+
+
+def replay_result(rows, limit=STREAM_REPLAY_LIMIT):
+    """(changes, None) or (None, resync reason)"""
+    if len(rows) > limit:
+        return None, "gap too large"
+    return [change_event(row) for row in rows], None
+
+
+class ChangeFeed:
+    def __init__(self, app, transport=CHANGE_FEED_TRANSPORT):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown change feed transport '{transport}'")
+        self.hub = ChangeHub()
+        self.transport_name = transport
+        self.transport = TRANSPORTS[transport](app, self.hub)
+
+    def publish(self, changes):
+        self.transport.publish(changes)
+
+    def subscribe(self, subscription):
+        self.transport.ensure_started()
+        self.hub.subscribe(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.hub.unsubscribe(subscription)
+
+    def replay(self, user_id, last_event_id):
+        """(changes after last_event_id, None) or (None, resync reason)"""
+        anchor = db.session.execute(anchor_query(user_id, last_event_id)).scalar()
+        if anchor is None:
+            return None, "unknown last event id"
+        return replay_result(db.session.execute(replay_query(user_id, last_event_id, anchor)).all())
+
+    def stats(self):
+        return {
+            "transport": self.transport_name,
+            "subscribers": self.hub.subscriber_count(),
+            "users": self.hub.user_count(),
+            **self.hub.metrics,
+            **getattr(self.transport, 'metrics', {}),
+        }
+
+
+def stream_events(feed, subscription, backlog, resync=None, heartbeat=STREAM_HEARTBEAT_SECONDS):
+    """SSE body for a thread-served stream; unsubscribes when the client goes away"""
+    try:
+        yield RETRY
+        if resync:
+            yield sse_resync(resync)
+            return
+        sent = set()
+        for change in backlog:
+            sent.add(change['id'])
+            yield sse_change(change)
+        while True:
+            change = subscription.get(heartbeat)
+            if subscription.overflowed:
+                yield sse_resync("client too slow")
+                return
+            if change is None:
+                yield HEARTBEAT
+            elif change['id'] not in sent:
+                yield sse_change(change)
+    finally:
+        feed.unsubscribe(subscription)
+
+
+async def stream_events_async(feed, subscription, backlog, resync=None, heartbeat=STREAM_HEARTBEAT_SECONDS):
+    """SSE body for an event-loop-served stream"""
+    try:
+        yield RETRY
+        if resync:
+            yield sse_resync(resync)
+            return
+        sent = set()
+        for change in backlog:
+            sent.add(change['id'])
+            yield sse_change(change)
+        while True:
+            change = await subscription.get(heartbeat)
+            if subscription.overflowed:
+                yield sse_resync("client too slow")
+                return
+            if change is None:
+                yield HEARTBEAT
+            elif change['id'] not in sent:
+                yield sse_change(change)
+    finally:
+        feed.unsubscribe(subscription)
+
+
+change_feed = None
+
+
+def init_change_feed(app):
+    global change_feed
+    change_feed = ChangeFeed(app)
+    return change_feed
+
+
+def publish_inserted(session, rows):
+    """Queue Core-inserted ledger rows for publication when session commits"""
+    session.info.setdefault('wallet_changes', []).extend(change_event(row) for row in rows)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_wallet_changes(session, flush_context):
+    changes = [change_event(obj) for obj in session.new if isinstance(obj, WalletTransaction)]
+    if changes:
+        session.info.setdefault('wallet_changes', []).extend(changes)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _publish_wallet_changes(session):
+    changes = session.info.pop('wallet_changes', None)
+    if changes and change_feed is not None:
+        change_feed.publish(changes)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_wallet_changes(session):
+    session.info.pop('wallet_changes', None)
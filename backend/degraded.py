@@ -0,0 +1,374 @@
+"""
+Degraded-mode serving when the database stalls.
+
+Three layers keep a slow or unreachable database from tying up every
+worker:
+
+* **Statement timeouts by endpoint class.** Each request is classed as
+  ``read`` (GET), ``write`` (other methods), ``admin`` (``/admin/*``) or
+  ``export`` (``/admin/export/*``), and every statement it runs gets that
+  class's ``DB_<CLASS>_TIMEOUT_MS`` (0 = none). The limit is enforced by
+  the server on MySQL (``max_execution_time`` for reads,
+  ``innodb_lock_wait_timeout`` for lock waits) and PostgreSQL
+  (``statement_timeout``), and by a progress handler on SQLite (not under
+  aiosqlite, which has none). Socket and pool timeouts in
+  ``engine_options`` bound what the server cannot.
+  Background threads and CLIs run without a limit.
+* **A circuit breaker per engine.** ``DB_BREAKER_FAILURES`` consecutive
+  connection errors or timeouts open it. While it is open, sessions fail
+  with ``DatabaseUnavailable`` before checking out a connection, and those
+  requests answer 503 with ``Retry-After``. After ``DB_BREAKER_RESET_SECONDS``
+  one request is let through as a probe; its success closes the breaker.
+* **Last-known-good responses.** Views wrapped in ``@serve_stale`` keep
+  their latest 200 body per URL (``STALE_CACHE_SIZE`` URLs, up to
+  ``STALE_MAX_AGE_SECONDS`` old). When the view fails with a 5xx, the
+  cached body is served with ``"stale": true``, an ``Age`` header and
+  ``Warning: 110``.
+
+Breakers and caches are per worker. ``benchmarks/bench_degraded.py`` drives
+an outage through a fault-injecting proxy (``benchmarks/fault_proxy.py``).
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import json
+import math
+import os
+import threading
+import time
+
+from flask import g, has_request_context, jsonify, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from models.routing_session import bind_checks
+
+STATEMENT_TIMEOUTS_MS = {
+    'read': int(os.getenv('DB_READ_TIMEOUT_MS', '3000')),
+    'write': int(os.getenv('DB_WRITE_TIMEOUT_MS', '5000')),
+    'admin': int(os.getenv('DB_ADMIN_TIMEOUT_MS', '30000')),
+    'export': int(os.getenv('DB_EXPORT_TIMEOUT_MS', '0')),
+}
+DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+DB_BREAKER_RESET_SECONDS = float(os.getenv('DB_BREAKER_RESET_SECONDS', '10'))
+STALE_CACHE_SIZE = int(os.getenv('STALE_CACHE_SIZE', '10000'))
+STALE_MAX_AGE_SECONDS = float(os.getenv('STALE_MAX_AGE_SECONDS', '3600'))
+
+# Driver error codes that are lock conflicts, not outages
+NOT_OUTAGES = (1213, '40001', '40P01')
+# MySQL: statement interrupted by max_execution_time
+MYSQL_TIMEOUT_ERRORS = (3024,)
+
+SQLITE_PROGRESS_STEPS = 1000
+
+# Statement timeout (ms) of the current request; None outside requests
+_statement_timeout = ContextVar('statement_timeout', default=None)
+
+
+class DatabaseUnavailable(SQLAlchemyError):
+    """Raised instead of touching a database whose circuit is open"""
+
+
+def current_statement_timeout():
+    return _statement_timeout.get()
+
+
+@contextmanager
+def statement_timeout(timeout_ms):
+    """Apply ``timeout_ms`` (None = no limit) to statements run in the block"""
+    token = _statement_timeout.set(timeout_ms)
+    try:
+        yield
+    finally:
+        _statement_timeout.reset(token)
+
+
+def endpoint_class(path, method):
+    if path.startswith('/admin/export/'):
+        return 'export'
+    if path.startswith('/admin/'):
+        return 'admin'
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+
+# ============================================================================
+# CIRCUIT BREAKER
+# ============================================================================
+
+class CircuitBreaker:
+    """closed -> open after ``failure_threshold`` consecutive failures ->
+    half-open after ``reset_seconds`` (one probing thread) -> closed on success"""
+
+    def __init__(self, name, failure_threshold=DB_BREAKER_FAILURES, reset_seconds=DB_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = None  # (thread id, started) of the half-open probe
+        self._lock = threading.Lock()
+        self.metrics = {"opened": 0, "rejected": 0, "failures": 0}
+
+    def allow(self):
+        """Whether the calling thread may use the database now"""
+        if self.state == 'closed':
+            return True
+        now = time.monotonic()
+        me = threading.get_ident()
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self._probe and self._probe[0] == me:
+                return True
+            probe_due = now - self._opened_at >= self.reset_seconds
+            probe_stuck = self._probe and now - self._probe[1] >= self.reset_seconds
+            if probe_due and (self._probe is None or probe_stuck):
+                self.state = 'half_open'
+                self._probe = (me, now)
+                return True
+            self.metrics["rejected"] += 1
+            return False
+
+    def record_success(self):
+        if self.state == 'closed' and not self._failures:
+            return
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._probe = None
+
+    def record_failure(self):
+        with self._lock:
+            self.metrics["failures"] += 1
+            self._failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._probe = None
+                self.metrics["opened"] += 1
+
+    def retry_after(self):
+        return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self._failures, **self.metrics}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(engine):
+    key = engine.url.render_as_string(hide_password=True)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(key))
+    return breaker
+
+
+def breaker_stats():
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+def check_circuit(engine):
+    """Raise DatabaseUnavailable if ``engine``'s circuit is open"""
+    breaker = breaker_for(engine)
+    if not breaker.allow():
+        if has_request_context():
+            g.database_unavailable = breaker.retry_after()
+        raise DatabaseUnavailable(f"Database unavailable, retry in {breaker.retry_after()}s")
+
+
+def _is_outage(context):
+    if context.is_disconnect:
+        return True
+    orig = context.original_exception
+    if isinstance(orig, DatabaseUnavailable):
+        return False
+    code = getattr(orig, 'pgcode', None) or (orig.args[0] if getattr(orig, 'args', None) else None)
+    if code in NOT_OUTAGES:
+        return False
+    if code in MYSQL_TIMEOUT_ERRORS:
+        return True
+    dbapi = context.dialect.dbapi if context.dialect is not None else None
+    return dbapi is not None and isinstance(orig, (dbapi.OperationalError, dbapi.InterfaceError))
+
+
+# ============================================================================
+# STATEMENT TIMEOUTS
+# ============================================================================
+
+def _sqlite_connection(conn):
+    """The pysqlite connection behind ``conn``, or None (async drivers have
+    no progress handler)"""
+    dbapi_connection = conn.connection.dbapi_connection
+    return dbapi_connection if hasattr(dbapi_connection, 'set_progress_handler') else None
+
+
+def _apply_timeout(conn, cursor, timeout_ms):
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        dbapi_connection = _sqlite_connection(conn)
+        if dbapi_connection is None:
+            return
+        if timeout_ms:
+            deadline = time.monotonic() + timeout_ms / 1000
+            dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+        else:
+            dbapi_connection.set_progress_handler(None, 0)
+        return
+    # Session settings persist on the pooled connection; only send changes
+    if conn.info.get('statement_timeout_ms') == timeout_ms:
+        return
+    if dialect == 'postgresql':
+        cursor.execute(f"SET statement_timeout = {int(timeout_ms or 0)}")
+    elif dialect == 'mysql':
+        cursor.execute(f"SET SESSION max_execution_time = {int(timeout_ms or 0)}")
+        # Lock waits are what a stalled write usually sits in; whole seconds
+        cursor.execute(f"SET SESSION innodb_lock_wait_timeout = {max(1, math.ceil((timeout_ms or 50000) / 1000))}")
+    conn.info['statement_timeout_ms'] = timeout_ms
+
+
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    check_circuit(conn.engine)
+    _apply_timeout(conn, cursor, _statement_timeout.get())
+
+
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name == 'sqlite' and _sqlite_connection(conn) is not None:
+        _sqlite_connection(conn).set_progress_handler(None, 0)
+    breaker_for(conn.engine).record_success()
+
+
+def _statement_failed(context):
+    conn = context.connection
+    if conn is not None and not conn.closed and conn.dialect.name == 'sqlite' and not context.is_disconnect \
+            and _sqlite_connection(conn) is not None:
+        _sqlite_connection(conn).set_progress_handler(None, 0)
+    if context.engine is not None and _is_outage(context):
+        breaker_for(context.engine).record_failure()
+
+
+def _forget_timeout(conn):
+    # A SET inside a rolled-back PostgreSQL transaction is undone too
+    conn.info.pop('statement_timeout_ms', None)
+
+
+# ============================================================================
+# LAST-KNOWN-GOOD RESPONSES
+# ============================================================================
+
+class StaleCache:
+    """LRU of the latest 200 JSON body per URL"""
+
+    def __init__(self, size=STALE_CACHE_SIZE, max_age=STALE_MAX_AGE_SECONDS):
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored at, body bytes)
+        self.metrics = {"stored": 0, "served": 0, "misses": 0}
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = (time.time(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self.metrics["stored"] += 1
+
+    def get(self, key):
+        """(age in seconds, body) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.max_age:
+                self.metrics["misses"] += 1
+                return None
+            self.metrics["served"] += 1
+            return time.time() - entry[0], entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), **self.metrics}
+
+
+stale_cache = StaleCache()
+
+
+def _stale_response(age, body):
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = {**data, "stale": True, "stale_age_seconds": int(age)}
+    response = jsonify(data)
+    response.headers['Age'] = str(int(age))
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+
+def serve_stale(view):
+    """Keep the view's latest 200 JSON body per URL and serve it, marked
+    stale, when the view fails with a 5xx or a database error"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.full_path
+        try:
+            response = make_response(view(*args, **kwargs))
+        except SQLAlchemyError:
+            cached = stale_cache.get(key)
+            if cached is None:
+                raise
+            return _stale_response(*cached)
+        if response.status_code == 200 and response.mimetype == 'application/json':
+            stale_cache.put(key, response.get_data())
+        elif response.status_code >= 500:
+            cached = stale_cache.get(key)
+            if cached is not None:
+                return _stale_response(*cached)
+        return response
+    return wrapper
+
+
+# ============================================================================
+# REQUEST HOOKS
+# ============================================================================
+
+def _start_request():
+    _statement_timeout.set(STATEMENT_TIMEOUTS_MS.get(endpoint_class(request.path, request.method)) or None)
+
+
+def _mark_unavailable(response):
+    retry_after = g.pop('database_unavailable', None)
+    if retry_after is not None and response.status_code == 500:
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _end_request(exc=None):
+    # Worker threads serve many requests; don't leak the limit to the next
+    _statement_timeout.set(None)
+
+
+ENGINE_EVENTS = (
+    ('before_cursor_execute', _before_statement),
+    ('after_cursor_execute', _after_statement),
+    ('handle_error', _statement_failed),
+    ('rollback', _forget_timeout),
+)
+
+
+def init_degraded_mode(app):
+    """Statement timeouts and breakers on every engine, sessions refusing
+    open circuits through ``bind_checks``, and 503s for those requests"""
+    for name, listener in ENGINE_EVENTS:
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    if check_circuit not in bind_checks:
+        bind_checks.append(check_circuit)
+    app.before_request(_start_request)
+    app.after_request(_mark_unavailable)
+    app.teardown_request(_end_request)
@@ -0,0 +1,360 @@
+"""
+Write-behind coalescing of high-frequency SF Coin earn events.
+
+When enabled (``EARN_COALESCE_ENABLED=1``), ``/wallet/earn`` requests that
+send ``"coalesce": true`` are accepted into a per-user in-memory accumulator
+instead of writing to the database. Every accepted event is first appended
+to a local log (``EARN_LOG_DIR``) so it survives a crash. A background
+thread flushes the accumulator every ``EARN_FLUSH_INTERVAL_MS`` or as soon
+as ``EARN_FLUSH_MAX_EVENTS`` events are pending. Each user then gets one
+wallet UPDATE and one aggregated ``WalletTransaction``.
+
+The daily earning limit is checked against committed + pending earnings
+when an event is accepted. It is enforced again against the locked wallet
+row at flush time, because other workers may have earned for the same user
+in the meantime.
+
+Each flush batch owns one log segment, held under an exclusive ``flock``
+by the worker writing it. Segments whose owner died are picked up by any
+worker. Their ledger rows carry ``reference_type='earn_batch:<segment>'``,
+so replaying a segment that was already committed is a no-op.
+"""
+
+from dataclasses import dataclass, field
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from models import db, UserWallet, WalletTransaction
+
+logger = logging.getLogger(__name__)
+
+EARN_COALESCE_ENABLED = os.getenv('EARN_COALESCE_ENABLED', '0') == '1'
+EARN_FLUSH_INTERVAL_MS = int(os.getenv('EARN_FLUSH_INTERVAL_MS', '500'))
+EARN_FLUSH_MAX_EVENTS = int(os.getenv('EARN_FLUSH_MAX_EVENTS', '1000'))
+EARN_LOG_DIR = os.getenv('EARN_LOG_DIR', os.path.join(os.path.dirname(__file__), 'earn_log'))
+EARN_LOG_FSYNC = os.getenv('EARN_LOG_FSYNC', '1') == '1'
+# How long an idle user's cached daily total is trusted before re-reading it
+EARN_DAILY_CACHE_SECONDS = float(os.getenv('EARN_DAILY_CACHE_SECONDS', '60'))
+
+BATCH_REFERENCE_PREFIX = 'earn_batch:'
+
+
+@dataclass
+class PendingEarn:
+    """Accumulated, not yet flushed earnings of one user"""
+    amount: int = 0
+    events: int = 0
+    first_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class DailyAllowance:
+    """Committed daily earnings and limit as last read from the wallet"""
+    committed: int
+    limit: int
+    loaded_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class FlushBatch:
+    segment: str
+    file: object  # open, flock-ed segment file
+    pending: dict
+    # Set for replayed or failed batches that may already be committed
+    verify_committed: bool = False
+
+
+class EarnCoalescer:
+    def __init__(self, app, log_dir=EARN_LOG_DIR, flush_interval_ms=EARN_FLUSH_INTERVAL_MS,
+                 flush_max_events=EARN_FLUSH_MAX_EVENTS, fsync=EARN_LOG_FSYNC):
+        self.app = app
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_events = flush_max_events
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}     # user_id -> PendingEarn
+        self._in_flight = []   # FlushBatch objects not yet committed
+        self._allowances = {}  # user_id -> DailyAllowance
+        self._pending_events = 0
+        self._segment = None
+        self._log = None
+        self._thread = None
+        self._pid = None
+
+        self.metrics = {
+            "accepted_events": 0,
+            "rejected_events": 0,
+            "flushed_events": 0,
+            "flushed_batches": 0,
+            "dropped_events": 0,
+            "flush_failures": 0,
+            "last_flush_lag_ms": 0.0,
+            "max_flush_lag_ms": 0.0,
+            "last_flush_duration_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # Accepting events
+    # ------------------------------------------------------------------
+
+    def submit(self, user_id, amount, description=None):
+        """Accept an earn event; raises ValueError / LookupError like the sync path.
+
+        Returns the user's pending (unflushed) amount after this event.
+        """
+        self._ensure_started()
+        user_id = str(user_id)
+        allowance = self._get_allowance(user_id)
+
+        with self._lock:
+            pending = self._pending.get(user_id)
+            pending_amount = (pending.amount if pending else 0) + self._in_flight_amount(user_id)
+            if allowance.committed + pending_amount + amount > allowance.limit:
+                self.metrics["rejected_events"] += 1
+                raise ValueError("Daily earning limit exceeded")
+
+            self._append_log({"user_id": user_id, "amount": amount, "description": description})
+            if pending is None:
+                pending = self._pending[user_id] = PendingEarn()
+            pending.amount += amount
+            pending.events += 1
+            self._pending_events += 1
+            self.metrics["accepted_events"] += 1
+            should_flush = self._pending_events >= self.flush_max_events
+
+        if should_flush:
+            self._wakeup.set()
+        return pending_amount + amount
+
+    def forget(self, user_id):
+        """Drop a user's cached daily total (e.g. after a daily reset)"""
+        with self._lock:
+            self._allowances.pop(str(user_id), None)
+
+    def _get_allowance(self, user_id):
+        with self._lock:
+            allowance = self._allowances.get(user_id)
+            if allowance and time.monotonic() - allowance.loaded_at < EARN_DAILY_CACHE_SECONDS:
+                return allowance
+
+        row = db.session.query(UserWallet.daily_earnings, UserWallet.daily_earning_limit) \
+            .filter_by(user_id=user_id).first()
+        if row is None:
+            raise LookupError("Wallet not found")
+
+        allowance = DailyAllowance(committed=row.daily_earnings or 0, limit=row.daily_earning_limit or 0)
+        with self._lock:
+            self._allowances[user_id] = allowance
+        return allowance
+
+    def _in_flight_amount(self, user_id):
+        return sum(batch.pending[user_id].amount for batch in self._in_flight if user_id in batch.pending)
+
+    # ------------------------------------------------------------------
+    # Durable log
+    # ------------------------------------------------------------------
+
+    def _open_segment(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._segment = uuid.uuid4().hex
+        # Lock before the file becomes visible as *.log to other workers
+        tmp_path = os.path.join(self.log_dir, f"{self._segment}.tmp")
+        self._log = open(tmp_path, 'a', encoding='utf-8')
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX)
+        os.rename(tmp_path, os.path.join(self.log_dir, f"{self._segment}.log"))
+
+    def _append_log(self, event):
+        self._log.write(json.dumps(event) + '\n')
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def _rotate(self):
+        """Swap out the accumulator and its log segment; caller holds the lock"""
+        batch = FlushBatch(segment=self._segment, file=self._log, pending=self._pending)
+        self._pending = {}
+        self._pending_events = 0
+        self._open_segment()
+        return batch
+
+    def _recover(self):
+        """Queue log segments whose owning process has died for flushing"""
+        if not os.path.isdir(self.log_dir):
+            return
+        with self._lock:
+            known = {self._segment} | {batch.segment for batch in self._in_flight}
+        for name in sorted(os.listdir(self.log_dir)):
+            segment = name[:-len('.log')]
+            if not name.endswith('.log') or segment in known:
+                continue
+            try:
+                f = open(os.path.join(self.log_dir, name), 'r+', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()  # owned by a live worker
+                continue
+            if not os.path.exists(f.name):
+                f.close()  # flushed and removed while we were opening it
+                continue
+
+            pending = {}
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn final write
+                entry = pending.setdefault(event['user_id'], PendingEarn())
+                entry.amount += event['amount']
+                entry.events += 1
+            with self._lock:
+                self._in_flight.append(FlushBatch(segment=segment, file=f, pending=pending, verify_committed=True))
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        # Started lazily so forked workers each get their own thread and log
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending, self._in_flight, self._pending_events = {}, [], 0
+            self._open_segment()
+            self._thread = threading.Thread(target=self._run, name='earn-coalescer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._recover()
+                self.flush()
+            except Exception:
+                logger.exception("Earn coalescer flush failed")
+
+    def flush(self):
+        """Write all pending earnings to the database"""
+        with self._flush_lock:
+            with self._lock:
+                if self._log is None:
+                    return
+                if self._pending:
+                    self._in_flight.append(self._rotate())
+                batches = list(self._in_flight)
+
+            for batch in batches:
+                started = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        allowances, flushed, dropped = self._write_batch(batch)
+                except Exception:
+                    self.metrics["flush_failures"] += 1
+                    # The commit may have landed before the error surfaced
+                    batch.verify_committed = True
+                    raise  # leave the batch in flight; it is retried next tick
+
+                os.remove(os.path.join(self.log_dir, f"{batch.segment}.log"))
+                batch.file.close()
+                with self._lock:
+                    self._in_flight.remove(batch)
+                    self._allowances.update(allowances)
+
+                finished = time.monotonic()
+                if batch.pending:
+                    lag_ms = (finished - min(p.first_at for p in batch.pending.values())) * 1000
+                    self.metrics["last_flush_lag_ms"] = lag_ms
+                    self.metrics["max_flush_lag_ms"] = max(self.metrics["max_flush_lag_ms"], lag_ms)
+                self.metrics["last_flush_duration_ms"] = (finished - started) * 1000
+                self.metrics["flushed_batches"] += 1
+                self.metrics["flushed_events"] += flushed
+                self.metrics["dropped_events"] += dropped
+
+    def _write_batch(self, batch):
+        """Apply one batch in a single transaction.
+
+        Returns (refreshed allowances, flushed events, dropped events).
+        """
+        reference_type = BATCH_REFERENCE_PREFIX + batch.segment
+        allowances = {}
+        flushed = dropped = 0
+        try:
+            user_ids = set(batch.pending)
+            if batch.verify_committed:
+                user_ids -= {
+                    str(user_id) for (user_id,) in db.session.query(WalletTransaction.user_id)
+                    .filter(WalletTransaction.reference_type == reference_type)
+                }
+
+            wallets = UserWallet.lock_by_user_ids(user_ids)
+            for user_id in user_ids:
+                pending = batch.pending[user_id]
+                wallet = wallets.get(user_id)
+                if wallet is None:
+                    dropped += pending.events
+                    continue
+
+                # The wallet row is the source of truth for the daily limit
+                amount = min(pending.amount, max(wallet.daily_earning_limit - wallet.daily_earnings, 0))
+                if amount < pending.amount:
+                    logger.warning("Dropped %s coalesced coins over daily limit for user %s",
+                                   pending.amount - amount, user_id)
+                if amount > 0:
+                    balance_before = wallet.sf_coins
+                    wallet.sf_coins += amount
+                    wallet.daily_earnings += amount
+                    wallet.total_coins_earned += amount
+                    db.session.add(WalletTransaction(
+                        wallet_id=wallet.id,
+                        user_id=wallet.user_id,
+                        transaction_type='earn',
+                        currency_type='sf_coins',
+                        amount=amount,
+                        balance_before=balance_before,
+                        balance_after=wallet.sf_coins,
+                        reference_type=reference_type,
+                        description=f"Earned SF Coins ({pending.events} events)"
+                    ))
+                    flushed += pending.events
+                else:
+                    dropped += pending.events
+                allowances[user_id] = DailyAllowance(wallet.daily_earnings, wallet.daily_earning_limit)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return allowances, flushed, dropped
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            oldest = [p.first_at for p in self._pending.values()]
+            oldest += [p.first_at for b in self._in_flight for p in b.pending.values()]
+            return {
+                "enabled": True,
+                "queue_depth": self._pending_events + sum(
+                    p.events for b in self._in_flight for p in b.pending.values()
+                ),
+                "pending_users": len(self._pending),
+                "in_flight_batches": len(self._in_flight),
+                "oldest_pending_ms": (now - min(oldest)) * 1000 if oldest else 0.0,
+                **self.metrics
+            }
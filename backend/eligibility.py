@@ -0,0 +1,186 @@
+"""
+Per-user "what can I buy" evaluation over the product catalog.
+
+Achievement ids are mapped to bit positions, so every product's
+``required_achievements`` compiles to an int mask and a user's unlocked
+achievements to another. Active products are grouped by requirement mask
+and sorted by ``min_user_level`` within a group, so evaluating the whole
+catalog for a user is one ``required & ~user_mask`` test per distinct
+requirement set plus a bisect on the level.
+
+The compiled table is built from the catalog search index and recompiled
+when that changes. Per-user results are cached until the user's level or
+achievements change, in this worker or (through the invalidation bus) in
+another, and for at most ``ELIGIBILITY_CACHE_TTL_SECONDS``.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+import os
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from invalidation import publish, register
+from models import db, User
+from models.routing_session import RoutingSession
+
+ELIGIBILITY_CACHE_SIZE = int(os.getenv('ELIGIBILITY_CACHE_SIZE', '100000'))
+ELIGIBILITY_CACHE_TTL_SECONDS = float(os.getenv('ELIGIBILITY_CACHE_TTL_SECONDS', '60'))
+
+
+class EligibilityTable:
+    """Catalog requirements compiled to achievement bitmasks"""
+
+    def __init__(self, records):
+        self.bits = {}  # achievement id -> bit position
+        groups = defaultdict(list)
+        for record in records:
+            if not record['is_active']:
+                continue
+            mask = 0
+            for achievement_id in record['required_achievements'] or ():
+                bit = self.bits.setdefault(str(achievement_id), len(self.bits))
+                mask |= 1 << bit
+            groups[mask].append(record)
+
+        self._groups = []  # (required mask, sorted min levels, records)
+        for mask, group in groups.items():
+            group.sort(key=lambda r: r['min_user_level'] or 0)
+            self._groups.append((mask, [r['min_user_level'] or 0 for r in group], group))
+
+    def user_mask(self, achievements):
+        # Achievements no product requires have no bit and cannot matter
+        mask = 0
+        for achievement_id in achievements or ():
+            bit = self.bits.get(str(achievement_id))
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def evaluate(self, level, achievements):
+        """Active products a user meets the requirements for, by price"""
+        missing = ~self.user_mask(achievements)
+        level = level or 0
+        out = []
+        for mask, levels, group in self._groups:
+            if mask & missing:
+                continue
+            out.extend(group[:bisect_right(levels, level)])
+        out.sort(key=lambda r: r['price'])
+        return out
+
+
+class EligibleCatalog:
+    """Compiled table plus an LRU of per-user results for this worker"""
+
+    def __init__(self, catalog_search, cache_size=ELIGIBILITY_CACHE_SIZE, ttl=ELIGIBILITY_CACHE_TTL_SECONDS):
+        self.catalog_search = catalog_search
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._table = None
+        self._version = None
+        self._cache = OrderedDict()  # user_id -> (catalog version, expires, level, records)
+        # Bumped by every invalidation, so a read that started earlier
+        # does not cache what it read
+        self._generation = 0
+        self._invalidated = {}       # user_id -> generation of their last invalidation
+        self._cleared = 0            # generation of the last invalidation of everyone
+
+    def table(self):
+        version = self.catalog_search.version()
+        if version != self._version:
+            table = EligibilityTable(self.catalog_search.records())
+            with self._lock:
+                self._table, self._version = table, version
+        return self._table, version
+
+    def _load_user(self, user_id):
+        row = db.session.execute(
+            select(User.level, User.achievements).where(User.id == user_id)
+        ).first()
+        return (row.level or 1, row.achievements) if row else None
+
+    def eligible_for(self, user_id):
+        """(level, eligible records) for a user, or None if there is no such user"""
+        user_id = str(user_id)
+        table, version = self.table()
+        now = time.monotonic()
+        with self._lock:
+            started = self._generation
+            entry = self._cache.get(user_id)
+            if entry and entry[0] == version and entry[1] > now:
+                self._cache.move_to_end(user_id)
+                return entry[2], entry[3]
+
+        user = self._load_user(user_id)
+        if user is None:
+            return None
+        level, achievements = user
+        records = table.evaluate(level, achievements)
+        with self._lock:
+            if self._invalidated.get(user_id, self._cleared) > started:
+                return level, records  # changed while we read; the next lookup reads again
+            self._cache[user_id] = (version, now + self.ttl, level, records)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return level, records
+
+    def invalidate(self, user_ids=None):
+        """Drop these users' results (None: everyone's)"""
+        with self._lock:
+            self._generation += 1
+            if user_ids is None or len(self._invalidated) > self.cache_size:
+                # Forgetting who changed only stops reads in flight from caching
+                self._cleared = self._generation
+                self._invalidated.clear()
+            if user_ids is None:
+                self._cache.clear()
+                return
+            for user_id in user_ids:
+                user_id = str(user_id)
+                self._cache.pop(user_id, None)
+                self._invalidated[user_id] = self._generation
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_users": len(self._cache),
+                "achievement_bits": len(self._table.bits) if self._table else 0,
+                "requirement_groups": len(self._table._groups) if self._table else 0
+            }
+
+
+eligible_catalog = None
+
+
+def init_eligible_catalog(catalog_search):
+    global eligible_catalog
+    eligible_catalog = EligibleCatalog(catalog_search)
+    register('eligibility', eligible_catalog.invalidate)
+    return eligible_catalog
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_user_changes(session, flush_context):
+    if eligible_catalog is None:
+        return
+    flushed = {str(obj.id) for obj in session.dirty if isinstance(obj, User)}
+    if flushed:
+        session.info.setdefault('eligibility_changes', set()).update(flushed)
+        publish('eligibility', flushed, session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_user_changes(session):
+    changed = session.info.pop('eligibility_changes', None)
+    if changed and eligible_catalog is not None:
+        eligible_catalog.invalidate(changed)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop('eligibility_changes', None)
@@ -0,0 +1,92 @@
+"""
+HTTP validators and response compression.
+
+``conditional(probe)`` wraps a GET view: it runs the probe (a cheap version
+query from ``read_queries``) first, answers ``If-None-Match`` with a bodyless
+304 when the weak ETag still matches, and otherwise runs the view and tags
+its 200 response with ``ETag`` and ``Last-Modified``. The version is read
+before the body, so a change in between can only cause a spurious full
+response, never a stale 304.
+
+``init_compression(app)`` compresses JSON responses larger than
+``COMPRESS_MIN_BYTES`` with brotli (when the ``brotli`` package from
+requirements-brotli.txt is installed and the client accepts it) or gzip.
+"""
+
+from datetime import datetime
+from functools import wraps
+import gzip
+import hashlib
+import os
+
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def make_etag(full_path, version):
+    """ETag of a resource version; ``full_path`` includes the query string,
+    which can select a different representation (e.g. ``?as_of=``)"""
+    return hashlib.blake2b(f"{full_path}|{tuple(version)!r}".encode(), digest_size=12).hexdigest()
+
+
+def conditional(probe):
+    """Serve 304s for unchanged resources; ``probe(**view_args)`` returns a
+    version row (first column a datetime or None) or None to skip"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = probe(**kwargs)
+            except ValueError:
+                version = None  # let the view report bad input
+            if version is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(request.full_path, version)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if isinstance(version[0], datetime):
+                response.last_modified = version[0]
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def _compress(response):
+    if response.direct_passthrough or response.is_streamed or response.status_code < 200 \
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers \
+            or response.mimetype != 'application/json':
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        body, encoding = brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    elif accepted['gzip']:
+        body, encoding = gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.after_request(_compress)
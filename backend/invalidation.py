@@ -0,0 +1,549 @@
+"""
+Cross-worker invalidation of in-process caches.
+
+Each worker keeps its own catalog index, eligibility results, loadouts and
+leaderboard. They already update themselves from this worker's commits; the
+bus tells the other workers (and other hosts) which keys to drop or
+re-read.
+
+A cache registers a handler for its namespace::
+
+    register('loadouts', loadout_cache.invalidate)   # handler(keys or None)
+
+and publishes the keys a flush changed from its ``after_flush`` hook::
+
+    publish('loadouts', user_ids, session)
+
+Other workers call the handler with just those keys, or with None (drop
+everything) when they cannot tell which keys changed.
+
+The keys are logged in ``cache_invalidations`` by the session's own
+transaction (in ``before_commit``), so a committed change is never lost
+with the worker that made it; a rollback discards them. Without a session,
+``publish`` logs the keys in a transaction of its own.
+
+Logged rows start without a version. A flusher numbers them per namespace
+under the ``cache_versions`` row lock, so versions commit in order and a
+worker that has applied version N of a namespace has seen every change up
+to N. If it finds a gap (the log was pruned past it), it drops the whole
+namespace.
+
+Transports (``INVALIDATION_TRANSPORT``):
+
+* ``local`` (default): a single worker; nothing is published.
+* ``db``: the committing worker numbers its rows ``INVALIDATION_FLUSH_MS``
+  after the commit; any worker's poll numbers rows a dead worker left
+  behind. Each worker reads ``cache_versions`` every
+  ``INVALIDATION_POLL_MS`` (one small query) and the log only for
+  namespaces that moved. Works across hosts.
+* ``unix``: ``db``, plus each numbered row is pushed as a datagram to every
+  worker socket in ``INVALIDATION_SOCKET_DIR`` on the host. The poll
+  backstops lost datagrams and other hosts.
+
+A change typically reaches other workers FLUSH + POLL / 2 ms plus a poll's
+run time after commit (about FLUSH for ``unix``); it is not a bound. Each
+worker measures the actual lag per namespace (``GET /admin/cache/versions``);
+across hosts the lag includes clock skew.
+"""
+
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from uuid import uuid4
+
+from sqlalchemy import bindparam, delete, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CacheVersion, CacheInvalidation
+from models.routing_session import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_TRANSPORT = os.getenv('INVALIDATION_TRANSPORT', 'local')
+INVALIDATION_FLUSH_MS = int(os.getenv('INVALIDATION_FLUSH_MS', '50'))
+INVALIDATION_POLL_MS = int(os.getenv('INVALIDATION_POLL_MS', '500'))
+INVALIDATION_SOCKET_DIR = os.getenv('INVALIDATION_SOCKET_DIR', '/tmp/sf_invalidation')
+INVALIDATION_RETENTION_SECONDS = float(os.getenv('INVALIDATION_RETENTION_SECONDS', '3600'))
+# A batch with more keys invalidates its whole namespace
+INVALIDATION_MAX_KEYS = 1000
+PRUNE_INTERVAL_SECONDS = 60
+DATAGRAM_LIMIT = 60000
+
+# namespace -> handler(keys or None), shared by every bus in the process
+_handlers = {}
+
+
+def register(namespace, handler):
+    """Call ``handler(keys)`` when other workers invalidate keys of
+    ``namespace``; keys is a set of strings, or None for all of them"""
+    _handlers[namespace] = handler
+
+
+def publish(namespace, keys, session=None):
+    """Tell other workers that ``keys`` of ``namespace`` changed (None: all).
+    Pass the ``session`` from an ``after_flush`` hook to log them when that
+    session commits."""
+    if invalidation_bus is not None:
+        invalidation_bus.publish(namespace, keys, session)
+
+
+def _epoch(created_at):
+    return (created_at - datetime(1970, 1, 1)).total_seconds()
+
+
+# ============================================================================
+# TRANSPORTS
+# ============================================================================
+
+class LocalTransport:
+    """One worker: its caches already follow its own commits"""
+    remote = False
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def start(self):
+        pass
+
+    def wake(self):
+        pass
+
+    def typical_staleness_ms(self):
+        return 0
+
+
+class DatabaseTransport:
+    """Numbers logged rows under the version table's row locks; polls the
+    version table"""
+    remote = True
+
+    def __init__(self, bus, flush_ms=INVALIDATION_FLUSH_MS, poll_ms=INVALIDATION_POLL_MS):
+        self.bus = bus
+        self.flush_interval = flush_ms / 1000
+        self.poll_interval = poll_ms / 1000
+        self._wake = threading.Event()
+        self._pruned_at = 0.0
+        self._poll_seconds = 0.0
+        self.metrics = {"flushes": 0, "flush_failures": 0, "numbered": 0, "orphans_found": 0,
+                        "polls": 0, "poll_failures": 0}
+
+    def start(self):
+        try:
+            self.prime()
+        except Exception as e:
+            logger.warning("Cache invalidation prime failed, will prime on the next poll: %s", e)
+        threading.Thread(target=self._flush_loop, name='invalidation-flush', daemon=True).start()
+        threading.Thread(target=self._poll_loop, name='invalidation-poll', daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def typical_staleness_ms(self):
+        return (self.flush_interval + self.poll_interval / 2 + self._poll_seconds) * 1000
+
+    # Publishing
+
+    def _flush_loop(self):
+        with self.bus.app.app_context():
+            while True:
+                self._wake.wait()
+                time.sleep(self.flush_interval)  # let concurrent commits land
+                self._wake.clear()
+                try:
+                    self.send(self.number())
+                    self.metrics["flushes"] += 1
+                except Exception as e:
+                    # The rows stay in the log; retry
+                    self.metrics["flush_failures"] += 1
+                    logger.warning("Cache invalidation flush failed, retrying: %s", e)
+                    time.sleep(self.poll_interval)
+                    self._wake.set()
+                if time.monotonic() - self._pruned_at > PRUNE_INTERVAL_SECONDS:
+                    self.prune()
+
+    def number(self):
+        """Give every committed row without a version the next versions of
+        its namespace, in log order; returns [(namespace, version, origin,
+        keys, created_at)]"""
+        versions = CacheVersion.__table__
+        log = CacheInvalidation.__table__
+        now = datetime.utcnow()
+        numbered = []
+        with db.engine.begin() as conn:
+            waiting = conn.execute(
+                select(log.c.namespace).where(log.c.namespace.in_(sorted(_handlers)), log.c.version.is_(None))
+                .distinct()
+            ).scalars().all()
+            # One lock order across workers
+            for namespace in sorted(waiting):
+                # Lock the version row before reading the log, so two
+                # flushers never number the same rows
+                locked = conn.execute(
+                    update(versions).where(versions.c.namespace == namespace).values(updated_at=now)
+                )
+                if not locked.rowcount:
+                    conn.execute(insert(versions).values(namespace=namespace, version=0, updated_at=now))
+                version = conn.execute(
+                    select(versions.c.version).where(versions.c.namespace == namespace)
+                ).scalar()
+                rows = conn.execute(
+                    select(log.c.id, log.c.origin, log.c.invalidated_keys, log.c.created_at)
+                    .where(log.c.namespace == namespace, log.c.version.is_(None))
+                    .order_by(log.c.id)
+                ).all()
+                if not rows:
+                    continue
+                conn.execute(
+                    update(log).where(log.c.id == bindparam('b_id')).values(version=bindparam('b_version')),
+                    [{"b_id": row.id, "b_version": version + i} for i, row in enumerate(rows, 1)]
+                )
+                conn.execute(
+                    update(versions).where(versions.c.namespace == namespace).values(version=version + len(rows))
+                )
+                numbered.extend((namespace, version + i, row.origin, row.invalidated_keys, _epoch(row.created_at))
+                                for i, row in enumerate(rows, 1))
+        self.metrics["numbered"] += len(numbered)
+        return numbered
+
+    def send(self, numbered):
+        pass  # the commit itself is the publication
+
+    def prune(self):
+        self._pruned_at = time.monotonic()
+        log = CacheInvalidation.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=INVALIDATION_RETENTION_SECONDS)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(delete(log).where(log.c.created_at < cutoff, log.c.version.is_not(None)))
+        except Exception as e:
+            logger.warning("Cache invalidation prune failed: %s", e)
+
+    # Receiving
+
+    def prime(self):
+        """Start from the current versions; create rows for registered namespaces"""
+        versions = CacheVersion.__table__
+        with self.bus.app.app_context():
+            with db.engine.connect() as conn:
+                current = dict(conn.execute(select(versions.c.namespace, versions.c.version)).all())
+            for namespace in set(_handlers) - current.keys():
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(insert(versions).values(namespace=namespace, version=0,
+                                                             updated_at=datetime.utcnow()))
+                    current[namespace] = 0
+                except IntegrityError:
+                    pass  # another worker created it; the poll reads it
+        self.bus.prime(current)
+
+    def _poll_loop(self):
+        with self.bus.app.app_context():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    started = time.monotonic()
+                    self.poll()
+                    self._poll_seconds = time.monotonic() - started
+                    self.metrics["polls"] += 1
+                except Exception as e:
+                    self.metrics["poll_failures"] += 1
+                    logger.warning("Cache invalidation poll failed: %s", e)
+                finally:
+                    db.session.remove()
+
+    def poll(self):
+        versions = CacheVersion.__table__
+        log = CacheInvalidation.__table__
+        # Rows their worker should have numbered by now: it died after commit
+        orphaned_before = datetime.utcnow() - timedelta(seconds=self.flush_interval + self.poll_interval)
+        with db.engine.connect() as conn:
+            current = dict(conn.execute(select(versions.c.namespace, versions.c.version)).all())
+            orphan = conn.execute(
+                select(log.c.id).where(log.c.namespace.in_(sorted(_handlers)), log.c.version.is_(None),
+                                       log.c.created_at < orphaned_before).limit(1)
+            ).first()
+            changes = {}
+            for namespace, version in current.items():
+                known = self.bus.known(namespace)
+                if known is not None and version > known:
+                    changes[namespace] = conn.execute(
+                        select(log.c.version, log.c.origin, log.c.invalidated_keys, log.c.created_at)
+                        .where(log.c.namespace == namespace, log.c.version > known)
+                        .order_by(log.c.version)
+                    ).all()
+        self.bus.prime({namespace: version for namespace, version in current.items()
+                        if self.bus.known(namespace) is None})
+        for namespace, rows in changes.items():
+            self.bus.apply_log(namespace, rows)
+        if orphan is not None:
+            self.metrics["orphans_found"] += 1
+            self.wake()
+
+
+class UnixSocketTransport(DatabaseTransport):
+    """``db``, plus a datagram to every worker on this host after each flush"""
+
+    def __init__(self, bus, socket_dir=INVALIDATION_SOCKET_DIR, **kwargs):
+        super().__init__(bus, **kwargs)
+        self.socket_dir = socket_dir
+        self.path = None
+        self._sender = None
+        self.metrics.update({"datagrams_sent": 0, "datagrams_received": 0, "datagrams_dropped": 0})
+
+    def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.path = os.path.join(self.socket_dir, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        super().start()
+        threading.Thread(target=self._receive_loop, args=(receiver,), name='invalidation-receive',
+                         daemon=True).start()
+
+    def typical_staleness_ms(self):
+        return self.flush_interval * 1000
+
+    def send(self, numbered):
+        for namespace, version, origin, keys, created_at in numbered:
+            message = {"namespace": namespace, "version": version, "origin": origin,
+                       "keys": keys, "queued_at": created_at}
+            data = json.dumps(message).encode()
+            if len(data) > DATAGRAM_LIMIT:
+                data = json.dumps({**message, "keys": None}).encode()
+            for name in os.listdir(self.socket_dir):
+                peer = os.path.join(self.socket_dir, name)
+                if peer == self.path or not name.endswith('.sock'):
+                    continue
+                try:
+                    self._sender.sendto(data, peer)
+                    self.metrics["datagrams_sent"] += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # A worker that exited; its socket file is left behind
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                except OSError:
+                    self.metrics["datagrams_dropped"] += 1  # peer's buffer is full; its poll catches up
+
+    def _receive_loop(self, receiver):
+        with self.bus.app.app_context():
+            while True:
+                data = receiver.recv(65536)
+                self.metrics["datagrams_received"] += 1
+                try:
+                    message = json.loads(data)
+                    keys = set(message["keys"]) if message["keys"] is not None else None
+                    self.bus.apply_pushed(message["namespace"], message["version"], message["origin"],
+                                          keys, message["queued_at"])
+                except Exception:
+                    logger.exception("Cache invalidation datagram failed")
+                finally:
+                    db.session.remove()
+
+
+TRANSPORTS = {
+    'local': LocalTransport,
+    'db': DatabaseTransport,
+    'unix': UnixSocketTransport,
+}
+
+
+# ============================================================================
+# BUS
+# ============================================================================
+
+class InvalidationBus:
+    def __init__(self, app, transport=INVALIDATION_TRANSPORT):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown invalidation transport '{transport}'")
+        self.app = app
+        self.transport_name = transport
+        self.transport = TRANSPORTS[transport](self)
+        self.origin = None
+        self._origin_pid = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._known = {}    # namespace -> last version applied here
+        self._lag = {}      # namespace -> [count, total seconds, max seconds, last seconds]
+        self.metrics = {"published_keys": 0, "applied_batches": 0, "own_batches": 0, "resyncs": 0}
+
+    def ensure_started(self):
+        """Start the transport once per process (after any fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._known, self._lag = {}, {}
+        self.own_origin()
+        self.transport.start()
+
+    def own_origin(self):
+        """This process's origin; a forked worker gets its own"""
+        with self._lock:
+            if self._origin_pid != os.getpid():
+                self._origin_pid = os.getpid()
+                self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+            return self.origin
+
+    # Publishing
+
+    def publish(self, namespace, keys, session=None):
+        if not self.transport.remote:
+            return
+        keys = None if keys is None else {str(key) for key in keys}
+        if keys is not None and not keys:
+            return
+        self.metrics["published_keys"] += len(keys) if keys is not None else 1
+        if session is not None:
+            # Started after the commit: priming inside the session's
+            # transaction would wait on its locks
+            staged = session.info.setdefault('invalidations', {})
+            earlier = staged.get(namespace, set())
+            if earlier is None or keys is None or len(earlier) + len(keys) > INVALIDATION_MAX_KEYS:
+                staged[namespace] = None
+            else:
+                staged[namespace] = earlier | keys
+            return
+        self.ensure_started()
+        with db.engine.begin() as conn:
+            conn.execute(insert(CacheInvalidation.__table__), [self.log_row(namespace, keys)])
+        self.transport.wake()
+
+    def log_row(self, namespace, keys):
+        """An unnumbered ``cache_invalidations`` row"""
+        if keys is not None and len(keys) > INVALIDATION_MAX_KEYS:
+            keys = None
+        return {"namespace": namespace, "version": None, "origin": self.own_origin(),
+                "invalidated_keys": sorted(keys) if keys is not None else None,
+                "created_at": datetime.utcnow()}
+
+    # Receiving
+
+    def known(self, namespace):
+        return self._known.get(namespace)
+
+    def prime(self, versions):
+        with self._apply_lock:
+            for namespace, version in versions.items():
+                self._known.setdefault(namespace, version)
+
+    def _invalidate(self, namespace, keys, queued_at):
+        handler = _handlers.get(namespace)
+        if handler is not None:
+            try:
+                handler(keys)
+            except Exception:
+                logger.exception("Cache invalidation handler for '%s' failed", namespace)
+        lag = max(0.0, time.time() - queued_at)
+        stats = self._lag.setdefault(namespace, [0, 0.0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += lag
+        stats[2] = max(stats[2], lag)
+        stats[3] = lag
+        self.metrics["applied_batches"] += 1
+
+    def apply_log(self, namespace, rows):
+        """Apply polled log rows [(version, origin, keys, created_at)] past
+        the known version, in order"""
+        with self._apply_lock:
+            known = self._known.get(namespace)
+            rows = [row for row in rows if row.version > known]
+            if not rows:
+                return
+            if rows[0].version != known + 1 or any(b.version != a.version + 1 for a, b in zip(rows, rows[1:])):
+                # Pruned or missing versions: the changed keys are unknown
+                self.metrics["resyncs"] += 1
+                self._invalidate(namespace, None, _epoch(rows[0].created_at))
+            else:
+                for row in rows:
+                    if row.origin == self.origin:
+                        self.metrics["own_batches"] += 1
+                        continue
+                    keys = set(row.invalidated_keys) if row.invalidated_keys is not None else None
+                    self._invalidate(namespace, keys, _epoch(row.created_at))
+            self._known[namespace] = rows[-1].version
+
+    def apply_pushed(self, namespace, version, origin, keys, queued_at):
+        """Apply a pushed batch now; the version only advances if it is the
+        next one, otherwise the poll fills the gap (re-dropping is harmless)"""
+        if origin == self.origin:
+            return
+        with self._apply_lock:
+            known = self._known.get(namespace)
+            if known is not None and version <= known:
+                return
+            self._invalidate(namespace, keys, queued_at)
+            if known is not None and version == known + 1:
+                self._known[namespace] = version
+
+    def stats(self):
+        with self._apply_lock:
+            lag = {
+                namespace: {"batches": count, "mean_ms": round(total / count * 1000, 1),
+                            "max_ms": round(worst * 1000, 1), "last_ms": round(last * 1000, 1)}
+                for namespace, (count, total, worst, last) in self._lag.items()
+            }
+            versions = dict(self._known)
+        return {
+            "transport": self.transport_name,
+            "origin": self.origin,
+            "namespaces": sorted(_handlers),
+            "versions": versions,
+            "typical_staleness_ms": round(self.transport.typical_staleness_ms(), 1),
+            "lag": lag,
+            **self.metrics,
+            **getattr(self.transport, 'metrics', {}),
+        }
+
+
+invalidation_bus = None
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _log_staged_invalidations(session):
+    if invalidation_bus is None or not invalidation_bus.transport.remote:
+        return
+    # Run the commit's flush now, so its after_flush hooks stage their keys
+    session.flush()
+    staged = session.info.pop('invalidations', None)
+    if staged:
+        # On the default database, which owns the log, even when the
+        # session's other statements go to a shard
+        session.execute(
+            insert(CacheInvalidation.__table__),
+            [invalidation_bus.log_row(namespace, keys) for namespace, keys in sorted(staged.items())],
+            bind_arguments={"bind": db.engine}
+        )
+        session.info['invalidations_logged'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _number_logged_invalidations(session):
+    if session.info.pop('invalidations_logged', False):
+        invalidation_bus.ensure_started()
+        invalidation_bus.transport.wake()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_staged_invalidations(session):
+    session.info.pop('invalidations', None)
+    session.info.pop('invalidations_logged', None)
+
+
+def init_invalidation_bus(app):
+    """Bus for this app; the transport starts with each worker's first request"""
+    global invalidation_bus
+    invalidation_bus = InvalidationBus(app)
+    app.before_request(invalidation_bus.ensure_started)
+    return invalidation_bus
@@ -0,0 +1,105 @@
+"""
+Batched inventory actions.
+
+A list of equip / unequip / use operations for one user is validated
+against a single read of the referenced items and then applied in one
+transaction, all or nothing:
+
+* ``equip`` is one UPDATE that unequips the user's other items of the
+  same ``product_type`` and equips the target,
+* ``unequip`` is one UPDATE,
+* ``use`` decrements ``remaining_uses`` (or ``quantity``) in SQL, guarded
+  so concurrent uses can never take it below zero.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, UserInventory, VirtualProduct
+
+INVENTORY_ACTIONS = ('equip', 'unequip', 'use')
+INVENTORY_MAX_ACTIONS = 100
+
+
+def validate_actions(actions):
+    """Normalise an action list; raises ValueError when invalid"""
+    if not isinstance(actions, list) or not actions:
+        raise ValueError("actions must be a non-empty list")
+    if len(actions) > INVENTORY_MAX_ACTIONS:
+        raise ValueError(f"At most {INVENTORY_MAX_ACTIONS} actions per request")
+
+    normalised = []
+    for i, action in enumerate(actions):
+        if not isinstance(action, dict):
+            raise ValueError(f"actions[{i}] must be an object")
+        kind = action.get('action')
+        if kind not in INVENTORY_ACTIONS:
+            raise ValueError(f"actions[{i}].action must be one of {', '.join(INVENTORY_ACTIONS)}")
+        if not action.get('inventory_id'):
+            raise ValueError(f"actions[{i}].inventory_id is required")
+        amount = action.get('amount', 1)
+        if kind == 'use' and (not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0):
+            raise ValueError(f"actions[{i}].amount must be a positive integer")
+        normalised.append({"action": kind, "inventory_id": str(action['inventory_id']), "amount": amount})
+    return normalised
+
+
+def _load_items(user_id, inventory_ids):
+    item, product = UserInventory, VirtualProduct
+    rows = db.session.execute(
+        select(item.id, item.product_id, item.remaining_uses, item.quantity, item.is_equipped,
+               item.is_consumed, item.expired, item.expires_at, product.product_type, product.consumable)
+        .join(product, product.id == item.product_id)
+        .where(item.user_id == user_id, item.id.in_(inventory_ids))
+    ).all()
+    return {str(row.id): row for row in rows}
+
+
+def apply_inventory_actions(user_id, actions):
+    """Apply validated actions in one transaction; returns the touched items.
+
+    Raises LookupError for items the user does not own and ValueError for
+    actions that are not allowed (nothing is applied in either case).
+    """
+    inventory_ids = sorted({action['inventory_id'] for action in actions})
+    items = _load_items(user_id, inventory_ids)
+    now = datetime.utcnow()
+
+    for action in actions:
+        row = items.get(action['inventory_id'])
+        if row is None:
+            raise LookupError(f"Inventory item {action['inventory_id']} not found")
+        if action['action'] == 'unequip':
+            continue
+        if row.is_consumed or row.expired or (row.expires_at and row.expires_at < now):
+            raise ValueError(f"Item {row.id} is not valid (expired or consumed)")
+        if action['action'] == 'use' and not row.consumable:
+            raise ValueError(f"Item {row.id} is not consumable")
+
+    try:
+        for action in actions:
+            row = items[action['inventory_id']]
+            if action['action'] == 'equip':
+                UserInventory.equip_exclusive(user_id, row.id, row.product_type)
+            elif action['action'] == 'unequip':
+                UserInventory.unequip_by_ids(user_id, [row.id])
+            elif not UserInventory.consume(user_id, row.id, action['amount'], by_uses=row.remaining_uses is not None):
+                raise ValueError(f"Item {row.id} does not have {action['amount']} uses left")
+        items = _load_items(user_id, inventory_ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return [
+        {
+            "id": str(row.id),
+            "product_id": str(row.product_id),
+            "product_type": row.product_type,
+            "is_equipped": bool(row.is_equipped),
+            "remaining_uses": row.remaining_uses,
+            "quantity": row.quantity,
+            "is_consumed": bool(row.is_consumed)
+        } for row in items.values()
+    ]
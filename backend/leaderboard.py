@@ -0,0 +1,324 @@
+"""
+In-memory leaderboards over UserWallet counters.
+
+Each metric keeps an order-statistic index of ``(-value, user_id)`` keys: a
+list of sorted blocks plus a Fenwick tree over the block sizes, so rank and
+top-N lookups cost O(log n) and updates O(log n + block size).
+
+The index is built from ``user_wallets`` on first use in each worker. It is
+then updated from every committed change to a wallet, so the earn, bonus,
+grant, transfer and purchase paths need no extra calls. Wallets changed by
+other workers are re-read when the invalidation bus reports them. A
+background resync rebuilds it every ``LEADERBOARD_RESYNC_SECONDS`` to pick
+up writes made outside the ORM.
+"""
+
+from bisect import bisect_left, insort
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from invalidation import publish, register
+from models import db, UserWallet
+from models.routing_session import RoutingSession
+from sharding import group_by_shard, shard_engines, use_shard
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_METRICS = tuple(
+    m.strip() for m in os.getenv('LEADERBOARD_METRICS', 'total_coins_earned,sf_coins').split(',') if m.strip()
+)
+LEADERBOARD_RESYNC_SECONDS = float(os.getenv('LEADERBOARD_RESYNC_SECONDS', '300'))
+LEADERBOARD_MAX_LIMIT = 1000
+BLOCK_LOAD = 1000
+
+
+class RankedIndex:
+    """Sorted multiset of keys with O(log n) rank and select"""
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + BLOCK_LOAD] for i in range(0, len(keys), BLOCK_LOAD)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._size = len(keys)
+        self._build_tree()
+
+    def __len__(self):
+        return self._size
+
+    # Fenwick tree over block lengths
+
+    def _build_tree(self):
+        tree = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, pos):
+        """Number of keys in blocks before ``pos``"""
+        total, i = 0, pos
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index):
+        """(block, offset) holding the key at ``index``"""
+        pos, remaining = 0, index
+        step = 1 << (len(self._tree).bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return pos, remaining
+
+    # Mutation
+
+    def add(self, key):
+        if not self._blocks:
+            self._blocks, self._maxes, self._size = [[key]], [key], 1
+            self._build_tree()
+            return
+        pos = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[pos]
+        insort(block, key)
+        self._maxes[pos] = block[-1]
+        self._size += 1
+        if len(block) > 2 * BLOCK_LOAD:
+            self._blocks[pos:pos + 1] = [block[:BLOCK_LOAD], block[BLOCK_LOAD:]]
+            self._maxes[pos:pos + 1] = [block[BLOCK_LOAD - 1], block[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._blocks):
+            raise KeyError(key)
+        block = self._blocks[pos]
+        idx = bisect_left(block, key)
+        if idx == len(block) or block[idx] != key:
+            raise KeyError(key)
+        del block[idx]
+        self._size -= 1
+        if block:
+            self._maxes[pos] = block[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._blocks[pos]
+            del self._maxes[pos]
+            self._build_tree()
+
+    # Queries
+
+    def rank(self, key):
+        """Number of keys strictly less than ``key``"""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._blocks):
+            return self._size
+        return self._prefix(pos) + bisect_left(self._blocks[pos], key)
+
+    def slice(self, start, stop):
+        """Keys at positions [start, stop)"""
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        pos, offset = self._locate(start)
+        out = []
+        while len(out) < stop - start and pos < len(self._blocks):
+            out.extend(self._blocks[pos][offset:offset + (stop - start - len(out))])
+            pos, offset = pos + 1, 0
+        return out
+
+
+class Leaderboard:
+    """Per-metric ranked indexes plus the current value of every user"""
+
+    def __init__(self, app, metrics=LEADERBOARD_METRICS, resync_seconds=LEADERBOARD_RESYNC_SECONDS):
+        self.app = app
+        self.metrics = metrics
+        self.resync_seconds = resync_seconds
+        self._lock = threading.RLock()
+        self._indexes = {}
+        self._values = {}       # metric -> {user_id: value}
+        self._replay = None     # updates seen while a resync is reading
+        self._built_at = None
+        self._pid = None
+
+    # Building
+
+    def _load(self):
+        columns = [getattr(UserWallet, metric) for metric in self.metrics]
+        values = {metric: {} for metric in self.metrics}
+        with self.app.app_context():
+            for engine in shard_engines().values() or [db.engine]:
+                with engine.connect() as conn:
+                    result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+                        select(UserWallet.user_id, *columns)
+                    )
+                    for row in result:
+                        user_id = str(row[0])
+                        for metric, value in zip(self.metrics, row[1:]):
+                            values[metric][user_id] = value or 0
+        indexes = {
+            metric: RankedIndex((-value, user_id) for user_id, value in by_user.items())
+            for metric, by_user in values.items()
+        }
+        return indexes, values
+
+    def rebuild(self):
+        with self._lock:
+            self._replay = []
+        try:
+            indexes, values = self._load()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._indexes, self._values = indexes, values
+            self._built_at = time.time()
+            for user_id, changes in replay:
+                self._apply(user_id, changes)
+
+    def ensure_built(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.rebuild()
+            self._pid = os.getpid()
+            threading.Thread(target=self._resync_loop, name='leaderboard-resync', daemon=True).start()
+
+    def _resync_loop(self):
+        while True:
+            time.sleep(self.resync_seconds)
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception("Leaderboard resync failed")
+
+    # Incremental updates
+
+    def _apply(self, user_id, changes):
+        for metric, value in changes.items():
+            values = self._values[metric]
+            index = self._indexes[metric]
+            old = values.get(user_id)
+            if old == value:
+                continue
+            if old is not None:
+                index.remove((-old, user_id))
+            index.add((-value, user_id))
+            values[user_id] = value
+
+    def update(self, user_id, changes):
+        """Record committed metric values ({metric: value}) for a user"""
+        changes = {m: v or 0 for m, v in changes.items() if m in self.metrics}
+        replay = self._replay
+        if replay is not None:
+            # A (re)build is reading the table and may have missed this commit
+            replay.append((user_id, changes))
+        if self._pid != os.getpid():
+            return  # not built in this worker yet
+        with self._lock:
+            self._apply(user_id, changes)
+
+    def refresh(self, user_ids=None):
+        """Re-read wallets other workers changed (None: rebuild)"""
+        if self._pid != os.getpid():
+            return
+        if user_ids is None:
+            self.rebuild()
+            return
+        columns = [getattr(UserWallet, metric) for metric in self.metrics]
+        with self.app.app_context():
+            for shard, shard_user_ids in group_by_shard(user_ids).items():
+                with use_shard(shard):
+                    rows = db.session.execute(
+                        select(UserWallet.user_id, *columns).where(UserWallet.user_id.in_(shard_user_ids))
+                    ).all()
+                for row in rows:
+                    self.update(str(row[0]), dict(zip(self.metrics, row[1:])))
+
+    # Queries
+
+    def top(self, metric, limit=100, offset=0):
+        self.ensure_built()
+        with self._lock:
+            keys = self._indexes[metric].slice(offset, offset + limit)
+            # Rank ties share the rank of the first user with that value
+            return [
+                {"rank": self._indexes[metric].rank((neg_value, '')) + 1, "user_id": user_id, "value": -neg_value}
+                for neg_value, user_id in keys
+            ]
+
+    def rank_of(self, metric, user_id):
+        self.ensure_built()
+        with self._lock:
+            value = self._values[metric].get(str(user_id))
+            if value is None:
+                return None
+            index = self._indexes[metric]
+            return {
+                "rank": index.rank((-value, '')) + 1,
+                "value": value,
+                "total": len(index)
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "metrics": list(self.metrics),
+                "users": len(next(iter(self._values.values()), {})),
+                "built_at": self._built_at
+            }
+
+
+leaderboard = None
+
+
+def init_leaderboard(app):
+    global leaderboard
+    leaderboard = Leaderboard(app)
+    register('leaderboard', leaderboard.refresh)
+    return leaderboard
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_wallet_changes(session, flush_context):
+    if leaderboard is None:
+        return
+    flushed = {str(obj.user_id): {metric: getattr(obj, metric) for metric in leaderboard.metrics}
+               for obj in (*session.new, *session.dirty) if isinstance(obj, UserWallet)}
+    if flushed:
+        session.info.setdefault('leaderboard_changes', {}).update(flushed)
+        publish('leaderboard', flushed.keys(), session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_wallet_changes(session):
+    changes = session.info.pop('leaderboard_changes', None)
+    if changes and leaderboard is not None:
+        for user_id, values in changes.items():
+            leaderboard.update(user_id, values)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_wallet_changes(session):
+    session.info.pop('leaderboard_changes', None)
@@ -0,0 +1,164 @@
+"""
+Equipped-loadout lookups for many users at once.
+
+Each worker keeps an LRU of ``user_id -> tuple of equipped product ids``.
+Users missing from it are resolved with one ``IN`` query joined to
+``virtual_products``; product details for cached users come from the
+in-memory catalog index, so a warm lobby of any size costs no queries.
+
+Entries are dropped when a commit changes the user's inventory, either
+through the ORM or through the set-based UPDATEs that report themselves
+with ``UserInventory.mark_changed``, in this worker or (through the
+invalidation bus) in another. They also expire after
+``LOADOUT_CACHE_TTL_SECONDS``, or earlier if an equipped item expires.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+import os
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from invalidation import publish, register
+from models import db, UserInventory, VirtualProduct
+from models.routing_session import RoutingSession
+from sharding import group_by_shard, use_shard
+
+LOADOUT_CACHE_SIZE = int(os.getenv('LOADOUT_CACHE_SIZE', '200000'))
+LOADOUT_CACHE_TTL_SECONDS = float(os.getenv('LOADOUT_CACHE_TTL_SECONDS', '30'))
+LOADOUT_MAX_USERS = 500
+
+
+def product_summary(product_id, product_type, name, icon_url):
+    return {"product_id": product_id, "product_type": product_type, "name": name, "icon_url": icon_url}
+
+
+class LoadoutCache:
+    def __init__(self, catalog_search, cache_size=LOADOUT_CACHE_SIZE, ttl=LOADOUT_CACHE_TTL_SECONDS):
+        self.catalog_search = catalog_search
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # user_id -> (expires, product ids)
+        # Bumped by every invalidation, so a load that started earlier
+        # does not cache what it read
+        self._generation = 0
+        self._invalidated = {}       # user_id -> generation of their last invalidation
+        self._cleared = 0            # generation of the last invalidation of everyone
+
+    def _query(self, user_ids):
+        item, product = UserInventory, VirtualProduct
+        now = datetime.utcnow()
+        rows = []
+        for shard, shard_user_ids in group_by_shard(user_ids).items():
+            with use_shard(shard):
+                rows.extend(db.session.execute(
+                    select(item.user_id, item.product_id, item.expires_at, product.product_type, product.name,
+                           product.icon_url)
+                    .join(product, product.id == item.product_id)
+                    .where(
+                        item.user_id.in_(shard_user_ids),
+                        item.is_equipped.is_(True),
+                        item.is_consumed.is_(False),
+                        item.expired.is_(False),
+                        db.or_(item.expires_at.is_(None), item.expires_at > now)
+                    )
+                    .order_by(item.user_id, product.product_type, item.product_id)
+                ).all())
+
+        loadouts = {user_id: [] for user_id in user_ids}
+        expires = {}
+        products = {}
+        for row in rows:
+            user_id, product_id = str(row.user_id), str(row.product_id)
+            loadouts[user_id].append(product_id)
+            products[product_id] = product_summary(product_id, row.product_type, row.name, row.icon_url)
+            if row.expires_at:
+                seconds = (row.expires_at - now).total_seconds()
+                expires[user_id] = min(expires.get(user_id, seconds), seconds)
+        return loadouts, expires, products
+
+    def get_many(self, user_ids):
+        """{user_id: [product summary, ...]} of equipped items"""
+        now = time.monotonic()
+        loadouts, missing = {}, []
+        with self._lock:
+            started = self._generation
+            for user_id in user_ids:
+                entry = self._cache.get(user_id)
+                if entry and entry[0] > now:
+                    self._cache.move_to_end(user_id)
+                    loadouts[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+
+        products = {}
+        if missing:
+            fetched, expires, products = self._query(missing)
+            with self._lock:
+                for user_id, product_ids in fetched.items():
+                    product_ids = tuple(product_ids)
+                    loadouts[user_id] = product_ids
+                    if self._invalidated.get(user_id, self._cleared) > started:
+                        continue  # changed while we read; the next lookup reads again
+                    ttl = min(self.ttl, expires.get(user_id, self.ttl))
+                    self._cache[user_id] = (now + ttl, product_ids)
+                    self._cache.move_to_end(user_id)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        wanted = {product_id for product_ids in loadouts.values() for product_id in product_ids}
+        for product_id, record in self.catalog_search.lookup(wanted - products.keys()).items():
+            products[product_id] = product_summary(product_id, record['product_type'], record['name'], record['icon_url'])
+        return {
+            user_id: [products[product_id] for product_id in loadouts[user_id] if product_id in products]
+            for user_id in user_ids
+        }
+
+    def invalidate(self, user_ids=None):
+        """Drop these users' loadouts (None: everyone's)"""
+        with self._lock:
+            self._generation += 1
+            if user_ids is None or len(self._invalidated) > self.cache_size:
+                # Forgetting who changed only stops loads in flight from caching
+                self._cleared = self._generation
+                self._invalidated.clear()
+            if user_ids is None:
+                self._cache.clear()
+                return
+            for user_id in user_ids:
+                self._cache.pop(user_id, None)
+                self._invalidated[user_id] = self._generation
+
+
+loadout_cache = None
+
+
+def init_loadout_cache(catalog_search):
+    global loadout_cache
+    loadout_cache = LoadoutCache(catalog_search)
+    register('loadouts', loadout_cache.invalidate)
+    return loadout_cache
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_inventory_changes(session, flush_context):
+    changed = {str(obj.user_id) for obj in (*session.new, *session.dirty, *session.deleted)
+               if isinstance(obj, UserInventory)}
+    if changed:
+        session.info.setdefault('inventory_changes', set()).update(changed)
+        publish('loadouts', changed, session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_inventory_changes(session):
+    changed = session.info.pop('inventory_changes', None)
+    if changed and loadout_cache is not None:
+        loadout_cache.invalidate(changed)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_inventory_changes(session):
+    session.info.pop('inventory_changes', None)
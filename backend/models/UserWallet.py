@@ -1,16 +1,17 @@
 from datetime import datetime
-from sqlalchemy import Integer, Float, ForeignKey
+from sqlalchemy import Integer, Float, ForeignKey, select, update
 from sqlalchemy.orm import relationship
 from .WalletTransaction import WalletTransaction
 import uuid
 from . import db, UUID, TIMESTAMP
 
+CURRENCY_NAMES = {"sf_coins": "SF Coins", "premium_gems": "Premium Gems", "event_tokens": "Event Tokens"}
 
 class UserWallet(db.Model):
     __tablename__ = 'user_wallets'
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = db.Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False, unique=True)
     sf_coins = db.Column(Integer, default=0)
     premium_gems = db.Column(Integer, default=0)
     event_tokens = db.Column(Integer, default=0)
@@ -31,14 +32,75 @@ class UserWallet(db.Model):
     )
     event_token_balances = db.relationship("EventTokenBalance", back_populates="wallet")
     
-    def earn_sf_coins(self, amount=0):
-        """Earn SF Coins (subject to daily limit)"""
+    @classmethod
+    def lock_by_user_ids(cls, user_ids):
+        """Lock the wallets of user_ids FOR UPDATE in wallet id order.
+
+        Locking in a canonical order keeps concurrent multi-wallet writers
+        from deadlocking each other. Returns {user_id: wallet}; users
+        without a wallet are simply absent.
+        """
+        wallet_ids = sorted(
+            wallet_id for (wallet_id,) in db.session.query(cls.id).filter(cls.user_id.in_(set(user_ids)))
+        )
+        if not wallet_ids:
+            return {}
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # SQLite ignores FOR UPDATE; a no-op write takes the database
+            # write lock before the balances are read
+            db.session.execute(
+                update(cls).where(cls.id.in_(wallet_ids)).values(sf_coins=cls.sf_coins)
+            )
+        wallets = (
+            db.session.query(cls)
+            .filter(cls.id.in_(wallet_ids))
+            .order_by(cls.id)
+            .with_for_update()
+            .populate_existing()
+            .all()
+        )
+        return {str(wallet.user_id): wallet for wallet in wallets}
+    
+    @classmethod
+    def find_balances(cls, user_ids, chunk_size=500):
+        """{user_id: (sf_coins, premium_gems, event_tokens)} without loading wallets"""
+        user_ids = list(user_ids)
+        balances = {}
+        for start in range(0, len(user_ids), chunk_size):
+            rows = db.session.execute(
+                select(cls.user_id, cls.sf_coins, cls.premium_gems, cls.event_tokens)
+                .where(cls.user_id.in_(user_ids[start:start + chunk_size]))
+            )
+            for user_id, sf_coins, premium_gems, event_tokens in rows:
+                balances[str(user_id)] = (sf_coins, premium_gems, event_tokens)
+        return balances
+    
+    def debit(self, currency_type, amount):
+        """Take amount of a currency without recording a ledger row (the
+        caller records its own); returns the balance before"""
+        balance = getattr(self, currency_type) or 0
+        if amount > balance:
+            raise ValueError(f"Insufficient {CURRENCY_NAMES[currency_type]}")
+        setattr(self, currency_type, balance - amount)
+        if currency_type == 'sf_coins':
+            self.total_coins_spent = (self.total_coins_spent or 0) + amount
+        return balance
+    
+    def credit_earning(self, amount):
+        """Add earned SF Coins under the daily limit without recording a
+        ledger row (the caller records its own); returns the balance before"""
         if self.daily_earnings + amount > self.daily_earning_limit:
             raise ValueError("Daily earning limit exceeded")
         
+        balance = self.sf_coins
         self.daily_earnings += amount
         self.total_coins_earned += amount
         self.sf_coins += amount
+        return balance
+    
+    def earn_sf_coins(self, amount=0):
+        """Earn SF Coins (subject to daily limit)"""
+        self.credit_earning(amount)
         
         WalletTransaction.record_transaction(
             wallet_id=self.id,
@@ -15,6 +15,14 @@ currency_type_enum = ENUM(
 
 class WalletTransaction(db.Model):
     __tablename__ = 'wallet_transactions'
+    __table_args__ = (
+        # Per-user ledger reads: history, XP recompute
+        db.Index('ix_wallet_transactions_user_created', 'user_id', 'created_at'),
+        # Ledger rows since a wallet's last balance snapshot
+        db.Index('ix_wallet_transactions_wallet_created', 'wallet_id', 'created_at'),
+        # Change feed tail: every user's rows since the poll's lookback
+        db.Index('ix_wallet_transactions_created_id', 'created_at', 'id'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     wallet_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user_wallets.id'), nullable=False)
@@ -29,7 +37,8 @@ class WalletTransaction(db.Model):
     reference_type = db.Column(db.Text, nullable=True)  # purchase, product, etc.
     reference_id = db.Column(db.Integer, nullable=True)  # ID of related entity
     description = db.Column(db.Text, nullable=True)
-    created_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+    # Sub-second, so two entries in one second still order (history ETags)
+    created_at = db.Column(TIMESTAMP(timezone=True, fsp=6), default=datetime.utcnow)
     
     # Relationships
     wallet = relationship("UserWallet", back_populates="transactions")
@@ -47,12 +56,11 @@ class WalletTransaction(db.Model):
             amount=amount,
             balance_before=balance_before,
             balance_after=balance_after,
-            source_type=source_type,
-            source_id=source_id,
+            reference_type=source_type,
+            reference_id=source_id,
             description=description
         )
-        db.session.add(transaction)
-        db.session.commit()
+        db.session.add(transaction)  # committed with the balance change by the caller
     
     def __repr__(self):
         return f'<WalletTransaction {self.id} {self.transaction_type} {self.amount} {self.currency_type}>'
@@ -1,15 +1,40 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, DateTime, Enum as ENUM, JSON as JSONB
+from sqlalchemy import String, DateTime, Enum as ENUM, JSON
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects import mysql, postgresql
 import uuid
+from .routing_session import RoutingSession, REPLICA_BIND, SHARD_BIND_PREFIX
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# UUIDs as text in Python; native uuid columns on PostgreSQL, String(36)
+# on MySQL and SQLite
+class UUIDString(TypeDecorator):
+    impl = String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(String(36))
+
+    def process_bind_param(self, value, dialect):
+        # uuid.UUID defaults must be bound as text on drivers (e.g. sqlite3)
+        # that don't stringify them implicitly
+        return str(value) if value is not None else None
 
-db = SQLAlchemy()
 
-# MySQL-compatible UUID type (returns String(36))
 def UUID(as_uuid=True):
-    return String(36)
+    return UUIDString()
+
+# Binary JSONB on PostgreSQL, JSON elsewhere
+JSONB = JSON().with_variant(postgresql.JSONB(), 'postgresql')
 
-# MySQL-compatible TIMESTAMP (use DateTime instead)
-def TIMESTAMP(timezone=True):
+# MySQL-compatible TIMESTAMP (use DateTime instead); fsp keeps sub-second
+# precision on MySQL, whose DATETIME otherwise truncates to whole seconds
+def TIMESTAMP(timezone=True, fsp=None):
+    if fsp:
+        return DateTime().with_variant(mysql.DATETIME(fsp=fsp), 'mysql')
     return DateTime()
 
 from .user import User
@@ -20,6 +45,11 @@ from .WalletTransaction import WalletTransaction
 from .EventTokenBalance import EventTokenBalance
 from .exchange_rate import ExchangeRate
 from .UserWallet import UserWallet
+from .wallet_daily_rollup import WalletDailyRollup
+from .global_daily_rollup import GlobalDailyRollup
+from .wallet_daily_snapshot import WalletDailySnapshot
+from .product_refund_job import ProductRefundJob
+from .cache_version import CacheVersion, CacheInvalidation
 
 
 __all__ = [
@@ -28,6 +58,8 @@ __all__ = [
     'JSONB',
     'TIMESTAMP',
     'ENUM',
+    'REPLICA_BIND',
+    'SHARD_BIND_PREFIX',
     'User',
     'VirtualProduct',
     'ProductPurchase',
@@ -35,5 +67,11 @@ __all__ = [
     'WalletTransaction',
     'EventTokenBalance',
     'ExchangeRate',
-    'UserWallet'
+    'UserWallet',
+    'WalletDailyRollup',
+    'GlobalDailyRollup',
+    'WalletDailySnapshot',
+    'ProductRefundJob',
+    'CacheVersion',
+    'CacheInvalidation'
 ]
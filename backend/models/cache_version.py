@@ -0,0 +1,42 @@
+from datetime import datetime
+from sqlalchemy import BigInteger
+from . import db, TIMESTAMP
+
+
+class CacheVersion(db.Model):
+    """Latest invalidation version of an in-process cache namespace.
+
+    Bumped by one per published batch under the row lock, so versions of a
+    namespace commit in order and a worker that has applied version N
+    knows it has seen every batch up to N.
+    """
+    __tablename__ = 'cache_versions'
+
+    namespace = db.Column(db.String(64), primary_key=True)
+    version = db.Column(BigInteger, nullable=False, default=0)
+    updated_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.namespace} v{self.version}>'
+
+
+class CacheInvalidation(db.Model):
+    """Keys invalidated by one version of a namespace (NULL: all of them).
+    Logged by the committing transaction without a version; the flusher
+    numbers it."""
+    __tablename__ = 'cache_invalidations'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    namespace = db.Column(db.String(64), nullable=False)
+    version = db.Column(BigInteger)
+    origin = db.Column(db.String(64), nullable=False)
+    invalidated_keys = db.Column(db.JSON)
+    # When the change committed; receivers measure lag from it
+    created_at = db.Column(TIMESTAMP(timezone=True, fsp=6), nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('namespace', 'version', name='uq_cache_invalidations_namespace_version'),
+    )
+
+    def __repr__(self):
+        return f'<CacheInvalidation {self.namespace} v{self.version}>'
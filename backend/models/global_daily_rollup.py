@@ -0,0 +1,23 @@
+from sqlalchemy import BigInteger
+from . import db
+from .WalletTransaction import currency_type_enum
+from .wallet_daily_rollup import rollup_type_enum
+
+
+class GlobalDailyRollup(db.Model):
+    """System-wide per day ledger totals by currency and transaction type.
+
+    Every ledger write would otherwise contend on the same row, so each day
+    and key is spread over a few ``slot`` rows that readers sum up.
+    """
+    __tablename__ = 'global_daily_rollups'
+
+    day = db.Column(db.Date, primary_key=True)
+    currency_type = db.Column(currency_type_enum, primary_key=True)
+    transaction_type = db.Column(rollup_type_enum, primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    amount_total = db.Column(BigInteger, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<GlobalDailyRollup {self.day} {self.transaction_type} {self.currency_type} slot={self.slot}>'
@@ -11,6 +11,10 @@ purchase_status_enum = ENUM(
 
 class ProductPurchase(db.Model):
     __tablename__ = "product_purchases"
+    __table_args__ = (
+        # Keyset scans of a product's purchases (bulk refunds)
+        db.Index('ix_product_purchases_product_status_id', 'product_id', 'status', 'id'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
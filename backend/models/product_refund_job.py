@@ -0,0 +1,64 @@
+from datetime import datetime
+import uuid
+from sqlalchemy import BigInteger
+from . import db, UUID, TIMESTAMP, ENUM
+
+refund_job_status_enum = ENUM(
+    'running', 'completed', 'failed'
+)
+
+
+class ProductRefundJob(db.Model):
+    """Progress of refunding every purchase of a recalled product.
+
+    ``cursor`` is the last purchase id processed and is advanced in the same
+    transaction as each chunk, so a job can resume exactly where it stopped.
+    """
+    __tablename__ = 'product_refund_jobs'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('virtual_products.id'), nullable=False, index=True)
+    status = db.Column(refund_job_status_enum, nullable=False, default='running')
+    cursor = db.Column(db.String(36))
+    total_purchases = db.Column(db.Integer, nullable=False, default=0)
+    purchases_refunded = db.Column(db.Integer, nullable=False, default=0)
+    purchases_skipped = db.Column(db.Integer, nullable=False, default=0)
+    sf_coins_refunded = db.Column(BigInteger, nullable=False, default=0)
+    premium_gems_refunded = db.Column(BigInteger, nullable=False, default=0)
+    event_tokens_refunded = db.Column(BigInteger, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+    updated_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(TIMESTAMP(timezone=True))
+
+    # Latest unfinished job for a product
+    @classmethod
+    def find_open_for_product(cls, product_id):
+        return cls.query.filter(
+            cls.product_id == product_id,
+            cls.status != 'completed'
+        ).order_by(cls.created_at.desc()).first()
+
+    def to_dict(self):
+        processed = self.purchases_refunded + self.purchases_skipped
+        return {
+            "job_id": str(self.id),
+            "product_id": str(self.product_id),
+            "status": self.status,
+            "total_purchases": self.total_purchases,
+            "purchases_refunded": self.purchases_refunded,
+            "purchases_skipped": self.purchases_skipped,
+            "progress": round(processed / self.total_purchases, 4) if self.total_purchases else 1.0,
+            "refunded": {
+                "sf_coins": self.sf_coins_refunded,
+                "premium_gems": self.premium_gems_refunded,
+                "event_tokens": self.event_tokens_refunded
+            },
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None
+        }
+
+    def __repr__(self):
+        return f'<ProductRefundJob {self.id} {self.product_id} {self.status}>'
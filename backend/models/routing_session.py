@@ -0,0 +1,57 @@
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Bind key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+# Shards are registered as SQLALCHEMY_BINDS "shard:<name>"
+SHARD_BIND_PREFIX = 'shard:'
+
+# Tables owned by the default database; shards only hold read copies
+HOME_TABLES = frozenset({'virtual_products', 'product_refund_jobs', 'exchange_rates',
+                         'cache_versions', 'cache_invalidations'})
+
+# Callables run with each engine a session is about to use; they may raise
+# to refuse it before a connection is checked out (see degraded.py)
+bind_checks = []
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return mapper.local_table.name
+    table = getattr(clause, 'table', None)
+    return getattr(table, 'name', None)
+
+
+class RoutingSession(Session):
+    """Session that sends statements to a user's shard or plain reads to the
+    replica bind when asked to.
+
+    Routing is opt-in per request. ``session.info['shard']`` (a shard bind
+    key) sends everything to that shard except writes to ``HOME_TABLES``,
+    which stay on the default database. Otherwise
+    ``session.info['use_replica']`` sends reads to the replica; flushes and
+    INSERT/UPDATE/DELETE statements always go to the primary.
+
+    Every engine chosen is passed to ``bind_checks`` first.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = self._route(mapper, clause, bind) or super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+        for check in bind_checks:
+            check(engine)
+        return engine
+
+    def _route(self, mapper, clause, bind):
+        if bind is None and self.info.get('shard'):
+            writing = self._flushing or isinstance(clause, UpdateBase)
+            if not (writing and _table_name(mapper, clause) in HOME_TABLES):
+                return self._db.engines[self.info['shard']]
+        elif (bind is None
+                and self.info.get('use_replica')
+                and not self._flushing
+                and not isinstance(clause, UpdateBase)):
+            return self._db.engines.get(REPLICA_BIND)
+        return None
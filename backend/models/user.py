@@ -2,7 +2,7 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import relationship
 import uuid
-from . import db, UUID, TIMESTAMP
+from . import db, UUID, TIMESTAMP, JSONB
 
 
 class User(db.Model):
@@ -15,6 +15,9 @@ class User(db.Model):
     created_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(TIMESTAMP(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    xp = db.Column(db.BigInteger, default=0, nullable=False)  # Running total of ledger xp_amount
+    level = db.Column(db.Integer, default=1)
+    achievements = db.Column(JSONB)  # List of achievement IDs
     
     # Relationships
     wallet = relationship("UserWallet", back_populates="user", uselist=False, cascade="all, delete-orphan")
@@ -36,6 +39,15 @@ class User(db.Model):
             return False
         return check_password_hash(self.password_hash, password)
 
+    # Record an unlocked achievement
+    def add_achievement(self, achievement_id: str) -> bool:
+        achievements = list(self.achievements or [])
+        if achievement_id in achievements:
+            return False
+        # Assign a new list so the JSON column is marked dirty
+        self.achievements = achievements + [achievement_id]
+        return True
+
     # Save user to database
     def save(self):
         db.session.add(self)
@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy import select, update
 from sqlalchemy.orm import relationship
 import uuid
 from . import db, UUID, TIMESTAMP
@@ -19,6 +20,8 @@ class UserInventory(db.Model):
     is_active = db.Column(db.Boolean, default=True)  # For features
     is_consumed = db.Column(db.Boolean, default=False)
     expired = db.Column(db.Boolean, default=False)
+    # Microsecond precision: the inventory ETag is derived from it
+    updated_at = db.Column(TIMESTAMP(timezone=True, fsp=6), default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     user = relationship('User', back_populates='inventory')
@@ -68,10 +71,68 @@ class UserInventory(db.Model):
     def find_equipped_items(cls, user_id: int):
         return cls.query.filter_by(user_id=user_id, is_equipped=True).all()
 
+    # Record users whose items were changed with set-based UPDATEs, which
+    # bypass the ORM change tracking that cache invalidation listens to
+    @staticmethod
+    def mark_changed(user_ids):
+        from invalidation import publish
+        from replica import note_user_writes
+        user_ids = {str(u) for u in user_ids}
+        db.session.info.setdefault('inventory_changes', set()).update(user_ids)
+        publish('loadouts', user_ids, db.session)
+        note_user_writes(db.session, user_ids)
+
+    # Equip one item and unequip the user's other items of the same product type
+    @classmethod
+    def equip_exclusive(cls, user_id, inventory_id, product_type):
+        from .virtual_product import VirtualProduct
+        cls.mark_changed([user_id])
+        same_type = select(VirtualProduct.id).where(VirtualProduct.product_type == product_type)
+        return db.session.execute(
+            update(cls)
+            .where(
+                cls.user_id == user_id,
+                cls.product_id.in_(same_type),
+                db.or_(cls.is_equipped.is_(True), cls.id == inventory_id)
+            )
+            .values(is_equipped=(cls.id == inventory_id))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    # Unequip items of a user
+    @classmethod
+    def unequip_by_ids(cls, user_id, inventory_ids):
+        cls.mark_changed([user_id])
+        return db.session.execute(
+            update(cls)
+            .where(cls.user_id == user_id, cls.id.in_(inventory_ids))
+            .values(is_equipped=False)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    # Atomically use up a consumable; returns False if it has too few uses left
+    @classmethod
+    def consume(cls, user_id, inventory_id, amount: int = 1, by_uses: bool = True):
+        cls.mark_changed([user_id])
+        counter = cls.remaining_uses if by_uses else cls.quantity
+        left = counter - amount
+        # Flags first: MySQL evaluates SET assignments left to right
+        stmt = (
+            update(cls)
+            .where(cls.user_id == user_id, cls.id == inventory_id, cls.is_consumed.is_(False), counter >= amount)
+            .ordered_values(
+                (cls.is_consumed, left <= 0),
+                (cls.is_active, left > 0),
+                (counter, left)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return db.session.execute(stmt).rowcount == 1
+
     # Equip item
     def equip(self):
-        self.is_equipped = True
-        self.save()
+        UserInventory.equip_exclusive(self.user_id, self.id, self.product.product_type)
+        db.session.commit()
 
     # Unequip item
     def unequip(self):
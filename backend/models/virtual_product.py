@@ -64,15 +64,19 @@ class VirtualProduct(db.Model):
     def find_by_id(cls, product_id: int):
         return cls.query.filter_by(id=product_id).first()
 
-    # Find active products
+    # Select statement for active products (shared with the async app)
     @classmethod
-    def find_active_products(cls):
+    def active_products_query(cls):
         now = datetime.utcnow()
-        return cls.query.filter(
+        return db.select(cls).filter(
             cls.is_active == True,
             (cls.available_from == None) | (cls.available_from <= now),
             (cls.available_to == None) | (cls.available_to >= now)
-        ).all()
+        )
+    # Find active products
+    @classmethod
+    def find_active_products(cls):
+        return db.session.execute(cls.active_products_query()).scalars().all()
 
     # Find products by type
     @classmethod
@@ -97,12 +101,12 @@ class VirtualProduct(db.Model):
 
     # Check if user meets requirements
     def user_meets_requirements(self, user_level: int, user_achievements: list) -> bool:
-        if user_level < self.min_user_level:
+        if user_level < (self.min_user_level or 1):
             return False
         
         if self.required_achievements:
             required_set = set(self.required_achievements)
-            user_set = set(user_achievements)
+            user_set = set(user_achievements or [])
             if not required_set.issubset(user_set):
                 return False
         
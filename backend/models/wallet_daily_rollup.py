@@ -0,0 +1,36 @@
+from sqlalchemy import BigInteger
+from . import db, UUID, ENUM
+from .WalletTransaction import currency_type_enum
+
+# Ledger transaction types, with transfers split by direction so a day's
+# incoming and outgoing transfers don't net out
+rollup_type_enum = ENUM(
+    'earn', 'spend', 'purchase', 'refund', 'transfer_in', 'transfer_out', 'bonus', 'penalty'
+)
+
+
+class WalletDailyRollup(db.Model):
+    """Per user, per day totals of the ledger by currency and transaction type.
+
+    Maintained in the same transaction as each WalletTransaction insert.
+    """
+    __tablename__ = 'wallet_daily_rollups'
+
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    currency_type = db.Column(currency_type_enum, primary_key=True)
+    transaction_type = db.Column(rollup_type_enum, primary_key=True)
+    amount_total = db.Column(BigInteger, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Find rollup rows for a user in [start_day, end_day]
+    @classmethod
+    def find_for_user(cls, user_id, start_day, end_day):
+        return cls.query.filter(
+            cls.user_id == user_id,
+            cls.day >= start_day,
+            cls.day <= end_day
+        ).order_by(cls.day).all()
+
+    def __repr__(self):
+        return f'<WalletDailyRollup {self.user_id} {self.day} {self.transaction_type} {self.currency_type}={self.amount_total}>'
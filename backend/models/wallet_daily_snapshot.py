@@ -0,0 +1,20 @@
+from . import db, UUID
+
+
+class WalletDailySnapshot(db.Model):
+    """End-of-day balances of a wallet on the days it had ledger activity.
+
+    Written in bulk by snapshots.py. A day without a row means the wallet
+    kept the balances of its previous row.
+    """
+    __tablename__ = 'wallet_daily_snapshots'
+
+    wallet_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user_wallets.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    sf_coins = db.Column(db.Integer, nullable=False, default=0)
+    premium_gems = db.Column(db.Integer, nullable=False, default=0)
+    event_tokens = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<WalletDailySnapshot {self.wallet_id} {self.day}>'
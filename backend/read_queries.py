@@ -0,0 +1,105 @@
+"""
+Core read paths for the hottest endpoints.
+
+The ORM versions of these reads build identity-mapped, instrumented objects
+only to convert them straight back to dicts. Here every query is a
+``lambda_stmt``: it is built and compiled once, then served from
+SQLAlchemy's statement cache with only its bound parameters changing. Each
+query projects just the columns its response needs and returns plain ``Row``
+tuples.
+
+The ``*_version`` probes are single indexed lookups whose result changes
+whenever the matching response would, for conditional GETs.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, func, lambda_stmt, select
+
+from models import db, UserWallet, WalletTransaction, VirtualProduct, UserInventory
+
+
+def wallet_balance(user_id):
+    """Row of the balance response fields, or None"""
+    stmt = lambda_stmt(lambda: select(
+        UserWallet.sf_coins, UserWallet.premium_gems, UserWallet.event_tokens,
+        UserWallet.total_coins_earned, UserWallet.total_coins_spent,
+        UserWallet.daily_earnings, UserWallet.daily_earning_limit
+    ).where(UserWallet.user_id == user_id))
+    return db.session.execute(stmt).first()
+
+
+def wallet_history(user_id):
+    tx = WalletTransaction
+    stmt = lambda_stmt(lambda: select(
+        tx.id, tx.transaction_type, tx.currency_type, tx.amount,
+        tx.balance_before, tx.balance_after, tx.description, tx.created_at
+    ).where(tx.user_id == user_id).order_by(tx.created_at.desc(), tx.id.desc()))
+    return db.session.execute(stmt).all()
+
+
+def active_products():
+    """Products currently in their availability window, same filter as VirtualProduct.find_active_products"""
+    now = datetime.utcnow()
+    p = VirtualProduct
+    stmt = lambda_stmt(lambda: select(
+        p.id, p.name, p.description, p.product_type, p.currency_type,
+        p.price, p.stock_quantity, p.icon_url
+    ).where(
+        p.is_active.is_(True),
+        p.available_from.is_(None) | (p.available_from <= now),
+        p.available_to.is_(None) | (p.available_to >= now)
+    ))
+    return db.session.execute(stmt).all()
+
+
+def user_inventory(user_id):
+    item, product = UserInventory, VirtualProduct
+    stmt = lambda_stmt(lambda: select(
+        item.id, item.product_id, product.name.label('product_name'), product.product_type,
+        item.quantity, item.remaining_uses, item.is_equipped, item.is_active, item.is_consumed,
+        item.expired, item.acquired_at, item.expires_at
+    ).outerjoin(product, product.id == item.product_id).where(item.user_id == user_id))
+    return db.session.execute(stmt).all()
+
+
+def is_item_valid(row, now):
+    """UserInventory.is_valid() for a row, without flagging expiry as a write"""
+    if row.is_consumed or row.expired:
+        return False
+    return not (row.expires_at and row.expires_at < now)
+
+
+# ============================================================================
+# VERSION PROBES
+# ============================================================================
+
+def wallet_version(user_id):
+    """updated_at plus the balances; on MySQL updated_at alone only has
+    one-second resolution"""
+    w = UserWallet
+    stmt = lambda_stmt(lambda: select(
+        w.updated_at, w.sf_coins, w.premium_gems, w.event_tokens,
+        w.total_coins_earned, w.total_coins_spent, w.daily_earnings, w.daily_earning_limit
+    ).where(w.user_id == user_id))
+    return db.session.execute(stmt).first()
+
+
+def history_version(user_id):
+    """Id and time of the latest ledger entry; created_at has microseconds,
+    and the id breaks ties"""
+    tx = WalletTransaction
+    stmt = lambda_stmt(lambda: select(tx.created_at, tx.id).where(tx.user_id == user_id)
+                       .order_by(tx.created_at.desc(), tx.id.desc()).limit(1))
+    return db.session.execute(stmt).first()
+
+
+def inventory_version(user_id):
+    """Latest change, item count, and how many items have passed expires_at
+    (which flips is_valid without any write)"""
+    now = datetime.utcnow()
+    item = UserInventory
+    stmt = lambda_stmt(lambda: select(
+        func.max(item.updated_at), func.count(), func.sum(case((item.expires_at < now, 1), else_=0))
+    ).where(item.user_id == user_id))
+    return db.session.execute(stmt).first()
@@ -0,0 +1,203 @@
+"""
+Bulk refunds for recalled products.
+
+A refund job walks the product's completed purchases in id order,
+``REFUND_CHUNK_SIZE`` at a time. Each chunk is one short transaction that:
+
+* locks the job row, so two runners never work the same job,
+* locks the chunk's purchases, then their wallets in wallet id order,
+* marks the purchases refunded and deactivates their inventory rows,
+* credits wallets with one UPDATE per (currency, amount) group,
+* bulk-inserts the refund ledger rows and folds them into the rollups,
+* advances the job's cursor and totals.
+
+Chunks are kept small and separated by ``REFUND_CHUNK_PAUSE_MS`` so live
+requests keep getting locks and connections. A job stopped by a crash or a
+restart resumes from its cursor when it is started again.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import func, insert, select, update
+
+from models import db, ProductPurchase, ProductRefundJob, UserInventory, UserWallet, WalletTransaction
+from rollups import apply_ledger_rollups
+from transfers import with_deadlock_retry
+import leaderboard
+from change_feed import publish_inserted
+from invalidation import publish
+
+logger = logging.getLogger(__name__)
+
+REFUND_CHUNK_SIZE = int(os.getenv('REFUND_CHUNK_SIZE', '500'))
+REFUND_CHUNK_PAUSE_MS = int(os.getenv('REFUND_CHUNK_PAUSE_MS', '50'))
+REFUND_JOB_STALE_SECONDS = 60  # a running job with no progress for this long is taken over
+REFUND_CURRENCIES = ('sf_coins', 'premium_gems', 'event_tokens')
+
+
+def start_refund_job(product, deactivate_product=True):
+    """Create or resume the product's refund job; returns (job, started).
+
+    ``started`` is False when another runner is still making progress on it.
+    """
+    job = ProductRefundJob.find_open_for_product(product.id)
+    if job and job.status == 'running' and \
+            job.updated_at > datetime.utcnow() - timedelta(seconds=REFUND_JOB_STALE_SECONDS):
+        return job, False
+
+    if job is None:
+        total = db.session.query(func.count(ProductPurchase.id)).filter(
+            ProductPurchase.product_id == product.id,
+            ProductPurchase.status == 'completed'
+        ).scalar()
+        job = ProductRefundJob(product_id=product.id, total_purchases=total)
+        db.session.add(job)
+    else:
+        job.status = 'running'
+        job.error = None
+        job.updated_at = datetime.utcnow()
+    if deactivate_product:
+        product.is_active = False
+    db.session.commit()
+    return job, True
+
+
+def _refund_chunk(job_id, cursor):
+    """Refund the next chunk; returns (done, cursor)"""
+    session = db.session
+    job = session.execute(
+        select(ProductRefundJob).where(ProductRefundJob.id == job_id)
+        .with_for_update().execution_options(populate_existing=True)
+    ).scalar_one()
+    if job.status != 'running' or job.cursor != cursor:
+        session.rollback()
+        return True, job.cursor  # finished or taken over by another runner
+
+    purchase = ProductPurchase
+    query = select(purchase.id, purchase.user_id, purchase.currency_type, purchase.amount_paid).where(
+        purchase.product_id == job.product_id,
+        purchase.status == 'completed'
+    )
+    if cursor:
+        query = query.where(purchase.id > cursor)
+    rows = session.execute(query.order_by(purchase.id).limit(REFUND_CHUNK_SIZE).with_for_update()).all()
+
+    if not rows:
+        job.status = 'completed'
+        job.completed_at = datetime.utcnow()
+        session.commit()
+        return True, cursor
+
+    wallets = UserWallet.lock_by_user_ids({str(row.user_id) for row in rows})
+    now = datetime.utcnow()
+    balances = {}                 # (user_id, currency) -> running balance
+    credits = defaultdict(int)    # (user_id, currency) -> amount
+    refunded, ledger = [], []
+    for row in rows:
+        user_id = str(row.user_id)
+        wallet = wallets.get(user_id)
+        if wallet is None or row.currency_type not in REFUND_CURRENCIES:
+            continue
+        amount = int(row.amount_paid)
+        key = (user_id, row.currency_type)
+        before = balances.get(key, getattr(wallet, row.currency_type) or 0)
+        balances[key] = before + amount
+        credits[key] += amount
+        refunded.append(str(row.id))
+        ledger.append({
+            "id": str(uuid.uuid4()),
+            "wallet_id": str(wallet.id),
+            "user_id": user_id,
+            "transaction_type": "refund",
+            "currency_type": row.currency_type,
+            "amount": amount,
+            "balance_before": before,
+            "balance_after": before + amount,
+            "reference_type": "product_recall",
+            "description": f"Recall refund for purchase {row.id}",
+            "created_at": now
+        })
+
+    if refunded:
+        session.execute(
+            update(ProductPurchase).where(ProductPurchase.id.in_(refunded)).values(status='refunded')
+            .execution_options(synchronize_session=False)
+        )
+        session.execute(
+            update(UserInventory).where(UserInventory.purchase_id.in_(refunded))
+            .values(is_active=False, is_equipped=False)
+            .execution_options(synchronize_session=False)
+        )
+        UserInventory.mark_changed({user_id for user_id, _ in credits})
+
+        # Most recalls refund one price, so this is usually one UPDATE per currency
+        groups = defaultdict(list)
+        for (user_id, currency), amount in credits.items():
+            groups[(currency, amount)].append(str(wallets[user_id].id))
+        for (currency, amount), wallet_ids in sorted(groups.items()):
+            column = getattr(UserWallet, currency)
+            values = {column: column + amount}
+            if currency == 'sf_coins':
+                values[UserWallet.total_coins_spent] = UserWallet.total_coins_spent - amount
+            session.execute(
+                update(UserWallet).where(UserWallet.id.in_(sorted(wallet_ids))).values(values)
+                .execution_options(synchronize_session=False)
+            )
+        publish('leaderboard', {user_id for user_id, _ in credits}, session)
+
+        session.execute(insert(WalletTransaction.__table__), ledger)
+        publish_inserted(session, ledger)
+        apply_ledger_rollups(session.connection(), [
+            (entry["user_id"], now, entry["currency_type"], "refund", entry["amount"]) for entry in ledger
+        ])
+
+    job.cursor = str(rows[-1].id)
+    job.purchases_refunded += len(refunded)
+    job.purchases_skipped += len(rows) - len(refunded)
+    for (_, currency), amount in credits.items():
+        setattr(job, f"{currency}_refunded", getattr(job, f"{currency}_refunded") + amount)
+    job.updated_at = now
+    session.commit()
+
+    # Core UPDATEs bypass the session events the leaderboard listens to;
+    # other workers re-read the wallets published above
+    if leaderboard.leaderboard is not None:
+        for (user_id, currency), balance in balances.items():
+            leaderboard.leaderboard.update(user_id, {currency: balance})
+    return False, job.cursor
+
+
+def run_refund_job(app, job_id):
+    """Process a job chunk by chunk until it completes, fails or is taken over"""
+    with app.app_context():
+        try:
+            cursor = db.session.get(ProductRefundJob, job_id).cursor
+            db.session.rollback()
+            while True:
+                (done, cursor), _ = with_deadlock_retry(_refund_chunk, job_id, cursor)
+                if done:
+                    break
+                time.sleep(REFUND_CHUNK_PAUSE_MS / 1000)
+        except Exception as e:
+            logger.exception("Refund job %s failed", job_id)
+            db.session.rollback()
+            db.session.execute(
+                update(ProductRefundJob).where(ProductRefundJob.id == job_id)
+                .values(status='failed', error=str(e))
+            )
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def launch_refund_job(app, job_id):
+    thread = threading.Thread(target=run_refund_job, args=(app, str(job_id)),
+                              name=f'refund-{job_id}', daemon=True)
+    thread.start()
+    return thread
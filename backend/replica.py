@@ -0,0 +1,246 @@
+"""
+Read-replica routing for GET endpoints.
+
+GET handlers decorated with ``@read_replica`` read from the ``replica`` bind
+when one is configured (``REPLICA_DATABASE_URL``), unless:
+
+* the user in the URL committed a write in this process within the last
+  ``READ_YOUR_WRITES_SECONDS`` (read-your-writes),
+* the client committed a write through any worker within that window, as
+  told by the marker it carries back (see below), or
+* the replica's measured lag exceeds ``REPLICA_MAX_LAG_SECONDS`` or cannot
+  be measured.
+
+In each case the request falls back to the primary. Write markers are
+collected automatically from the ORM objects every committed session
+wrote; set-based writes report their users with ``note_user_writes``
+(``UserInventory.mark_changed`` and the XP accrual do). A request that commits a write also answers with its commit
+time in the ``sf_last_write`` cookie and the ``X-Last-Write`` header;
+clients that do not keep cookies send the header value back. The window is
+checked against the wall clock, so workers on different hosts need
+synchronized clocks.
+
+Locally this can be exercised with two SQLite files, e.g.
+    DATABASE_URL=sqlite:////tmp/primary.db REPLICA_DATABASE_URL=sqlite:////tmp/replica.db
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import math
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, text
+
+from models import db, REPLICA_BIND
+from models.routing_session import RoutingSession
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '1'))
+
+READ_YOUR_WRITES_COOKIE = 'sf_last_write'
+READ_YOUR_WRITES_HEADER = 'X-Last-Write'
+
+
+def configure_replica(app):
+    """Register the replica bind; must run before ``db.init_app(app)``"""
+    replica_url = os.getenv('REPLICA_DATABASE_URL')
+    if replica_url:
+        app.config.setdefault("SQLALCHEMY_BINDS", {})[REPLICA_BIND] = replica_url
+    app.after_request(_send_write_marker)
+
+
+# ============================================================================
+# READ-YOUR-WRITES MARKERS
+# ============================================================================
+
+_recent_writers = {}  # user_id -> monotonic time the marker expires
+_recent_writers_lock = threading.Lock()
+
+
+def mark_user_write(user_id):
+    """Pin a user's reads to the primary for READ_YOUR_WRITES_SECONDS, and
+    the requesting client's reads through its marker"""
+    with _recent_writers_lock:
+        _recent_writers[str(user_id)] = time.monotonic() + READ_YOUR_WRITES_SECONDS
+    if has_request_context():
+        g.last_write_at = time.time()
+
+
+def user_recently_wrote(user_id):
+    now = time.monotonic()
+    with _recent_writers_lock:
+        expires = _recent_writers.get(str(user_id))
+        if expires is None:
+            return False
+        if expires <= now:
+            del _recent_writers[str(user_id)]
+            return False
+        return True
+
+
+def note_user_writes(session, user_ids):
+    """Mark users written with Core statements, which the ORM collection
+    below cannot see, once ``session`` commits"""
+    session.info.setdefault('written_user_ids', set()).update(str(user_id) for user_id in user_ids)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_written_users(session, flush_context):
+    written = session.info.setdefault('written_user_ids', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        user_id = getattr(obj, 'user_id', None)
+        if user_id is not None:
+            written.add(str(user_id))
+
+
+def client_recently_wrote():
+    """Whether the request carries a write marker from the last
+    READ_YOUR_WRITES_SECONDS; a little ahead of this host's clock counts"""
+    if not has_request_context():
+        return False
+    value = request.headers.get(READ_YOUR_WRITES_HEADER) or request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    try:
+        age = time.time() - float(value)
+    except (TypeError, ValueError):
+        return False
+    return -READ_YOUR_WRITES_SECONDS < age < READ_YOUR_WRITES_SECONDS
+
+
+def _send_write_marker(response):
+    wrote_at = g.pop('last_write_at', None)
+    if wrote_at is not None:
+        marker = f"{wrote_at:.3f}"
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, marker, max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+                            httponly=True, samesite='Lax')
+        response.headers[READ_YOUR_WRITES_HEADER] = marker
+    return response
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _mark_written_users(session):
+    for user_id in session.info.pop('written_user_ids', ()):
+        mark_user_write(user_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_written_users(session):
+    session.info.pop('written_user_ids', None)
+
+
+# ============================================================================
+# REPLICA LAG
+# ============================================================================
+
+def _mysql_lag(conn):
+    for sql, column in (("SHOW REPLICA STATUS", 'Seconds_Behind_Source'),
+                        ("SHOW SLAVE STATUS", 'Seconds_Behind_Master')):
+        try:
+            row = conn.execute(text(sql)).mappings().first()
+        except Exception:
+            continue
+        if row is None:
+            return 0.0  # Not configured as a replica (e.g. a local copy)
+        return None if row[column] is None else float(row[column])
+    return None
+
+
+def _postgresql_lag(conn):
+    return float(conn.execute(text(
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )).scalar())
+
+
+LAG_PROBES = {
+    'mysql': _mysql_lag,
+    'postgresql': _postgresql_lag,
+}
+
+
+class ReplicaLagMonitor:
+    """Cached replica lag; ``None`` means unknown and is treated as unhealthy"""
+
+    def __init__(self, check_interval=REPLICA_LAG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.probe = None  # Override with a callable(conn) to simulate lag
+        self._lag = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current_lag(self, engine):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._lag
+            self._checked_at = now
+
+        probe = self.probe or LAG_PROBES.get(engine.dialect.name, lambda conn: 0.0)
+        try:
+            with engine.connect() as conn:
+                lag = probe(conn)
+        except Exception:
+            lag = None
+
+        with self._lock:
+            self._lag = lag
+        return lag
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+# ============================================================================
+# ROUTING
+# ============================================================================
+
+def replica_available(user_id=None):
+    """Whether a read for ``user_id`` may be served from the replica"""
+    engine = db.engines.get(REPLICA_BIND)
+    if engine is None:
+        return False
+    if user_id is not None and user_recently_wrote(user_id) or client_recently_wrote():
+        return False
+    lag = lag_monitor.current_lag(engine)
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+
+def get_read_engine(user_id=None):
+    """Engine for standalone read connections (exports, batch readers)"""
+    return db.engines[REPLICA_BIND] if replica_available(user_id) else db.engine
+
+
+@contextmanager
+def _route_reads(use_replica):
+    previous = db.session.info.get('use_replica', False)
+    db.session.info['use_replica'] = use_replica
+    try:
+        yield
+    finally:
+        db.session.info['use_replica'] = previous
+
+
+def use_replica(user_id=None):
+    """Route reads in this block to the replica if it is fresh enough"""
+    return _route_reads(replica_available(user_id))
+
+
+def use_primary():
+    """Force reads in this block back to the primary"""
+    return _route_reads(False)
+
+
+def read_replica(view):
+    """Serve a read-only GET route from the replica when it is safe to.
+
+    The ``user_id`` view argument, when present, is checked against the
+    read-your-writes markers.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica((request.view_args or {}).get('user_id')):
+            return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,200 @@
+"""
+Daily ledger rollups.
+
+Every ``WalletTransaction`` flushed through the ORM session increments the
+matching ``wallet_daily_rollups`` and ``global_daily_rollups`` rows with an
+upsert in the same transaction, so the stats endpoints read a handful of
+pre-aggregated rows instead of scanning the ledger. Writers that insert
+ledger rows with Core statements must call ``apply_ledger_rollups``
+themselves.
+
+Rows are keyed by ``rollup_type``: the ledger's transaction type, except
+that transfers are split into ``transfer_in`` and ``transfer_out`` by the
+sign of the balance change.
+
+Backfill an existing ledger with:
+    python rollups.py --rebuild
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+import os
+import random
+
+from sqlalchemy import case, event, func, insert, select, delete
+
+from models import db, WalletTransaction, WalletDailyRollup, GlobalDailyRollup
+from models.routing_session import RoutingSession
+from write_paths import dialect_insert
+from sharding import scatter, shard_names, use_shard
+
+ROLLUP_GLOBAL_SLOTS = int(os.getenv('ROLLUP_GLOBAL_SLOTS', '16'))
+MAX_STATS_RANGE_DAYS = 366
+
+
+def upsert_increment(connection, model, rows):
+    """Insert rows, adding amount_total / transaction_count on key conflicts"""
+    if not rows:
+        return
+    table = model.__table__
+    dialect = connection.dialect.name
+    stmt = dialect_insert(connection, table)
+
+    increments = {
+        'amount_total': table.c.amount_total,
+        'transaction_count': table.c.transaction_count,
+    }
+    if dialect == 'mysql':
+        stmt = stmt.on_duplicate_key_update(
+            {name: column + stmt.inserted[name] for name, column in increments.items()}
+        )
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={name: column + stmt.excluded[name] for name, column in increments.items()}
+        )
+    connection.execute(stmt, rows)
+
+
+def rollup_type(transaction_type, balance_before, balance_after):
+    """Rollup key of a ledger entry; transfers by direction"""
+    if transaction_type == 'transfer':
+        return 'transfer_out' if balance_after < balance_before else 'transfer_in'
+    return transaction_type
+
+
+def apply_ledger_rollups(connection, entries):
+    """Fold ledger entries into the rollup tables on ``connection``.
+
+    ``entries`` yields (user_id, created_at, currency_type, rollup_type, amount).
+    """
+    per_user = defaultdict(lambda: [0, 0])
+    per_day = defaultdict(lambda: [0, 0])
+    for user_id, created_at, currency_type, transaction_type, amount in entries:
+        day = (created_at or datetime.utcnow()).date()
+        for totals in (per_user[(str(user_id), day, currency_type, transaction_type)],
+                       per_day[(day, currency_type, transaction_type)]):
+            totals[0] += amount
+            totals[1] += 1
+
+    # Sorted keys give concurrent writers the same lock order
+    slot = random.randrange(ROLLUP_GLOBAL_SLOTS)
+    upsert_increment(connection, WalletDailyRollup, [
+        {"user_id": user_id, "day": day, "currency_type": currency_type,
+         "transaction_type": transaction_type, "amount_total": amount, "transaction_count": count}
+        for (user_id, day, currency_type, transaction_type), (amount, count) in sorted(per_user.items())
+    ])
+    upsert_increment(connection, GlobalDailyRollup, [
+        {"day": day, "currency_type": currency_type, "transaction_type": transaction_type,
+         "slot": slot, "amount_total": amount, "transaction_count": count}
+        for (day, currency_type, transaction_type), (amount, count) in sorted(per_day.items())
+    ])
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _rollup_new_transactions(session, flush_context):
+    entries = [
+        (obj.user_id, obj.created_at, obj.currency_type,
+         rollup_type(obj.transaction_type, obj.balance_before, obj.balance_after), obj.amount)
+        for obj in session.new if isinstance(obj, WalletTransaction)
+    ]
+    if entries:
+        apply_ledger_rollups(session.connection(), entries)
+
+
+# ============================================================================
+# QUERIES
+# ============================================================================
+
+def parse_day_range(args, default_days=7):
+    """Parse ``from`` / ``to`` (YYYY-MM-DD) query args; raises ValueError"""
+    end_day = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') \
+        else datetime.utcnow().date()
+    start_day = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') \
+        else end_day - timedelta(days=default_days - 1)
+    if start_day > end_day:
+        raise ValueError("from must not be after to")
+    if (end_day - start_day).days >= MAX_STATS_RANGE_DAYS:
+        raise ValueError(f"Date range is limited to {MAX_STATS_RANGE_DAYS} days")
+    return start_day, end_day
+
+
+def _summarize(rows):
+    days = defaultdict(lambda: defaultdict(dict))
+    totals = defaultdict(dict)
+    for day, currency_type, transaction_type, amount, count in rows:
+        days[day.isoformat()][currency_type][transaction_type] = {"amount": int(amount), "count": int(count)}
+        total = totals[currency_type].setdefault(transaction_type, {"amount": 0, "count": 0})
+        total["amount"] += int(amount)
+        total["count"] += int(count)
+    return {"days": days, "totals": totals}
+
+
+def user_stats(user_id, start_day, end_day):
+    rows = [
+        (r.day, r.currency_type, r.transaction_type, r.amount_total, r.transaction_count)
+        for r in WalletDailyRollup.find_for_user(user_id, start_day, end_day)
+    ]
+    return _summarize(rows)
+
+
+def global_stats(start_day, end_day):
+    """Summed across shards; each holds the rollups of its own users"""
+    model = GlobalDailyRollup
+    stmt = (
+        select(model.day, model.currency_type, model.transaction_type,
+               func.sum(model.amount_total), func.sum(model.transaction_count))
+        .where(model.day >= start_day, model.day <= end_day)
+        .group_by(model.day, model.currency_type, model.transaction_type)
+    )
+    merged = defaultdict(lambda: [0, 0])
+    for rows in scatter(lambda: db.session.execute(stmt).all()).values():
+        for day, currency_type, transaction_type, amount, count in rows:
+            total = merged[(day, currency_type, transaction_type)]
+            total[0] += int(amount)
+            total[1] += int(count)
+    return _summarize(sorted((*key, amount, count) for key, (amount, count) in merged.items()))
+
+
+# ============================================================================
+# BACKFILL
+# ============================================================================
+
+def rebuild_rollups():
+    """Recompute both rollup tables from the full ledger of the session's
+    database (see ``use_shard``)"""
+    tx = WalletTransaction
+    day = func.date(tx.created_at)
+    kind = case(
+        (tx.transaction_type != 'transfer', tx.transaction_type),
+        (tx.balance_after < tx.balance_before, 'transfer_out'),
+        else_='transfer_in'
+    )
+    with db.session.get_bind().begin() as conn:
+        conn.execute(delete(WalletDailyRollup))
+        conn.execute(delete(GlobalDailyRollup))
+        conn.execute(insert(WalletDailyRollup).from_select(
+            ['user_id', 'day', 'currency_type', 'transaction_type', 'amount_total', 'transaction_count'],
+            select(tx.user_id, day, tx.currency_type, kind, func.sum(tx.amount), func.count())
+            .group_by(tx.user_id, day, tx.currency_type, kind)
+        ))
+        conn.execute(insert(GlobalDailyRollup).from_select(
+            ['day', 'currency_type', 'transaction_type', 'slot', 'amount_total', 'transaction_count'],
+            select(day, tx.currency_type, kind, 0, func.sum(tx.amount), func.count())
+            .group_by(day, tx.currency_type, kind)
+        ))
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Maintain wallet ledger rollups")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute rollups from the ledger")
+    args = parser.parse_args()
+    if args.rebuild:
+        with app.app_context():
+            for shard in shard_names():
+                with use_shard(shard):
+                    rebuild_rollups()
+        print("✅ Rollups rebuilt")
@@ -0,0 +1,413 @@
+"""
+Deterministic scale dataset generator.
+
+    python seed.py --users 1000000 --products 2000 --workers 8
+    python seed.py --users 50000 --seed 7 --end 2026-01-01   # reproducible run
+    python seed.py --users 1000000 --bulk native             # LOAD DATA / COPY
+
+Generates a catalog, then users in chunks of ``--chunk-size``, each with a
+wallet, a ledger, purchases, inventory and event-token balances that are
+consistent with one another (wallet balances and totals match the ledger,
+purchases have their ledger row and inventory item). Skew is modeled on
+production:
+
+* transactions per user follow a Pareto long tail (``--tx-median``), so a
+  few heavy users own a large share of the ledger,
+* product popularity is Zipf-distributed over the catalog,
+* about a third of the users hold event tokens.
+
+Everything is derived from ``--seed`` and ``--end``. Each user's rows come
+from a generator keyed on (seed, user index), so the output is identical
+whatever the chunk size or worker count. ``--end`` defaults to today, so
+pass it explicitly to reproduce a dataset on another day.
+
+Chunks are generated and written in parallel by ``--workers`` processes,
+one transaction per chunk. ``--bulk insert`` (default) uses multi-row
+executemany inserts. ``--bulk native`` streams each table through MySQL's
+``LOAD DATA LOCAL INFILE`` (the server needs ``local_infile=ON``) or
+PostgreSQL's ``COPY``, and falls back to inserts elsewhere. SQLite
+serializes writers, so extra workers there only overlap generation.
+"""
+
+import argparse
+from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import accumulate
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import make_url
+
+from models import (
+    User, UserWallet, WalletTransaction, VirtualProduct, ProductPurchase, UserInventory, EventTokenBalance
+)
+from xp import xp_for, level_for
+
+SEED_CHUNK_SIZE = 2000
+PARETO_ALPHA = 1.16  # the 80/20 rule
+ZIPF_EXPONENT = 1.1
+MAX_TRANSACTIONS_PER_USER = 20000
+DAILY_EARNING_LIMIT = 1000
+EVENT_TOKEN_SHARE = 0.35
+EVENT_IDS = tuple(f"event_{i:02d}" for i in range(12))
+ACHIEVEMENT_IDS = tuple(f"ach_{i:02d}" for i in range(24))
+
+# Ledger step kinds and their weights
+STEPS = ('earn', 'bonus', 'spend', 'gems', 'purchase')
+STEP_WEIGHTS = tuple(accumulate((0.70, 0.06, 0.09, 0.04, 0.11)))
+
+PRODUCT_TYPES = ('cosmetic', 'booster', 'feature_unlock', 'subscription', 'collectible', 'currency_pack')
+PRODUCT_TYPE_WEIGHTS = tuple(accumulate((0.40, 0.20, 0.10, 0.08, 0.17, 0.05)))
+
+# Tables in foreign key order
+TABLES = (User, UserWallet, WalletTransaction, ProductPurchase, UserInventory, EventTokenBalance)
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _pick(rng, choices, cum_weights):
+    return choices[bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+
+# ============================================================================
+# CATALOG
+# ============================================================================
+
+def build_catalog(seed, products, end):
+    """VirtualProduct rows, most popular first"""
+    rng = random.Random(f"{seed}:catalog")
+    rows = []
+    for index in range(products):
+        product_type = _pick(rng, PRODUCT_TYPES, PRODUCT_TYPE_WEIGHTS)
+        roll = rng.random()
+        currency = 'sf_coins' if roll < 0.70 else 'premium_gems' if roll < 0.95 else 'event_tokens'
+        price = max(1, round(rng.lognormvariate(5.0 if currency == 'sf_coins' else 2.5, 0.8)))
+        rows.append({
+            "id": _uuid(rng),
+            "name": f"{product_type.replace('_', ' ').title()} #{index}",
+            "description": f"Seeded {product_type} {index}",
+            "product_type": product_type,
+            "currency_type": currency,
+            "price": Decimal(price),
+            "duration_days": rng.choice((7, 30, 90)) if product_type in ('booster', 'subscription') else None,
+            "consumable": product_type == 'booster',
+            "max_purchases": None,
+            "stock_quantity": rng.randint(100, 10000) if rng.random() < 0.05 else None,
+            "min_user_level": rng.choice((1, 1, 1, 5, 10, 20)),
+            "required_achievements": [rng.choice(ACHIEVEMENT_IDS)] if rng.random() < 0.1 else None,
+            "is_active": rng.random() < 0.95,
+            "available_from": None,
+            "available_to": None,
+            "icon_url": f"https://cdn.example.com/icons/{index}.png",
+            "preview_url": None,
+            "created_at": end - timedelta(days=365),
+            "updated_at": end - timedelta(days=365),
+        })
+    return rows
+
+
+def popularity(products):
+    """Cumulative Zipf weights over the catalog order"""
+    return tuple(accumulate(1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(products)))
+
+
+# ============================================================================
+# USERS
+# ============================================================================
+
+class Ledger:
+    """Running balances and ledger rows of one wallet"""
+
+    def __init__(self, wallet_id, user_id):
+        self.wallet_id = wallet_id
+        self.user_id = user_id
+        self.balances = {'sf_coins': 0, 'premium_gems': 0, 'event_tokens': 0}
+        self.earned = self.spent = self.xp = 0
+        self.daily = {}  # day -> sf_coins earned under the daily limit
+        self.rows = []
+
+    def post(self, rng, when, transaction_type, currency, amount, description, reference_type=None):
+        before = self.balances[currency]
+        after = before + amount if transaction_type in ('earn', 'bonus', 'refund') else before - amount
+        self.balances[currency] = after
+        xp = xp_for(transaction_type, amount)
+        self.xp += xp
+        row = {
+            "id": _uuid(rng), "wallet_id": self.wallet_id, "user_id": self.user_id,
+            "transaction_type": transaction_type, "currency_type": currency, "amount": amount,
+            "balance_before": before, "balance_after": after, "xp_amount": xp, "exchange_rate": 0,
+            "reference_type": reference_type, "reference_id": None, "description": description, "created_at": when,
+        }
+        self.rows.append(row)
+        return row
+
+
+def generate_user(seed, index, config, catalog, weights):
+    """All rows for user ``index``: {model: [row, ...]}"""
+    rng = random.Random(f"{seed}:user:{index}")
+    end, days = config['end'], config['days']
+    user_id, wallet_id = _uuid(rng), _uuid(rng)
+    created_at = end - timedelta(seconds=rng.uniform(0, days * 86400))
+    ledger = Ledger(wallet_id, user_id)
+    purchases, inventory = [], []
+    equipped = {}  # product type -> newest unexpired cosmetic or collectible
+
+    transactions = min(int(config['tx_median'] * rng.paretovariate(PARETO_ALPHA) / 2 ** (1 / PARETO_ALPHA)),
+                       MAX_TRANSACTIONS_PER_USER)
+    span = (end - created_at).total_seconds()
+    for offset in sorted(rng.uniform(0, span) for _ in range(transactions)):
+        when = created_at + timedelta(seconds=offset)
+        step = _pick(rng, STEPS, STEP_WEIGHTS)
+        if step == 'earn':
+            amount = rng.randint(5, 100)
+            day = when.date()
+            if ledger.daily.get(day, 0) + amount > DAILY_EARNING_LIMIT:
+                step = 'bonus'
+            else:
+                ledger.daily[day] = ledger.daily.get(day, 0) + amount
+                ledger.earned += amount
+                ledger.post(rng, when, 'earn', 'sf_coins', amount, "Daily quest reward")
+        if step == 'bonus':
+            amount = rng.choice((50, 100, 250, 500))
+            ledger.earned += amount
+            ledger.post(rng, when, 'bonus', 'sf_coins', amount, "Achievement bonus")
+        elif step == 'spend' and ledger.balances['sf_coins'] >= 10:
+            amount = rng.randint(10, max(10, ledger.balances['sf_coins'] // 4))
+            ledger.spent += amount
+            ledger.post(rng, when, 'spend', 'sf_coins', amount, "Spent SF Coins")
+        elif step == 'gems':
+            ledger.post(rng, when, 'earn', 'premium_gems', rng.choice((20, 50, 100, 500)), "Premium gems top-up")
+        elif step == 'purchase':
+            product = _pick(rng, catalog, weights)
+            price = int(product['price'])
+            currency = product['currency_type']
+            if not product['is_active'] or ledger.balances[currency] < price:
+                continue
+            if currency == 'sf_coins':
+                ledger.spent += price
+            transaction = ledger.post(rng, when, 'purchase', currency, price, f"Purchased {product['name']}", 'purchase')
+            purchase_id = _uuid(rng)
+            expires_at = when + timedelta(days=product['duration_days']) if product['duration_days'] else None
+            purchases.append({
+                "id": purchase_id, "user_id": user_id, "product_id": product['id'], "currency_type": currency,
+                "amount_paid": product['price'], "status": 'completed', "purchased_at": when,
+                "expires_at": expires_at, "is_delivered": True, "delivered_at": when,
+                "transaction_id": transaction['id'],
+            })
+            consumed = product['consumable'] and rng.random() < 0.5
+            item = {
+                "id": _uuid(rng), "user_id": user_id, "product_id": product['id'], "purchase_id": purchase_id,
+                "quantity": 1, "remaining_uses": (0 if consumed else 3) if product['consumable'] else None,
+                "acquired_at": when, "expires_at": expires_at, "is_equipped": False, "is_active": True,
+                "is_consumed": consumed, "expired": bool(expires_at and expires_at < end), "updated_at": when,
+            }
+            inventory.append(item)
+            if product['product_type'] in ('cosmetic', 'collectible') and not item['expired']:
+                equipped[product['product_type']] = item
+
+    for item in equipped.values():
+        item['is_equipped'] = True
+
+    token_balances, token_moves = [], []
+    if rng.random() < EVENT_TOKEN_SHARE:
+        for event_id in rng.sample(EVENT_IDS, rng.randint(1, 3)):
+            earned = rng.randint(10, 500)
+            spent = rng.randint(0, earned)
+            earned_at = created_at + timedelta(seconds=rng.uniform(0, span))
+            token_moves.append((earned_at, 'earn', earned, f"Event {event_id} tokens"))
+            if spent:
+                spent_at = earned_at + timedelta(seconds=rng.uniform(0, (end - earned_at).total_seconds()))
+                token_moves.append((spent_at, 'spend', spent, f"Spent event {event_id} tokens"))
+            token_balances.append({
+                "id": _uuid(rng), "user_id": user_id, "wallet_id": wallet_id, "event_id": event_id,
+                "balance": earned - spent, "earned_total": earned, "spent_total": spent,
+                "created_at": created_at, "expires_at": end + timedelta(days=rng.choice((7, 14, 30))),
+                "last_updated": end - timedelta(days=rng.uniform(0, 7)),
+            })
+
+    # Token rows go in time order so their running balance is consistent
+    for when, transaction_type, amount, description in sorted(token_moves):
+        ledger.post(rng, when, transaction_type, 'event_tokens', amount, description)
+
+    today = (end - timedelta(seconds=1)).date()
+    level = level_for(ledger.xp)
+    user = {
+        "id": user_id, "username": f"s{seed}_user_{index}", "email": f"s{seed}_user_{index}@example.com",
+        "password_hash": None, "created_at": created_at, "updated_at": created_at, "is_active": rng.random() < 0.98,
+        "xp": ledger.xp, "level": level, "achievements": sorted(rng.sample(ACHIEVEMENT_IDS, min(len(ACHIEVEMENT_IDS), level // 4))),
+    }
+    wallet = {
+        "id": wallet_id, "user_id": user_id,
+        "sf_coins": ledger.balances['sf_coins'], "premium_gems": ledger.balances['premium_gems'],
+        "event_tokens": sum(balance['balance'] for balance in token_balances),
+        "total_coins_earned": ledger.earned, "total_coins_spent": ledger.spent,
+        "daily_earnings": ledger.daily.get(today, 0), "daily_earning_limit": DAILY_EARNING_LIMIT,
+        "created_at": created_at, "updated_at": max(row['created_at'] for row in ledger.rows) if ledger.rows else created_at,
+        "last_earning_reset": datetime.combine(today, datetime.min.time()),
+    }
+    return {
+        User: [user], UserWallet: [wallet], WalletTransaction: ledger.rows,
+        ProductPurchase: purchases, UserInventory: inventory, EventTokenBalance: token_balances,
+    }
+
+
+# ============================================================================
+# WRITING
+# ============================================================================
+
+def _tsv_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, list):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def native_load(conn, table, rows):
+    """Bulk-load rows through LOAD DATA LOCAL INFILE (MySQL) or COPY (PostgreSQL)"""
+    columns = list(rows[0])
+    lines = ''.join('\t'.join(_tsv_value(row[column]) for column in columns) + '\n' for row in rows)
+    dialect = conn.dialect.name
+    cursor = conn.connection.cursor()
+    try:
+        if dialect == 'postgresql':
+            import io
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", io.StringIO(lines))
+        else:
+            with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                cursor.execute(
+                    f"LOAD DATA LOCAL INFILE %s INTO TABLE {table.name} CHARACTER SET utf8mb4 "
+                    f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                    f"({', '.join(columns)})",
+                    (f.name,)
+                )
+    finally:
+        cursor.close()
+
+
+def write_rows(conn, table, rows, bulk):
+    if not rows:
+        return
+    if bulk == 'native' and conn.dialect.name in ('mysql', 'postgresql'):
+        native_load(conn, table, rows)
+    else:
+        conn.execute(insert(table), rows)
+
+
+_engine = None
+_catalog = None
+
+
+def _worker_init(url, bulk, seed, products, end):
+    """Per-process engine and catalog; nothing is inherited from the parent's pools"""
+    global _engine, _catalog
+    connect_args = {}
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        connect_args['timeout'] = 300
+    elif backend == 'mysql' and bulk == 'native':
+        connect_args['local_infile'] = True
+    _engine = create_engine(url, connect_args=connect_args, pool_size=1, max_overflow=0) \
+        if backend != 'sqlite' else create_engine(url, connect_args=connect_args)
+    catalog = build_catalog(seed, products, end)
+    _catalog = (catalog, popularity(len(catalog)))
+
+
+def seed_chunk(config, start, stop):
+    """Generate and write users [start, stop) in one transaction; returns row counts"""
+    catalog, weights = _catalog
+    tables = {model: [] for model in TABLES}
+    for index in range(start, stop):
+        for model, rows in generate_user(config['seed'], index, config, catalog, weights).items():
+            tables[model].extend(rows)
+    with _engine.begin() as conn:
+        for model in TABLES:
+            write_rows(conn, model.__table__, tables[model], config['bulk'])
+    return {model.__tablename__: len(rows) for model, rows in tables.items()}
+
+
+def seed(url, config, workers, chunk_size):
+    """Write the catalog, then all user chunks in parallel; returns row counts per table"""
+    _worker_init(url, config['bulk'], config['seed'], config['products'], config['end'])
+    catalog, _ = _catalog
+    with _engine.begin() as conn:
+        write_rows(conn, VirtualProduct.__table__, catalog, config['bulk'])
+    _engine.dispose()
+
+    totals = {VirtualProduct.__tablename__: len(catalog)}
+    chunks = [(start, min(start + chunk_size, config['users'])) for start in range(0, config['users'], chunk_size)]
+    started = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_worker_init,
+        initargs=(url, config['bulk'], config['seed'], config['products'], config['end'])
+    ) as pool:
+        futures = [pool.submit(seed_chunk, config, start, stop) for start, stop in chunks]
+        for done, future in enumerate(futures, 1):
+            for table, count in future.result().items():
+                totals[table] = totals.get(table, 0) + count
+            elapsed = time.monotonic() - started
+            print(f"  chunk {done}/{len(chunks)}: {sum(totals.values()):,} rows, "
+                  f"{sum(totals.values()) / elapsed:,.0f} rows/s", flush=True)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--tx-median', type=int, default=20, help="Median transactions per user")
+    parser.add_argument('--days', type=int, default=90, help="History length")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end', type=lambda value: datetime.fromisoformat(value),
+                        default=datetime.combine(datetime.utcnow().date(), datetime.min.time()),
+                        help="End of the generated history, ISO date (default: today)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=SEED_CHUNK_SIZE, help="Users per transaction")
+    parser.add_argument('--bulk', choices=('insert', 'native'), default='insert')
+    parser.add_argument('--skip-rollups', action='store_true', help="Don't rebuild the ledger rollups afterwards")
+    parser.add_argument('--skip-snapshots', action='store_true', help="Don't write daily balance snapshots afterwards")
+    args = parser.parse_args()
+
+    from app import app
+    from rollups import rebuild_rollups
+    from snapshots import write_snapshots, first_ledger_day
+    url = app.config["SQLALCHEMY_DATABASE_URI"]
+    config = {
+        "seed": args.seed, "users": args.users, "products": args.products, "tx_median": args.tx_median,
+        "days": args.days, "end": args.end, "bulk": args.bulk,
+    }
+    print(f"Seeding {args.users:,} users, {args.products:,} products (seed {args.seed}, "
+          f"end {args.end.date().isoformat()}) with {args.workers} workers")
+    started = time.monotonic()
+    totals = seed(url, config, args.workers, args.chunk_size)
+    if not args.skip_rollups:
+        with app.app_context():
+            rebuild_rollups()
+    if not args.skip_snapshots:
+        with app.app_context():
+            first_day = first_ledger_day()
+            if first_day:
+                write_snapshots(first_day, (args.end - timedelta(seconds=1)).date())
+    elapsed = time.monotonic() - started
+    for table, count in totals.items():
+        print(f"  {table:<22} {count:>12,}")
+    print(f"✅ Seeded {sum(totals.values()):,} rows in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Production launcher: gunicorn with a preloaded app and autotuned workers.
+
+    python serve.py                      # bind 0.0.0.0:$PORT (default 5001)
+    python serve.py --dry-run            # print the tuning and exit
+    WEB_WORKERS=4 WEB_THREADS=8 python serve.py
+
+* The app is imported once in the master (``preload_app``), and hot SQL is
+  compiled there, so code, mappers and compiled statements are shared
+  copy-on-write by every worker. ``gc.freeze()`` keeps the collector from
+  touching, and so un-sharing, those pages.
+* The master disposes its engines before forking and every worker disposes
+  its inherited pools again, so no two processes ever share a DB socket.
+* Each worker runs ``DB_POOL_SIZE + DB_MAX_OVERFLOW - 1`` threads, one
+  connection short of its pool to leave room for background jobs. The
+  worker count is ``2 x CPUs``, capped so that all pools together fit in
+  ``DB_POOL_BUDGET`` connections.
+* Before taking traffic, each worker builds its in-memory caches
+  (``WARMUP_CACHES``, default ``catalog,leaderboard``), then logs its
+  startup time and memory.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import time
+
+from gunicorn.app.base import BaseApplication
+
+STARTED = time.monotonic()
+
+logger = logging.getLogger('gunicorn.error')
+
+DB_POOL_BUDGET = int(os.getenv('DB_POOL_BUDGET', '100'))
+WARMUP_CACHES = tuple(c.strip() for c in os.getenv('WARMUP_CACHES', 'catalog,leaderboard').split(',') if c.strip())
+
+
+def autotune(cpu_count, pool_per_worker, pool_budget, workers=None, threads=None):
+    """(workers, threads) for a CPU count and a DB connection budget"""
+    threads = threads or max(1, pool_per_worker - 1)
+    workers = workers or max(1, min(2 * cpu_count, pool_budget // max(1, pool_per_worker)))
+    return workers, threads
+
+
+def memory_usage(pid='self'):
+    """(rss, pss, shared) bytes from /proc, or the peak RSS where that is unavailable"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f if line.endswith('kB\n')}
+        return fields['Rss'], fields['Pss'], fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    except (OSError, KeyError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return rss, None, None
+
+
+def _mib(value):
+    return f"{value / 2**20:.0f} MiB" if value is not None else "n/a"
+
+
+def prime_statements():
+    """Compile the hot read statements once so workers inherit the cache"""
+    import read_queries
+    probe = '00000000-0000-0000-0000-000000000000'
+    read_queries.wallet_balance(probe)
+    read_queries.wallet_history(probe)
+    read_queries.active_products()
+    read_queries.user_inventory(probe)
+
+
+def warm_up(app):
+    """Build this worker's in-memory caches before it accepts requests"""
+    import app as app_module
+    with app.app_context():
+        from models import db
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
+    if 'catalog' in WARMUP_CACHES:
+        app_module.catalog_search.index()
+        app_module.eligible_catalog.table()
+    if 'leaderboard' in WARMUP_CACHES:
+        app_module.leaderboard.ensure_built()
+
+
+def dispose_engines(app, close=True):
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+# Gunicorn server hooks
+
+def when_ready(server):
+    app = server.app.wsgi()
+    try:
+        with app.app_context():
+            prime_statements()
+    except Exception:
+        logger.exception("Statement priming failed; workers will compile on first use")
+    dispose_engines(app)
+    gc.freeze()
+    rss, _, _ = memory_usage()
+    logger.info("Master ready in %.2fs (rss %s)", time.monotonic() - STARTED, _mib(rss))
+
+
+def post_fork(server, worker):
+    # Drop inherited pool state without closing the parent's sockets
+    dispose_engines(server.app.wsgi(), close=False)
+
+
+def post_worker_init(worker):
+    started = time.monotonic()
+    try:
+        warm_up(worker.app.wsgi())
+    except Exception:
+        logger.exception("Warm-up failed; caches will build on first request")
+    rss, pss, shared = memory_usage()
+    logger.info(
+        "Worker %s ready %.2fs after launch (warm-up %.2fs): rss %s, pss %s, shared %s",
+        worker.pid, time.monotonic() - STARTED, time.monotonic() - started, _mib(rss), _mib(pss), _mib(shared)
+    )
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def main():
+    started = time.monotonic()
+    from app import DB_POOL_SIZE, DB_MAX_OVERFLOW
+    print(f"App loaded in {time.monotonic() - started:.2f}s")
+
+    parser = argparse.ArgumentParser(description="Run the API under gunicorn")
+    parser.add_argument('--bind', default=f"0.0.0.0:{os.getenv('PORT', '5001')}")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', '0')) or None)
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', '0')) or None)
+    parser.add_argument('--dry-run', action='store_true', help="Print the tuning and exit")
+    args = parser.parse_args()
+
+    pool_per_worker = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    workers, threads = autotune(os.cpu_count() or 1, pool_per_worker, DB_POOL_BUDGET, args.workers, args.threads)
+    print(f"{workers} workers x {threads} threads, {pool_per_worker} DB connections per worker "
+          f"({workers * pool_per_worker} of a {DB_POOL_BUDGET} budget)")
+    if args.dry_run:
+        return
+
+    ProductionServer({
+        'bind': args.bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': int(os.getenv('WEB_TIMEOUT', '30')),
+        'keepalive': 5,
+        'accesslog': '-',
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
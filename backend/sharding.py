@@ -0,0 +1,377 @@
+"""
+Horizontal sharding of per-user data across several databases.
+
+``SHARD_DATABASE_URLS`` lists the shards as ``name=url`` pairs, e.g.
+    SHARD_DATABASE_URLS=s0=sqlite:////tmp/s0.db,s1=sqlite:////tmp/s1.db
+
+Each user's rows (user, wallet, ledger, purchases, inventory, event
+tokens, rollups and snapshots) live on the shard a consistent-hash ring
+assigns to the user id. ``SHARD_VNODES`` points per shard keep the split
+even, and adding a shard moves only about 1/N of the users.
+
+The default database (``DATABASE_URL``) stays the home of the catalog,
+refund jobs and exchange rates. ``virtual_products`` is copied to every
+shard after each commit that writes it, so a purchase reads its product
+and writes its ledger rows on one shard. Writes to the catalog (e.g. a
+stock decrement) still go to the default database.
+
+Routes are pinned with ``@user_shard`` (or ``use_shard``), which sets
+``session.info['shard']`` for ``RoutingSession``. Cross-shard admin reads
+fan out with ``scatter``. Transfers must stay within one shard.
+
+Maintenance, with the app stopped or writes paused:
+    python sharding.py --sync-catalog          # copy the catalog to every shard
+    python sharding.py --rebalance [--dry-run] # move users to their ring shard
+
+``--rebalance`` also moves users out of the default database, which is
+how an unsharded deployment is split. Without ``SHARD_DATABASE_URLS``
+everything here is a no-op and the app runs on one database.
+"""
+
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+import hashlib
+import logging
+import os
+import threading
+
+from flask import current_app, request
+from sqlalchemy import bindparam, delete, event, insert, select, update
+
+from degraded import current_statement_timeout, statement_timeout
+from models import (db, SHARD_BIND_PREFIX, User, UserWallet, WalletTransaction, ProductPurchase,
+                    UserInventory, EventTokenBalance, VirtualProduct, WalletDailyRollup, WalletDailySnapshot)
+from models.routing_session import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', '128'))
+SHARD_SCATTER_WORKERS = int(os.getenv('SHARD_SCATTER_WORKERS', '8'))
+SHARD_REBALANCE_BATCH = int(os.getenv('SHARD_REBALANCE_BATCH', '500'))
+
+# Per-user tables in foreign-key order, with the column holding the user id
+USER_TABLES = (
+    (User.__table__, 'id'),
+    (UserWallet.__table__, 'user_id'),
+    (WalletTransaction.__table__, 'user_id'),
+    (ProductPurchase.__table__, 'user_id'),
+    (UserInventory.__table__, 'user_id'),
+    (EventTokenBalance.__table__, 'user_id'),
+    (WalletDailyRollup.__table__, 'user_id'),
+    (WalletDailySnapshot.__table__, 'user_id'),
+)
+
+# Set by configure_shards(); None when sharding is off
+shard_ring = None
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class ShardRing:
+    """Consistent-hash ring of shard names with ``vnodes`` points each"""
+
+    def __init__(self, names, vnodes=SHARD_VNODES):
+        if not names or len(set(names)) != len(names):
+            raise ValueError("Shard names must be unique and non-empty")
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self.names = tuple(names)
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def shard_for(self, key):
+        index = bisect_right(self._points, _hash(str(key)))
+        return self._owners[index % len(self._owners)]
+
+
+def parse_shard_urls(value):
+    """{name: url} from "name=url,name=url"; raises ValueError"""
+    shards = {}
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        name, sep, url = entry.partition('=')
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid shard entry '{entry}', expected name=url")
+        if name.strip() in shards:
+            raise ValueError(f"Duplicate shard name '{name.strip()}'")
+        shards[name.strip()] = url.strip()
+    return shards
+
+
+def configure_shards(app):
+    """Register the shard binds and the ring; must run before ``db.init_app(app)``"""
+    global shard_ring
+    shards = parse_shard_urls(os.getenv('SHARD_DATABASE_URLS', ''))
+    if not shards:
+        shard_ring = None
+        return
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    for name, url in shards.items():
+        binds[SHARD_BIND_PREFIX + name] = url
+    shard_ring = ShardRing(list(shards))
+
+
+def shards_enabled():
+    return shard_ring is not None
+
+
+def shard_for(user_id):
+    """Shard name of a user, or None when sharding is off"""
+    return shard_ring.shard_for(str(user_id)) if shard_ring else None
+
+
+def shard_names():
+    """Names of the databases holding user rows: the shards, or (None,)
+    for the default database when sharding is off"""
+    return shard_ring.names if shard_ring else (None,)
+
+
+def shard_engines():
+    """{name: engine} of every shard; empty when sharding is off"""
+    if shard_ring is None:
+        return {}
+    return {name: db.engines[SHARD_BIND_PREFIX + name] for name in shard_ring.names}
+
+
+def create_shard_schemas():
+    for engine in shard_engines().values():
+        db.metadata.create_all(engine)
+
+
+# ============================================================================
+# ROUTING
+# ============================================================================
+
+@contextmanager
+def use_shard(name):
+    """Send this block's statements to shard ``name`` (None: the default database)"""
+    previous = db.session.info.get('shard')
+    db.session.info['shard'] = SHARD_BIND_PREFIX + name if name else None
+    try:
+        yield
+    finally:
+        db.session.info['shard'] = previous
+
+
+def group_by_shard(user_ids):
+    """{shard: [user_id, ...]} preserving order; one None group when sharding is off"""
+    groups = defaultdict(list)
+    for user_id in user_ids:
+        groups[shard_for(user_id)].append(user_id)
+    return dict(groups)
+
+
+def common_shard(user_ids):
+    """The one shard holding all ``user_ids``; raises ValueError if they span several"""
+    shards = set(group_by_shard(user_ids))
+    if len(shards) > 1:
+        raise ValueError("Transfers between users on different shards are not supported")
+    return shards.pop() if shards else None
+
+
+def request_user_id():
+    """The user a request acts for: the ``user_id`` view argument, else
+    ``user_id`` or ``from_user_id`` in the JSON body"""
+    user_id = (request.view_args or {}).get('user_id')
+    if user_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user_id = data.get('user_id') or data.get('from_user_id')
+    return str(user_id) if user_id else None
+
+
+def user_shard(view):
+    """Run a route on the shard of the user it acts for"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if shard_ring is None:
+            return view(*args, **kwargs)
+        user_id = request_user_id()
+        if user_id is None:
+            return view(*args, **kwargs)
+        with use_shard(shard_for(user_id)):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+# ============================================================================
+# SCATTER-GATHER
+# ============================================================================
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _scatter_pool():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(SHARD_SCATTER_WORKERS, thread_name_prefix='shard-scatter')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def scatter(fn, shards=None):
+    """Run ``fn()`` on each shard in parallel, each in its own app context
+    and session; returns {shard: result}.
+
+    Without sharding ``fn()`` runs once, inline, as {None: result}. ``fn``
+    must not call scatter itself.
+    """
+    if shard_ring is None:
+        return {None: fn()}
+    app = current_app._get_current_object()
+    names = list(shards or shard_ring.names)
+    timeout_ms = current_statement_timeout()
+
+    def run(name):
+        with app.app_context(), use_shard(name), statement_timeout(timeout_ms):
+            return fn()
+
+    return dict(zip(names, _scatter_pool().map(run, names)))
+
+
+# ============================================================================
+# CATALOG REPLICATION
+# ============================================================================
+
+def _upsert(conn, table, rows):
+    ids = [row['id'] for row in rows]
+    existing = set(conn.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+    columns = [column.name for column in table.c if column.name != 'id']
+    updates = [{f"b_{key}": value for key, value in row.items()} for row in rows if row['id'] in existing]
+    if updates:
+        conn.execute(
+            update(table).where(table.c.id == bindparam('b_id'))
+            .values({name: bindparam(f"b_{name}") for name in columns}),
+            updates
+        )
+    inserts = [row for row in rows if row['id'] not in existing]
+    if inserts:
+        conn.execute(insert(table), inserts)
+
+
+def replicate_products(product_ids=None):
+    """Copy virtual_products rows (all of them when product_ids is None)
+    from the default database to every shard; returns rows copied"""
+    if shard_ring is None:
+        return 0
+    table = VirtualProduct.__table__
+    stmt = select(table)
+    if product_ids is not None:
+        stmt = stmt.where(table.c.id.in_([str(product_id) for product_id in product_ids]))
+    with db.engine.connect() as conn:
+        rows = [dict(row) for row in conn.execute(stmt).mappings()]
+    if rows:
+        for engine in shard_engines().values():
+            with engine.begin() as conn:
+                _upsert(conn, table, rows)
+    return len(rows)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_catalog_changes(session, flush_context):
+    if shard_ring is None:
+        return
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, VirtualProduct):
+            session.info.setdefault('replicated_products', set()).add(str(obj.id))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _replicate_catalog_changes(session):
+    changed = session.info.pop('replicated_products', None)
+    if changed:
+        try:
+            replicate_products(changed)
+        except Exception:
+            # Repaired by the next write of the product or --sync-catalog
+            logger.exception("Catalog replication to shards failed")
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_catalog_changes(session):
+    session.info.pop('replicated_products', None)
+
+
+# ============================================================================
+# REBALANCING
+# ============================================================================
+
+def move_users(user_ids, source, target):
+    """Copy the users' rows from engine ``source`` to ``target``, then
+    delete them from ``source``. Re-running after a failure is safe: the
+    target's copy is replaced, and the source keeps its rows until the
+    copy has committed."""
+    with source.connect() as conn:
+        rows = {
+            table.name: [dict(row) for row in conn.execute(
+                select(table).where(table.c[column].in_(user_ids))
+            ).mappings()]
+            for table, column in USER_TABLES
+        }
+    with target.begin() as conn:
+        for table, column in reversed(USER_TABLES):
+            conn.execute(delete(table).where(table.c[column].in_(user_ids)))
+        for table, _ in USER_TABLES:
+            if rows[table.name]:
+                conn.execute(insert(table), rows[table.name])
+    with source.begin() as conn:
+        for table, column in reversed(USER_TABLES):
+            conn.execute(delete(table).where(table.c[column].in_(user_ids)))
+
+
+def rebalance(batch_size=SHARD_REBALANCE_BATCH, dry_run=False):
+    """Move every user not on its ring shard (including users still in the
+    default database) there; returns Counter({(source, target): users})"""
+    if shard_ring is None:
+        raise ValueError("SHARD_DATABASE_URLS is not set")
+    engines = shard_engines()
+    users = User.__table__
+    moved = Counter()
+    for source, engine in ((None, db.engine), *engines.items()):
+        last_id = None
+        while True:
+            page = select(users.c.id).order_by(users.c.id).limit(batch_size)
+            if last_id is not None:
+                page = page.where(users.c.id > last_id)
+            with engine.connect() as conn:
+                user_ids = [str(user_id) for user_id in conn.execute(page).scalars()]
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            for target, ids in group_by_shard(user_ids).items():
+                if target == source:
+                    continue
+                if not dry_run:
+                    move_users(ids, engine, engines[target])
+                moved[(source or 'default', target)] += len(ids)
+    return moved
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+    import sharding  # the copy app configured, not this __main__ one
+
+    parser = argparse.ArgumentParser(description="Maintain wallet shards")
+    parser.add_argument('--sync-catalog', action='store_true', help="Copy virtual_products to every shard")
+    parser.add_argument('--rebalance', action='store_true', help="Move users to the shard the ring assigns")
+    parser.add_argument('--dry-run', action='store_true', help="Count the users --rebalance would move")
+    parser.add_argument('--batch-size', type=int, default=SHARD_REBALANCE_BATCH)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not sharding.shards_enabled():
+            parser.error("SHARD_DATABASE_URLS is not set")
+        if args.sync_catalog or (args.rebalance and not args.dry_run):
+            print(f"✅ Copied {sharding.replicate_products():,} products to {len(sharding.shard_ring.names)} shards")
+        if args.rebalance:
+            moved = sharding.rebalance(args.batch_size, args.dry_run)
+            for (source, target), count in sorted(moved.items()):
+                print(f"{'Would move' if args.dry_run else 'Moved'} {count:,} users {source} -> {target}")
+            print(f"✅ {sum(moved.values()):,} users {'to move' if args.dry_run else 'moved'}")
@@ -0,0 +1,279 @@
+"""
+Daily wallet balance snapshots and point-in-time balances.
+
+``wallet_daily_snapshots`` holds each wallet's balances at the end of every
+UTC day on which it had ledger rows. A day's snapshot is the wallet's
+previous snapshot plus that day's ledger deltas (``balance_after -
+balance_before``), so it depends only on committed history and not on the
+live wallet row. Run this nightly, shortly after midnight UTC:
+
+    python snapshots.py                 # days since the last run, up to yesterday
+    python snapshots.py --backfill      # rebuild from the first ledger row
+
+A wallet's first snapshot is an opening one, the day before its first
+activity: the live balances minus every ledger delta. It carries balances
+that were set without a ledger row, such as init_db's ``testuser``.
+
+``balance_as_of`` starts from the latest snapshot that ends at or before the
+requested time and adds the ledger rows after it. With nightly snapshots
+that is at most about one day of rows, however old the account is. A
+wallet the job has not reached yet is walked back from its live balances.
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+import os
+
+from sqlalchemy import and_, delete, func, insert, select
+
+from models import db, UserWallet, WalletTransaction, WalletDailySnapshot
+from sharding import shard_names, use_shard
+
+SNAPSHOT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', '2000'))
+CURRENCIES = ('sf_coins', 'premium_gems', 'event_tokens')
+
+
+def day_end(day):
+    """First instant after ``day``; a snapshot covers ledger rows before it"""
+    return datetime.combine(day + timedelta(days=1), time.min)
+
+
+def _as_date(value):
+    # func.date() returns text on SQLite
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def parse_as_of(value):
+    """ISO-8601 timestamp or date (meaning the end of that day) as naive UTC;
+    raises ValueError"""
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), time.max)
+    as_of = datetime.fromisoformat(value)
+    if as_of.tzinfo is not None:
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    return as_of
+
+
+# ============================================================================
+# POINT-IN-TIME LOOKUP
+# ============================================================================
+
+def balance_as_of(user_id, as_of):
+    """Balances of a user's wallet just after ``as_of``, or None if the user
+    has no wallet or it was created after ``as_of``"""
+    wallet = db.session.execute(
+        select(UserWallet.id, UserWallet.created_at).where(UserWallet.user_id == str(user_id))
+    ).first()
+    if wallet is None or wallet.created_at is not None and wallet.created_at > as_of:
+        return None
+    wallet_id = wallet.id
+
+    snap = WalletDailySnapshot
+    snapshot = db.session.execute(
+        select(snap.day, snap.sf_coins, snap.premium_gems, snap.event_tokens)
+        .where(snap.wallet_id == wallet_id, snap.day <= (as_of - timedelta(days=1)).date())
+        .order_by(snap.day.desc())
+        .limit(1)
+    ).first()
+
+    tx = WalletTransaction
+    if snapshot is None:
+        return _walk_back(wallet_id, as_of)
+    balances = {currency: getattr(snapshot, currency) for currency in CURRENCIES}
+    rows = select(
+        tx.currency_type, func.sum(tx.balance_after - tx.balance_before), func.count()
+    ).where(tx.wallet_id == wallet_id, tx.created_at <= as_of, tx.created_at >= day_end(snapshot.day))
+
+    applied = 0
+    for currency, delta, count in db.session.execute(rows.group_by(tx.currency_type)):
+        balances[currency] += int(delta or 0)
+        applied += count
+
+    return {
+        **balances,
+        "as_of": as_of.isoformat(),
+        "snapshot_day": snapshot.day.isoformat() if snapshot is not None else None,
+        "ledger_rows_applied": applied
+    }
+
+
+def _walk_back(wallet_id, as_of):
+    """Live balances minus the ledger rows after ``as_of``, for a wallet
+    without a snapshot yet; one statement, so both sides are consistent"""
+    w, tx = UserWallet, WalletTransaction
+    later = lambda *where: select(*where).where(tx.wallet_id == wallet_id, tx.created_at > as_of)
+    delta = lambda currency: func.coalesce(func.sum(tx.balance_after - tx.balance_before), 0)
+    row = db.session.execute(
+        select(
+            *(func.coalesce(getattr(w, currency), 0)
+              - later(delta(currency)).where(tx.currency_type == currency).scalar_subquery()
+              for currency in CURRENCIES),
+            later(func.count()).scalar_subquery()
+        ).where(w.id == wallet_id)
+    ).first()
+    return {
+        **{currency: int(balance) for currency, balance in zip(CURRENCIES, row)},
+        "as_of": as_of.isoformat(),
+        "snapshot_day": None,
+        "ledger_rows_applied": row[-1]
+    }
+
+
+# ============================================================================
+# NIGHTLY SNAPSHOTS
+# ============================================================================
+
+def _latest_snapshots(conn, wallet_ids, before_day):
+    """{wallet_id: balances} of each wallet's last snapshot before ``before_day``"""
+    snap = WalletDailySnapshot.__table__
+    latest = (
+        select(snap.c.wallet_id, func.max(snap.c.day).label('day'))
+        .where(snap.c.wallet_id.in_(wallet_ids), snap.c.day < before_day)
+        .group_by(snap.c.wallet_id)
+        .subquery()
+    )
+    rows = conn.execute(
+        select(snap.c.wallet_id, *(snap.c[currency] for currency in CURRENCIES))
+        .join(latest, and_(snap.c.wallet_id == latest.c.wallet_id, snap.c.day == latest.c.day))
+    )
+    return {row[0]: dict(zip(CURRENCIES, row[1:])) for row in rows}
+
+
+def _opening_snapshots(conn, wallet_ids):
+    """{wallet_id: (day, balances)} before any ledger row: the live balances
+    minus every delta, dated the day before the wallet's first activity.
+    One statement, so both sides are consistent."""
+    w = UserWallet.__table__
+    tx = WalletTransaction.__table__
+    rows = conn.execute(
+        select(w.c.id, w.c.created_at, *(w.c[currency] for currency in CURRENCIES), tx.c.currency_type,
+               func.sum(tx.c.balance_after - tx.c.balance_before), func.min(tx.c.created_at))
+        .select_from(w.outerjoin(tx, tx.c.wallet_id == w.c.id))
+        .where(w.c.id.in_(wallet_ids))
+        .group_by(w.c.id, w.c.created_at, *(w.c[currency] for currency in CURRENCIES), tx.c.currency_type)
+    )
+    openings = {}
+    for wallet_id, created_at, *live, currency, delta, first_row in rows:
+        day, balances = openings.get(wallet_id, (None, {c: value or 0 for c, value in zip(CURRENCIES, live)}))
+        if currency is not None:
+            balances[currency] -= int(delta or 0)
+        for started in (created_at, first_row):
+            if started is not None:
+                started = _as_datetime(started).date() - timedelta(days=1)
+                day = started if day is None else min(day, started)
+        openings[wallet_id] = (day, balances)
+    return openings
+
+
+def _as_datetime(value):
+    # func.min() over a datetime column returns text on SQLite
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _snapshot_batch(conn, wallets, first_day, last_day):
+    """Write snapshots for [first_day, last_day] of ``wallets`` [(id, user_id)]; returns rows written"""
+    tx = WalletTransaction.__table__
+    wallet_ids = [wallet_id for wallet_id, _ in wallets]
+    bases = _latest_snapshots(conn, wallet_ids, first_day)
+
+    # Wallets with an earlier snapshot only need rows from first_day on:
+    # a day between it and first_day had no rows, or it would have one
+    delta = func.sum(tx.c.balance_after - tx.c.balance_before)
+    day = func.date(tx.c.created_at)
+    in_range = tx.c.created_at < day_end(last_day)
+    since_first = tx.c.created_at >= datetime.combine(first_day, time.min)
+    based = [wallet_id for wallet_id in wallet_ids if wallet_id in bases]
+    unbased = [wallet_id for wallet_id in wallet_ids if wallet_id not in bases]
+    deltas = []
+    for ids, bound in ((based, since_first), (unbased, None)):
+        if not ids:
+            continue
+        stmt = select(tx.c.wallet_id, day, tx.c.currency_type, delta).where(tx.c.wallet_id.in_(ids), in_range)
+        if bound is not None:
+            stmt = stmt.where(bound)
+        deltas.extend(conn.execute(stmt.group_by(tx.c.wallet_id, day, tx.c.currency_type)).all())
+
+    days = {}  # wallet_id -> {day: {currency: delta}}
+    for wallet_id, active_day, currency, amount in deltas:
+        days.setdefault(wallet_id, {}).setdefault(_as_date(active_day), {})[currency] = int(amount or 0)
+
+    user_ids = dict(wallets)
+    openings = _opening_snapshots(conn, unbased) if unbased else {}
+    rows = []
+    for wallet_id, (opening_day, balances) in openings.items():
+        # A later run writes it once the wallet's first activity is in range
+        if opening_day is not None and opening_day <= last_day:
+            rows.append({"wallet_id": wallet_id, "day": opening_day, "user_id": user_ids[wallet_id], **balances})
+    for wallet_id, active_days in days.items():
+        if wallet_id in bases:
+            balances = dict(bases[wallet_id])
+        else:
+            balances = dict(openings[wallet_id][1])
+        for active_day in sorted(active_days):
+            for currency, amount in active_days[active_day].items():
+                balances[currency] += amount
+            if active_day >= first_day:
+                rows.append({"wallet_id": wallet_id, "day": active_day, "user_id": user_ids[wallet_id], **balances})
+
+    snap = WalletDailySnapshot.__table__
+    conn.execute(delete(snap).where(
+        snap.c.wallet_id.in_(wallet_ids), snap.c.day >= first_day, snap.c.day <= last_day
+    ))
+    if rows:
+        conn.execute(insert(snap), rows)
+    return len(rows)
+
+
+def write_snapshots(first_day, last_day=None, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Write end-of-day snapshots for [first_day, last_day] on the session's
+    database (see ``use_shard``), batch_size wallets per transaction; safe
+    to re-run. Returns rows written."""
+    last_day = last_day or first_day
+    wallets = UserWallet.__table__
+    last_id, written = None, 0
+    while True:
+        with db.session.get_bind().begin() as conn:
+            page = select(wallets.c.id, wallets.c.user_id).order_by(wallets.c.id).limit(batch_size)
+            if last_id is not None:
+                page = page.where(wallets.c.id > last_id)
+            batch = [tuple(row) for row in conn.execute(page)]
+            if not batch:
+                return written
+            written += _snapshot_batch(conn, batch, first_day, last_day)
+        last_id = batch[-1][0]
+
+
+def first_ledger_day():
+    first = db.session.execute(select(func.min(WalletTransaction.created_at))).scalar()
+    return first.date() if first else None
+
+
+def next_snapshot_day():
+    """Day after the latest snapshot, so missed nights are caught up; the
+    first ledger day if there are none"""
+    latest = db.session.execute(select(func.max(WalletDailySnapshot.day))).scalar()
+    return latest + timedelta(days=1) if latest else first_ledger_day()
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Write daily wallet balance snapshots")
+    parser.add_argument('--from', dest='first', type=date.fromisoformat,
+                        help="First day (default: the day after the latest snapshot)")
+    parser.add_argument('--to', dest='last', type=date.fromisoformat, help="Last day (default: yesterday)")
+    parser.add_argument('--backfill', action='store_true', help="Rebuild from the first ledger row")
+    parser.add_argument('--batch-size', type=int, default=SNAPSHOT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with app.app_context():
+        for shard in shard_names():
+            with use_shard(shard):
+                label = f"[{shard}] " if shard else ""
+                last = args.last or datetime.utcnow().date() - timedelta(days=1)
+                first = args.first or (first_ledger_day() if args.backfill else next_snapshot_day())
+                if first is None or first > last:
+                    print(f"✅ {label}Snapshots are up to date")
+                else:
+                    written = write_snapshots(first, last, args.batch_size)
+                    print(f"✅ {label}Wrote {written:,} snapshots for {first.isoformat()} to {last.isoformat()}")
@@ -73,6 +73,11 @@ pip install -r requirements.txt
 
 # Run the application
 echo ""
-echo "Starting Flask server on port 5001..."
 echo "Database: MySQL"
-python app.py
+if [ "$FLASK_DEBUG" = "True" ]; then
+    echo "Starting Flask development server on port 5001..."
+    python app.py
+else
+    echo "Starting gunicorn on port 5001..."
+    python serve.py
+fi
@@ -0,0 +1,176 @@
+"""
+Wallet-to-wallet transfers.
+
+Every wallet taking part in a transfer (or a whole batch of transfers) is
+locked with ``SELECT ... FOR UPDATE`` in ascending wallet id order, so two
+transfers touching the same pair of wallets in opposite directions can never
+wait on each other in a cycle. Debit and credit ledger rows are written in
+the same commit as the balance changes. Deadlocks and lock wait timeouts
+that still surface (e.g. from gap locks or other writers) are retried a
+bounded number of times.
+"""
+
+import random
+import time
+
+from sqlalchemy.exc import DBAPIError
+
+from models import db, UserWallet, WalletTransaction
+
+TRANSFER_CURRENCIES = ('sf_coins', 'premium_gems', 'event_tokens')
+TRANSFER_MAX_RETRIES = 3
+TRANSFER_RETRY_BASE_DELAY = 0.01  # seconds, doubled per attempt
+
+# Driver error codes that mean "roll back and try again"
+MYSQL_RETRYABLE_ERRORS = (1205, 1213)  # lock wait timeout, deadlock
+POSTGRESQL_RETRYABLE_ERRORS = ('40001', '40P01')  # serialization failure, deadlock
+
+
+def is_retryable_error(exc):
+    """Whether a DB error is a transient lock conflict worth retrying"""
+    if not isinstance(exc, DBAPIError) or exc.orig is None:
+        return False
+    orig = exc.orig
+    if getattr(orig, 'pgcode', None) in POSTGRESQL_RETRYABLE_ERRORS:
+        return True
+    if orig.args and orig.args[0] in MYSQL_RETRYABLE_ERRORS:
+        return True
+    return 'database is locked' in str(orig)
+
+
+def with_deadlock_retry(fn, *args, max_retries=TRANSFER_MAX_RETRIES, **kwargs):
+    """Run ``fn`` in a fresh transaction, retrying transient lock conflicts.
+
+    Returns ``(result, attempts)``.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return fn(*args, **kwargs), attempt
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt > max_retries or not is_retryable_error(e):
+                raise
+            delay = TRANSFER_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            time.sleep(delay + random.uniform(0, delay))
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def validate_transfer(transfer):
+    """Normalise one transfer request; raises ValueError when invalid"""
+    from_user_id = transfer.get('from_user_id')
+    to_user_id = transfer.get('to_user_id')
+    currency_type = transfer.get('currency_type', 'sf_coins')
+    amount = transfer.get('amount')
+
+    if not from_user_id or not to_user_id:
+        raise ValueError("from_user_id and to_user_id are required")
+    if str(from_user_id) == str(to_user_id):
+        raise ValueError("Cannot transfer to the same wallet")
+    if currency_type not in TRANSFER_CURRENCIES:
+        raise ValueError(f"currency_type must be one of {', '.join(TRANSFER_CURRENCIES)}")
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        raise ValueError("amount must be a positive integer")
+
+    return {
+        "from_user_id": str(from_user_id),
+        "to_user_id": str(to_user_id),
+        "currency_type": currency_type,
+        "amount": amount,
+        "description": transfer.get('description')
+    }
+
+
+def lock_wallets(user_ids):
+    """Lock the wallets of ``user_ids`` in wallet id order; returns {user_id: wallet}.
+
+    Raises LookupError if any user has no wallet.
+    """
+    user_ids = set(user_ids)
+    by_user = UserWallet.lock_by_user_ids(user_ids)
+
+    missing = user_ids - by_user.keys()
+    if missing:
+        raise LookupError(f"Wallet not found for user(s): {', '.join(sorted(missing))}")
+    return by_user
+
+
+def _apply_transfer(wallets, transfer):
+    """Move funds between two locked wallets and stage both ledger rows"""
+    source = wallets[transfer['from_user_id']]
+    target = wallets[transfer['to_user_id']]
+    currency_type = transfer['currency_type']
+    amount = transfer['amount']
+
+    source_before = getattr(source, currency_type)
+    if source_before < amount:
+        raise ValueError(f"Insufficient {currency_type} in wallet of user {transfer['from_user_id']}")
+    target_before = getattr(target, currency_type)
+
+    setattr(source, currency_type, source_before - amount)
+    setattr(target, currency_type, target_before + amount)
+
+    debit = WalletTransaction(
+        wallet_id=source.id,
+        user_id=source.user_id,
+        transaction_type='transfer',
+        currency_type=currency_type,
+        amount=amount,
+        balance_before=source_before,
+        balance_after=source_before - amount,
+        reference_type='transfer_out',
+        description=transfer['description'] or f"Transfer to {target.user_id}"
+    )
+    credit = WalletTransaction(
+        wallet_id=target.id,
+        user_id=target.user_id,
+        transaction_type='transfer',
+        currency_type=currency_type,
+        amount=amount,
+        balance_before=target_before,
+        balance_after=target_before + amount,
+        reference_type='transfer_in',
+        description=transfer['description'] or f"Transfer from {source.user_id}"
+    )
+    db.session.add_all([debit, credit])
+    return debit, credit
+
+
+def _execute_transfers(transfers):
+    user_ids = {t['from_user_id'] for t in transfers} | {t['to_user_id'] for t in transfers}
+    wallets = lock_wallets(user_ids)
+
+    entries = [_apply_transfer(wallets, transfer) for transfer in transfers]
+    db.session.flush()
+    results = [
+        {
+            "from_user_id": transfer['from_user_id'],
+            "to_user_id": transfer['to_user_id'],
+            "currency_type": transfer['currency_type'],
+            "amount": transfer['amount'],
+            "debit_transaction_id": debit.id,
+            "credit_transaction_id": credit.id,
+            "from_balance": debit.balance_after,
+            "to_balance": credit.balance_after
+        } for transfer, (debit, credit) in zip(transfers, entries)
+    ]
+    db.session.commit()
+    return results
+
+
+def transfer_funds(transfer):
+    """Execute one validated transfer atomically; returns (result, attempts)"""
+    results, attempts = with_deadlock_retry(_execute_transfers, [transfer])
+    return results[0], attempts
+
+
+def bulk_transfer(transfers):
+    """Execute validated transfers all-or-nothing in one transaction.
+
+    All wallets involved are locked up front in id order, so a batch holds
+    each lock exactly once. Returns (results, attempts).
+    """
+    return with_deadlock_retry(_execute_transfers, transfers)
@@ -0,0 +1,182 @@
+"""
+Dialect-specific write paths.
+
+The portable ORM path for a new user costs a SELECT to rule out a
+duplicate, then a flush to get the user's key before the wallet can
+reference it. Here ids are generated up front and each backend gets its
+native statement:
+
+* PostgreSQL: one data-modifying CTE. ``INSERT ... ON CONFLICT DO NOTHING
+  RETURNING`` adds the user, and the wallet insert selects from it, so a
+  duplicate adds neither.
+* SQLite (3.35+): ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` for the
+  user, then the wallet.
+* MySQL: a plain insert, with a duplicate detected from the unique-key
+  error (1062) rather than a SELECT.
+
+``ensure_wallet`` is an idempotent upsert keyed on the unique
+``user_wallets.user_id``: ``ON DUPLICATE KEY UPDATE`` on MySQL and
+``ON CONFLICT DO NOTHING`` elsewhere.
+
+``reserve_stock`` takes a unit of a product with a conditional
+``UPDATE ... SET stock_quantity = stock_quantity - 1 WHERE stock_quantity > 0``
+on the default database, which owns the catalog, so concurrent buyers
+cannot oversell and shards' read copies are never written back.
+
+These are Core statements and bypass the ORM session events. After
+commit, callers report new wallets with ``note_new_wallets`` and stock
+changes with ``note_stock_changes``.
+"""
+
+import logging
+import uuid
+
+from sqlalchemy import insert, literal, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from invalidation import publish
+from models import db, User, UserWallet, VirtualProduct
+from replica import mark_user_write
+from sharding import replicate_products, shards_enabled
+import catalog_index
+import leaderboard
+
+logger = logging.getLogger(__name__)
+
+MYSQL_DUPLICATE_KEY = 1062
+
+INSERTS = {
+    'mysql': mysql.insert,
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+EMPTY_BALANCES = {"sf_coins": 0, "premium_gems": 0, "event_tokens": 0}
+
+
+def dialect_insert(connection, table):
+    """The backend's INSERT construct, with its upsert clauses"""
+    return INSERTS[connection.dialect.name](table)
+
+
+def _with_defaults(table, values):
+    """``values`` plus the Python-side default of every other column.
+
+    Defaults the statement would otherwise prefetch are bound under the
+    column's name, which collides when two tables in one statement share
+    a defaulted column (created_at, updated_at)."""
+    values = dict(values)
+    for column in table.columns:
+        if column.key not in values and column.default is not None and not column.default.is_sequence:
+            default = column.default
+            values[column.key] = default.arg(None) if default.is_callable else default.arg
+    return values
+
+
+def create_user_with_wallet(session, username, email, user_id=None):
+    """Insert a user and an empty wallet; returns the user id, or None if the
+    username or email is taken. Pass ``user_id`` when it must be known up
+    front (e.g. to pick the user's shard)."""
+    users, wallets = User.__table__, UserWallet.__table__
+    user_id, wallet_id = str(user_id or uuid.uuid4()), str(uuid.uuid4())
+    user_values = {"id": user_id, "username": username, "email": email}
+    wallet_values = {"id": wallet_id, "user_id": user_id, **EMPTY_BALANCES}
+    conn = session.connection()
+    dialect = conn.dialect.name
+
+    if dialect == 'postgresql':
+        new_user = (
+            postgresql.insert(users).values(_with_defaults(users, user_values)).on_conflict_do_nothing()
+            .returning(users.c.id).cte('new_user')
+        )
+        wallet_row = _with_defaults(wallets, wallet_values)
+        del wallet_row['user_id']
+        stmt = insert(wallets).from_select(
+            ['user_id', *wallet_row],
+            select(new_user.c.id, *(literal(value, wallets.c[key].type) for key, value in wallet_row.items()))
+        ).returning(wallets.c.user_id)
+        return conn.execute(stmt).scalar()
+
+    if dialect == 'sqlite':
+        stmt = sqlite.insert(users).values(user_values).on_conflict_do_nothing().returning(users.c.id)
+        if conn.execute(stmt).scalar() is None:
+            return None
+    else:
+        try:
+            conn.execute(insert(users).values(user_values))
+        except IntegrityError as e:
+            if getattr(e.orig, 'args', (None,))[0] == MYSQL_DUPLICATE_KEY:
+                return None
+            raise
+    conn.execute(insert(wallets).values(wallet_values))
+    return user_id
+
+
+def ensure_wallet(session, user_id, **defaults):
+    """Create user_id's wallet unless one exists; safe for concurrent callers"""
+    conn = session.connection()
+    stmt = dialect_insert(conn, UserWallet.__table__).values(
+        id=str(uuid.uuid4()), user_id=str(user_id), **{**EMPTY_BALANCES, **defaults}
+    )
+    if conn.dialect.name == 'mysql':
+        stmt = stmt.on_duplicate_key_update(user_id=stmt.inserted.user_id)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['user_id'])
+    conn.execute(stmt)
+
+
+def note_new_wallets(user_ids):
+    """Report committed empty wallets to the read-your-writes markers and
+    the leaderboard"""
+    for user_id in user_ids:
+        mark_user_write(user_id)
+        if leaderboard.leaderboard is not None:
+            leaderboard.leaderboard.update(str(user_id), dict.fromkeys(leaderboard.leaderboard.metrics, 0))
+
+
+def reserve_stock(session, product_id):
+    """Take one unit of a product's stock; False when it is sold out.
+
+    Unsharded, the decrement joins the session's transaction. Sharded, it
+    commits on the default database before the purchase commits on the
+    user's shard, and the caller gives the unit back with ``release_stock``
+    if that commit fails."""
+    products = VirtualProduct.__table__
+    stmt = (
+        update(products)
+        .where(products.c.id == str(product_id), products.c.stock_quantity > 0)
+        .values(stock_quantity=products.c.stock_quantity - 1)
+    )
+    if not shards_enabled():
+        return session.connection().execute(stmt).rowcount == 1
+    with db.engine.begin() as conn:
+        return conn.execute(stmt).rowcount == 1
+
+
+def release_stock(product_id):
+    """Give back a unit taken by ``reserve_stock`` on a sharded deployment"""
+    products = VirtualProduct.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(products)
+                .where(products.c.id == str(product_id), products.c.stock_quantity.is_not(None))
+                .values(stock_quantity=products.c.stock_quantity + 1)
+            )
+    except Exception:
+        logger.exception("Could not give back a unit of product %s", product_id)
+
+
+def note_stock_changes(product_ids):
+    """Report committed stock changes to the shards' catalog copies, this
+    worker's catalog index and the other workers'"""
+    product_ids = [str(product_id) for product_id in product_ids]
+    try:
+        replicate_products(product_ids)
+    except Exception:
+        # Repaired by the next write of the product or --sync-catalog
+        logger.exception("Catalog replication to shards failed")
+    if catalog_index.catalog_search is not None:
+        catalog_index.catalog_search.refresh(product_ids)
+        publish('catalog', product_ids)
@@ -0,0 +1,263 @@
+"""
+Server-side XP, levels and leagues.
+
+Every ledger row records the XP it granted in ``xp_amount``, and
+``users.xp`` holds each user's running total. New ``WalletTransaction``
+rows get ``xp_amount`` from ``XP_PER_COIN_EARNED`` / ``XP_PER_COIN_SPENT``
+unless the writer set it. At flush, each user's new XP is added to
+``users.xp`` and ``users.level`` is raised to match, in the same
+transaction. Writers that insert ledger rows with Core statements must
+call ``apply_xp`` themselves.
+
+Level n starts at ``XP_LEVEL_BASE * (n - 1) ** 2`` XP, up to
+``XP_MAX_LEVEL``. The leagues mirror ``LEAGUE_CONFIG`` in the frontend.
+Both threshold tables are built once per process and resolved with a
+bisect. Levels only go up through accrual, so levels set by hand are kept.
+
+Recompute the totals from the ledger with:
+    python xp.py --recompute
+"""
+
+from bisect import bisect_right
+from collections import defaultdict
+import os
+
+from sqlalchemy import bindparam, event, func, select, update
+
+from invalidation import publish
+from models import db, User, UserWallet, WalletTransaction
+from models.routing_session import RoutingSession
+import eligibility
+from replica import note_user_writes
+from sharding import shard_names, use_shard
+
+XP_LEVEL_BASE = int(os.getenv('XP_LEVEL_BASE', '100'))
+XP_MAX_LEVEL = int(os.getenv('XP_MAX_LEVEL', '100'))
+XP_PER_COIN_EARNED = float(os.getenv('XP_PER_COIN_EARNED', '1'))
+XP_PER_COIN_SPENT = float(os.getenv('XP_PER_COIN_SPENT', '0.1'))
+XP_RECOMPUTE_BATCH = int(os.getenv('XP_RECOMPUTE_BATCH', '5000'))
+MAX_XP_GRANTS = 5000
+
+LEAGUES = (
+    ('Bronze', 0),
+    ('Silver', 2500),
+    ('Gold', 7500),
+    ('Platinum', 15000),
+    ('Diamond', 30000),
+    ('Challenger', 50000),
+)
+
+XP_RATES = {
+    'earn': XP_PER_COIN_EARNED,
+    'bonus': XP_PER_COIN_EARNED,
+    'purchase': XP_PER_COIN_SPENT,
+    'spend': XP_PER_COIN_SPENT,
+}
+
+# Minimum XP of each level (index 0 is level 1) and of each league
+LEVEL_THRESHOLDS = tuple(XP_LEVEL_BASE * (level - 1) ** 2 for level in range(1, XP_MAX_LEVEL + 1))
+LEAGUE_THRESHOLDS = tuple(min_xp for _, min_xp in LEAGUES)
+
+
+def xp_for(transaction_type, amount):
+    """XP a ledger row of this type and amount grants"""
+    return int((amount or 0) * XP_RATES.get(transaction_type, 0))
+
+
+def level_for(xp):
+    return bisect_right(LEVEL_THRESHOLDS, max(xp or 0, 0))
+
+
+def progress(xp, level=None):
+    """Level and league standing of an XP total; ``level`` is a stored level
+    that may be ahead of the XP"""
+    xp = max(xp or 0, 0)
+    level = min(max(level_for(xp), level or 1), XP_MAX_LEVEL)
+    league = bisect_right(LEAGUE_THRESHOLDS, xp) - 1
+    name, league_xp = LEAGUES[league]
+    next_league = LEAGUES[league + 1] if league + 1 < len(LEAGUES) else None
+    return {
+        "xp": xp,
+        "level": level,
+        "next_level_xp": LEVEL_THRESHOLDS[level] if level < XP_MAX_LEVEL else None,
+        "league": name,
+        "league_xp": league_xp,
+        "next_league": next_league[0] if next_league else None,
+        "next_league_xp": next_league[1] if next_league else None,
+        "league_progress": round((xp - league_xp) / (next_league[1] - league_xp) * 100, 1) if next_league else 100.0
+    }
+
+
+# ============================================================================
+# ACCRUAL
+# ============================================================================
+
+def _raise_levels(connection, ids):
+    """Bring users.level up to users.xp; returns the ids changed"""
+    users = User.__table__
+    rows = connection.execute(
+        select(users.c.id, users.c.xp, users.c.level).where(users.c.id.in_(ids))
+    ).all()
+    changes = []
+    for user_id, xp, level in rows:
+        target = max(level or 1, level_for(xp))
+        if target != level:
+            changes.append({"b_id": user_id, "b_level": target})
+    if changes:
+        connection.execute(
+            update(users).where(users.c.id == bindparam('b_id')).values(level=bindparam('b_level')),
+            changes
+        )
+    return [change["b_id"] for change in changes]
+
+
+def apply_xp(connection, deltas):
+    """Add {user_id: xp} to users.xp on ``connection`` and raise levels to
+    match; returns the ids whose level changed"""
+    deltas = {str(user_id): xp for user_id, xp in deltas.items() if xp}
+    if not deltas:
+        return []
+    users = User.__table__
+    connection.execute(
+        update(users).where(users.c.id == bindparam('b_id'))
+        .values(xp=func.coalesce(users.c.xp, 0) + bindparam('b_xp')),
+        [{"b_id": user_id, "b_xp": xp} for user_id, xp in deltas.items()]
+    )
+    return _raise_levels(connection, list(deltas))
+
+
+def validate_grants(grants):
+    """Normalise [{"user_id", "xp"}, ...] to {user_id: xp}; raises ValueError"""
+    totals = defaultdict(int)
+    for grant in grants:
+        user_id, xp = grant.get('user_id'), grant.get('xp')
+        if not user_id:
+            raise ValueError("user_id is required")
+        if not isinstance(xp, int) or isinstance(xp, bool) or xp <= 0:
+            raise ValueError("xp must be a positive integer")
+        totals[str(user_id)] += xp
+    return dict(totals)
+
+
+def grant_xp(session, grants, reason=None):
+    """Add one zero-amount bonus ledger row per user carrying its XP grant.
+
+    The rows accrue like any other at flush; the caller commits. Returns
+    the user ids that have no wallet and were skipped.
+    """
+    wallets = session.execute(
+        select(UserWallet.id, UserWallet.user_id, UserWallet.sf_coins)
+        .where(UserWallet.user_id.in_(list(grants)))
+    ).all()
+    found = set()
+    for wallet_id, user_id, balance in wallets:
+        found.add(str(user_id))
+        session.add(WalletTransaction(
+            wallet_id=wallet_id,
+            user_id=user_id,
+            transaction_type='bonus',
+            currency_type='sf_coins',
+            amount=0,
+            balance_before=balance,
+            balance_after=balance,
+            xp_amount=grants[str(user_id)],
+            reference_type='xp_grant',
+            description=reason or "XP grant"
+        ))
+    return [user_id for user_id in grants if user_id not in found]
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _assign_xp(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, WalletTransaction) and obj.xp_amount is None:
+            obj.xp_amount = xp_for(obj.transaction_type, obj.amount)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _accrue_xp(session, flush_context):
+    deltas = defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, WalletTransaction) and obj.xp_amount:
+            deltas[str(obj.user_id)] += obj.xp_amount
+    if deltas:
+        note_user_writes(session, deltas)
+        changed = apply_xp(session.connection(), deltas)
+        if changed:
+            session.info.setdefault('xp_level_changes', set()).update(changed)
+            # The Core UPDATE bypasses eligibility's own after_flush hook
+            publish('eligibility', changed, session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_level_changes(session):
+    changed = session.info.pop('xp_level_changes', None)
+    if changed and eligibility.eligible_catalog is not None:
+        eligibility.eligible_catalog.invalidate(changed)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_level_changes(session):
+    session.info.pop('xp_level_changes', None)
+
+
+# ============================================================================
+# RECOMPUTE
+# ============================================================================
+
+def recompute_xp(batch_size=XP_RECOMPUTE_BATCH, reset_levels=False):
+    """Recompute users.xp from the ledger, batch_size users per transaction.
+
+    Only users whose total or level differs are written, on the session's
+    database (see ``use_shard``). Returns (users recomputed, users changed).
+    """
+    users, tx = User.__table__, WalletTransaction.__table__
+    last_id, total, changed = None, 0, 0
+    while True:
+        with db.session.get_bind().begin() as conn:
+            page = select(users.c.id, users.c.xp, users.c.level).order_by(users.c.id).limit(batch_size)
+            if last_id is not None:
+                page = page.where(users.c.id > last_id)
+            rows = conn.execute(page).all()
+            if not rows:
+                return total, changed
+            ledger_xp = dict(conn.execute(
+                select(tx.c.user_id, func.sum(tx.c.xp_amount))
+                .where(tx.c.user_id.in_([row.id for row in rows]))
+                .group_by(tx.c.user_id)
+            ).all())
+            updates = []
+            for user_id, xp, level in rows:
+                new_xp = int(ledger_xp.get(user_id) or 0)
+                new_level = level_for(new_xp) if reset_levels else max(level or 1, level_for(new_xp))
+                if (new_xp, new_level) != (xp, level):
+                    updates.append({"b_id": user_id, "b_xp": new_xp, "b_level": new_level})
+            if updates:
+                conn.execute(
+                    update(users).where(users.c.id == bindparam('b_id'))
+                    .values(xp=bindparam('b_xp'), level=bindparam('b_level')),
+                    updates
+                )
+        total += len(rows)
+        changed += len(updates)
+        last_id = rows[-1].id
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Maintain user XP totals")
+    parser.add_argument('--recompute', action='store_true', help="Recompute users.xp from the ledger")
+    parser.add_argument('--reset-levels', action='store_true',
+                        help="Set levels exactly from XP, lowering levels set by hand")
+    parser.add_argument('--batch-size', type=int, default=XP_RECOMPUTE_BATCH)
+    args = parser.parse_args()
+    if args.recompute:
+        total, changed = 0, 0
+        with app.app_context():
+            for shard in shard_names():
+                with use_shard(shard):
+                    shard_total, shard_changed = recompute_xp(args.batch_size, args.reset_levels)
+                total, changed = total + shard_total, changed + shard_changed
+        print(f"✅ Recomputed XP for {total:,} users ({changed:,} changed)")